@@ -0,0 +1,102 @@
+import argparse
+import json as python_json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from bench.stubs import discord_server, image_server, s3_server
+from migrations.runner import connect_to_database, run_migrations
+
+LEAF_TASKS = ("update_database_with_image", "update_interaction_with_image", "update_database_with_message_id")
+PIPELINES = ("canvas", "lean")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts broker messages and end-to-end latency of the add-death pipelines.")
+    parser.add_argument("--deaths", type=int, default=50)
+    parser.add_argument("--image-bytes", type=int, default=512 * 1024)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with image_server() as images, s3_server() as s3, discord_server() as discord, tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        connection = connect_to_database(database_path)
+        run_migrations(connection)
+        connection.close()
+
+        os.environ.update({
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            "S3_BUCKET": "rip-bot-bench",
+            "S3_ENDPOINT_URL": s3.url,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "ca-central-1",
+            "DISCORD_API_BASE": discord.url,
+            "DISCORD_BOT_APPLICATION_ID": "bench",
+            "AUTHORIZATION": "Bot bench",
+            "IMAGE_SPOOL_DIR": directory,
+        })
+
+        from celery.contrib.testing.worker import start_worker
+        from celery.signals import before_task_publish, task_postrun
+
+        import interactions.app as interactions_app
+        import tasks.tasks as app_tasks
+
+        published = Counter()
+        finished_leaves = Counter()
+        finished = threading.Condition()
+
+        @before_task_publish.connect(weak=False)
+        def count_publish(sender=None, **kwargs):
+            published[sender] += 1
+
+        @task_postrun.connect(weak=False)
+        def count_leaf(task=None, args=(), **kwargs):
+            if task.name.rsplit(".", 1)[-1] in LEAF_TASKS:
+                with finished:
+                    finished_leaves[args[0]["interaction_token"]] += 1
+                    finished.notify_all()
+
+        # the in-memory transport polls once a second by default, which would swamp the differences
+        app_tasks.app.conf.broker_transport_options = {"polling_interval": 0.005}
+
+        results = {}
+        with start_worker(app_tasks.app, pool="threads", concurrency=args.concurrency, perform_ping_check=False):
+            for pipeline in PIPELINES:
+                interactions_app.ADD_DEATH_PIPELINE = pipeline
+                published.clear()
+                latencies = []
+
+                for i in range(args.deaths):
+                    token = f"{pipeline}-{i}"
+                    death = ("guild", "channel", None, "victim", "caption", "{}", f"{images.url}/{args.image_bytes}/{i}.png", int(time.time()), "reporter")
+
+                    began = time.perf_counter()
+                    interactions_app.build_add_death_pipeline(death, death[6], token, "guild").delay()
+                    with finished:
+                        finished.wait_for(lambda: finished_leaves[token] == len(LEAF_TASKS), timeout=30)
+                    latencies.append(time.perf_counter() - began)
+
+                results[pipeline] = {
+                    "broker_messages_per_death": sum(published.values()) / args.deaths,
+                    "messages_by_task": {name: count / args.deaths for name, count in published.items()},
+                    "end_to_end_p50_ms": statistics.median(latencies) * 1000,
+                    "end_to_end_max_ms": max(latencies) * 1000,
+                }
+
+    print(python_json.dumps({
+        "benchmark": "add_death_pipeline",
+        "deaths": args.deaths,
+        "image_bytes": args.image_bytes,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import itertools
+import json as python_json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from bench.generate import generate_deaths
+from db.db import SELECT_DEADPERSON_COUNT_BY_TIME_SQL, SECONDS_PER_DAY, decompress_attachment
+from migrations.runner import connect_to_database, run_migrations
+
+# the last version that kept the attachment JSON in deaths
+BEFORE_SPLIT_VERSION = 6
+LEGACY_INSERT_DEATH_SQL = """INSERT INTO deaths VALUES (:server, :channel_id, :message_id, :dead_person, :caption, :attachment, :image_url, :timestamp, :reporter)"""
+# every row of deaths, the way a tally has to read them when there's no rollup to answer from.
+# the GROUP BY one also pays for sorting, the filtered one is mostly reading pages
+FULL_SCAN_TALLY_SQL = """SELECT server, dead_person, COUNT(*) FROM deaths NOT INDEXED GROUP BY server, dead_person"""
+FULL_SCAN_VICTIM_SQL = """SELECT server, COUNT(*) FROM deaths NOT INDEXED WHERE dead_person = 'victim0' GROUP BY server"""
+# what get_death_db reads for the death it picked, before and after the split
+SELECT_INLINE_ATTACHMENT_SQL = """SELECT caption, attachment FROM deaths WHERE rowid = ?"""
+SELECT_SPLIT_ATTACHMENT_SQL = """SELECT caption, death_attachments.attachment FROM deaths LEFT JOIN death_attachments ON death_attachments.death_rowid = deaths.rowid WHERE deaths.rowid = ?"""
+SELECT_TABLE_BYTES_SQL = """SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ('deaths', 'death_attachments') GROUP BY name"""
+
+
+def create_database(path: str, guilds: int, victims: int, deaths: int, days: int, attachment_bytes: int, seed: int) -> float:
+    connection = connect_to_database(path)
+    # raw rows first so the aggregate migrations backfill them in one pass
+    run_migrations(connection, target=2)
+    end_time = time.time()
+    rows = generate_deaths(guilds, victims, deaths, days, attachment_bytes, 1.1, 1.0, end_time, seed)
+    connection.execute("BEGIN")
+    while True:
+        batch = list(itertools.islice(rows, 10000))
+        if not batch:
+            break
+        connection.executemany(LEGACY_INSERT_DEATH_SQL, batch)
+    connection.execute("COMMIT")
+    run_migrations(connection, target=BEFORE_SPLIT_VERSION)
+    # no VACUUM, death_ordinals is keyed on the implicit rowids it may renumber
+    connection.execute("ANALYZE")
+    connection.close()
+
+    return end_time
+
+
+def time_calls(call: Callable, arguments: List, repeat: int) -> Dict:
+    durations = []
+    for i in range(repeat):
+        began = time.perf_counter()
+        call(*arguments[i % len(arguments)])
+        durations.append(time.perf_counter() - began)
+
+    return {
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": statistics.median(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def measure(path: str, guilds: int, deaths: int, end_time: float, repeat: int, split: bool) -> Dict:
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    table_bytes = dict(cursor.execute(SELECT_TABLE_BYTES_SQL).fetchall())
+
+    rng = random.Random(0)
+    # a year of raw rows for a busy guild, the slow path the rollup exists to avoid
+    windows = [
+        {"guild_id": f"guild{rng.randrange(min(guilds, 3))}", "start_time": int(end_time) - 365 * SECONDS_PER_DAY, "end_time": int(end_time), "limit": 50}
+        for _ in range(repeat)
+    ]
+    rowids = [(rng.randrange(1, deaths + 1),) for _ in range(repeat * 100)]
+
+    def load_attachment(rowid: int):
+        if split:
+            caption, attachment = cursor.execute(SELECT_SPLIT_ATTACHMENT_SQL, (rowid,)).fetchone()
+            return caption, decompress_attachment(attachment)
+        return cursor.execute(SELECT_INLINE_ATTACHMENT_SQL, (rowid,)).fetchone()
+
+    results = {
+        "file_bytes": os.path.getsize(path),
+        "deaths_bytes": table_bytes.get("deaths", 0),
+        "death_attachments_bytes": table_bytes.get("death_attachments", 0),
+        "full_scan_tally": time_calls(lambda: cursor.execute(FULL_SCAN_TALLY_SQL).fetchall(), [()], repeat),
+        "full_scan_victim": time_calls(lambda: cursor.execute(FULL_SCAN_VICTIM_SQL).fetchall(), [()], repeat),
+        "raw_ranged_tally": time_calls(lambda window: cursor.execute(SELECT_DEADPERSON_COUNT_BY_TIME_SQL, window).fetchall(), [(window,) for window in windows], repeat),
+        "attachment_lookup": time_calls(load_attachment, rowids, len(rowids)),
+    }
+    connection.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures database size and scan speed before and after moving attachment JSON out of deaths.")
+    parser.add_argument("--deaths", type=int, default=500000)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=200)
+    parser.add_argument("--days", type=int, default=3 * 365)
+    parser.add_argument("--attachment-bytes", type=int, default=450)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "deaths.db")
+        end_time = create_database(path, args.guilds, args.victims, args.deaths, args.days, args.attachment_bytes, args.seed)
+        before = measure(path, args.guilds, args.deaths, end_time, args.repeat, split=False)
+
+        connection = connect_to_database(path)
+        began = time.perf_counter()
+        run_migrations(connection)
+        migrate_seconds = time.perf_counter() - began
+        connection.execute("ANALYZE")
+        connection.close()
+        after = measure(path, args.guilds, args.deaths, end_time, args.repeat, split=True)
+
+    print(python_json.dumps({
+        "benchmark": "attachment_split",
+        "deaths": args.deaths,
+        "attachment_bytes": args.attachment_bytes,
+        "migrate_seconds": migrate_seconds,
+        "before": before,
+        "after": after,
+        "file_bytes_saved": before["file_bytes"] - after["file_bytes"],
+        "full_scan_tally_speedup": before["full_scan_tally"]["mean_ms"] / after["full_scan_tally"]["mean_ms"],
+        "full_scan_victim_speedup": before["full_scan_victim"]["mean_ms"] / after["full_scan_victim"]["mean_ms"],
+        "raw_ranged_tally_speedup": before["raw_ranged_tally"]["mean_ms"] / after["raw_ranged_tally"]["mean_ms"],
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
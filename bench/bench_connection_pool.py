@@ -0,0 +1,134 @@
+import argparse
+import json as python_json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+
+from db.db import connect_to_database, pooled_cursor, get_tally_db, get_death_db, get_death_by_message_id_db
+from migrations.runner import run_migrations
+
+
+def create_database(path: str, guilds: int, victims: int, deaths: int):
+    conn = sqlite3.connect(path)
+    # the rows go in with the original layout, the later migrations move and aggregate them
+    run_migrations(conn, target=2)
+    rows = (
+        (
+            f"guild{random.randrange(guilds)}",
+            "channel",
+            f"message{i}",
+            f"victim{random.randrange(victims)}",
+            "caption",
+            python_json.dumps({"url": f"https://cdn.discordapp.com/attachments/{i}.png"}),
+            f"https://example.com/{i}.png",
+            1600000000 + i,
+            "reporter",
+        )
+        for i in range(deaths)
+    )
+    conn.executemany("INSERT INTO deaths VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    run_migrations(conn)
+    conn.close()
+
+
+def run_request(cursor: sqlite3.Cursor, guilds: int, victims: int, deaths: int):
+    # same mix the slash commands produce: mostly tallies and random deaths, some removals
+    roll = random.random()
+    if roll < 0.4:
+        get_tally_db(cursor, f"guild{random.randrange(guilds)}")
+    elif roll < 0.8:
+        get_death_db(cursor, f"guild{random.randrange(guilds)}", f"victim{random.randrange(victims)}")
+    else:
+        get_death_by_message_id_db(cursor, f"message{random.randrange(deaths)}")
+
+
+def connect_per_call(path: str, *args):
+    conn = connect_to_database(path)
+    cursor = conn.cursor()
+    run_request(cursor, *args)
+    conn.close()
+
+
+def pooled(path: str, *args):
+    with pooled_cursor(path) as cursor:
+        run_request(cursor, *args)
+
+
+MODES: Dict[str, Callable] = {
+    "connect_per_call": connect_per_call,
+    "pooled": pooled,
+}
+
+
+def worker(mode: str, path: str, threads: int, duration: float, shape: tuple, counts):
+    # one gunicorn worker: a process with a number of request threads (the gthread worker class)
+    request_fn = MODES[mode]
+    deadline = time.monotonic() + duration
+    totals = [0] * threads
+
+    def serve(index: int):
+        while time.monotonic() < deadline:
+            request_fn(path, *shape)
+            totals[index] += 1
+
+    request_threads = [threading.Thread(target=serve, args=(i,)) for i in range(threads)]
+    for thread in request_threads:
+        thread.start()
+    for thread in request_threads:
+        thread.join()
+
+    counts.put(sum(totals))
+
+
+def run_mode(mode: str, path: str, workers: int, threads: int, duration: float, shape: tuple) -> float:
+    counts = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(mode, path, threads, duration, shape, counts))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(counts.get() for _ in processes)
+    for process in processes:
+        process.join()
+
+    return total / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares requests per second for connect-per-call and pooled SQLite connections.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=50)
+    parser.add_argument("--deaths", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "deaths.db")
+        create_database(path, args.guilds, args.victims, args.deaths)
+        shape = (args.guilds, args.victims, args.deaths)
+
+        results = {
+            mode: run_mode(mode, path, args.workers, args.threads, args.duration, shape)
+            for mode in MODES
+        }
+
+    print(python_json.dumps({
+        "benchmark": "connection_pool",
+        "workers": args.workers,
+        "threads": args.threads,
+        "deaths": args.deaths,
+        "requests_per_second": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
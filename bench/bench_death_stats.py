@@ -0,0 +1,90 @@
+import argparse
+import json as python_json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from bench.generate import generate_database
+from db.db import get_current_gaps_db, get_longest_gaps_db, get_reporter_tally_db, get_week_tallies_db, week_of
+
+STATS_LIMIT = 10
+WEEKS = 12
+
+# the same answers computed from deaths, what each stat would cost without its aggregate
+RAW_REPORTER_TALLY_SQL = """SELECT reporter, COUNT(*) AS count FROM deaths WHERE server = :guild_id GROUP BY reporter ORDER BY count DESC, reporter LIMIT :limit"""
+RAW_WEEK_TALLIES_SQL = """SELECT (CAST(timestamp AS INTEGER) / 86400 + 3) / 7 AS week, COUNT(*) FROM deaths
+    WHERE server = :guild_id AND timestamp >= :start_time GROUP BY week"""
+RAW_LONGEST_GAPS_SQL = """SELECT dead_person, MAX(gap) AS longest_gap FROM (
+    SELECT dead_person, timestamp - LAG(timestamp) OVER (PARTITION BY dead_person ORDER BY timestamp) AS gap FROM deaths WHERE server = :guild_id
+) GROUP BY dead_person HAVING longest_gap IS NOT NULL ORDER BY longest_gap DESC, dead_person LIMIT :limit"""
+RAW_CURRENT_GAPS_SQL = """SELECT dead_person, MAX(timestamp) AS last_timestamp FROM deaths WHERE server = :guild_id
+    GROUP BY dead_person ORDER BY last_timestamp, dead_person LIMIT :limit"""
+
+
+def time_calls(call: Callable, guilds: List[str]) -> Dict:
+    durations = []
+    for guild_id in guilds:
+        began = time.perf_counter()
+        call(guild_id)
+        durations.append(time.perf_counter() - began)
+
+    return {
+        "p50_ms": statistics.median(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the /death-stats queries, from the aggregates and from raw deaths, as the table grows.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, f"deaths-{size}.db")
+            end_time = time.time()
+            generate_database(path, args.guilds, args.victims, size, attachment_bytes=0, end_time=end_time)
+            cursor = sqlite3.connect(path).cursor()
+
+            # mostly the busiest guild, whose stats are the most expensive to compute
+            guilds = ["guild0" if i % 2 == 0 else f"guild{random.randrange(args.guilds)}" for i in range(args.queries)]
+            last_week = week_of(end_time)
+            parameters = lambda guild_id: {"guild_id": guild_id, "limit": STATS_LIMIT, "start_time": int(end_time) - WEEKS * 7 * 86400}
+
+            results[size] = {
+                "aggregates": {
+                    "top-reporters": time_calls(lambda guild_id: get_reporter_tally_db(cursor, guild_id, STATS_LIMIT), guilds),
+                    "deaths-per-week": time_calls(lambda guild_id: get_week_tallies_db(cursor, guild_id, last_week - WEEKS + 1, last_week), guilds),
+                    "longest-gaps": time_calls(lambda guild_id: get_longest_gaps_db(cursor, guild_id, STATS_LIMIT), guilds),
+                    "current-gaps": time_calls(lambda guild_id: get_current_gaps_db(cursor, guild_id, STATS_LIMIT), guilds),
+                },
+                "raw": {
+                    name: time_calls(lambda guild_id: cursor.execute(sql, parameters(guild_id)).fetchall(), guilds)
+                    for name, sql in (
+                        ("top-reporters", RAW_REPORTER_TALLY_SQL),
+                        ("deaths-per-week", RAW_WEEK_TALLIES_SQL),
+                        ("longest-gaps", RAW_LONGEST_GAPS_SQL),
+                        ("current-gaps", RAW_CURRENT_GAPS_SQL),
+                    )
+                },
+            }
+            cursor.connection.close()
+
+    print(python_json.dumps({
+        "benchmark": "death_stats",
+        "guilds": args.guilds,
+        "victims": args.victims,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json as python_json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.stubs import discord_server
+from tasks.discord import DiscordClient, RateLimited
+
+ROUTE = "/webhooks/{application_id}/{interaction_token}/messages/@original"
+
+
+def bare_requests_patch(base_url: str, interaction_token: str) -> int:
+    # what the tasks did before: a new connection per call and a fixed 5 second retry on errors
+    while True:
+        response = requests.patch(
+            f"{base_url}/webhooks/bench/{interaction_token}/messages/@original",
+            json={"content": "rip"},
+            headers={"Authorization": "Bot bench"},
+        )
+        if response.status_code != 429:
+            response.raise_for_status()
+            return 0
+        time.sleep(5)
+
+
+def client_patch(client: DiscordClient, interaction_token: str):
+    # what the tasks do now: retry exactly when the bucket resets, like the Celery countdown
+    while True:
+        try:
+            client.request("PATCH", ROUTE, application_id="bench", interaction_token=interaction_token, json={"content": "rip"})
+            return
+        except RateLimited as e:
+            time.sleep(e.retry_after)
+
+
+def run(patch, requests_count: int, concurrency: int, tokens: int) -> float:
+    began = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda i: patch(f"token{i % tokens}"), range(requests_count)))
+
+    return time.perf_counter() - began
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares webhook PATCH throughput for bare requests calls and the shared Discord client.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=500, help="distinct interaction tokens, each one is its own rate-limit bucket")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per bucket per second on the stub, 0 for unlimited")
+    args = parser.parse_args()
+
+    results = {}
+    with discord_server(rate_limit=args.rate_limit) as discord:
+        elapsed = run(lambda token: bare_requests_patch(discord.url, token), args.requests, args.concurrency, args.tokens)
+        results["bare_requests"] = {
+            "patches_per_second": args.requests / elapsed,
+            "stub_requests": discord.counters.get("requests", 0),
+            "rate_limited": discord.counters.get("rate_limited", 0),
+        }
+
+        discord.counters.clear()
+        discord.buckets.clear()
+        client = DiscordClient(discord.url, "Bot bench")
+        elapsed = run(lambda token: client_patch(client, token), args.requests, args.concurrency, args.tokens)
+        results["shared_client"] = {
+            "patches_per_second": args.requests / elapsed,
+            "stub_requests": discord.counters.get("requests", 0),
+            "rate_limited": discord.counters.get("rate_limited", 0),
+        }
+
+    print(python_json.dumps({
+        "benchmark": "discord_patch",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "rate_limit": args.rate_limit,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import base64
+import json as python_json
+import multiprocessing
+import os
+import tempfile
+from typing import Dict, Tuple
+
+from bench.stubs import image_server, s3_server
+
+SIZES_MB = (1, 10, 25)
+S3_BUCKET = "rip-bot-bench"
+
+
+def peak_rss_kb() -> int:
+    # VmHWM rather than ru_maxrss, which Linux carries over from the parent across fork and exec
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def base64_download_image_and_upload_to_s3(source_url: str) -> Dict:
+    # the pipeline before streaming: whole image in memory, then base64 into the task result
+    import boto3
+    import requests
+
+    from tasks.s3 import S3_ENDPOINT_URL
+
+    s3 = boto3.resource("s3", endpoint_url=S3_ENDPOINT_URL)
+    response = requests.get(source_url)
+    content_type = response.headers["content-type"]
+    s3.Bucket(S3_BUCKET).put_object(Key="img/bench.png", Body=response.content, ContentType=content_type)
+    encoded_image = base64.b64encode(response.content).decode("utf-8")
+
+    return { "image": ("bench.png", content_type, encoded_image, "") }
+
+
+def download_stage(mode: str, source_url: str, results):
+    from kombu.utils.json import dumps
+
+    import tasks.tasks as app_tasks
+
+    download = base64_download_image_and_upload_to_s3 if mode == "base64" else app_tasks.download_image_and_upload_to_s3.run
+
+    # what the worker hands to the result backend
+    message = dumps(download(f"{source_url}/bench.png"))
+    results.put((peak_rss_kb(), message))
+
+
+def idle_stage(results):
+    import tasks.tasks  # noqa: F401
+
+    results.put((peak_rss_kb(), None))
+
+
+def interaction_stage(mode: str, message: str, results):
+    from kombu.utils.json import loads
+    from requests.models import RequestEncodingMixin
+
+    import tasks.tasks  # noqa: F401, same imports as a real worker
+
+    # the worker receives the result from the backend and builds the multipart PATCH body
+    file_name, content_type, image_content, _ = loads(message)["image"]
+    if mode == "base64":
+        RequestEncodingMixin._encode_files({"files[0]": (file_name, base64.b64decode(image_content.encode("utf-8")), content_type)}, {})
+    else:
+        with open(image_content, "rb") as image_file:
+            RequestEncodingMixin._encode_files({"files[0]": (file_name, image_file, content_type)}, {})
+        os.remove(image_content)
+
+    results.put((peak_rss_kb(), None))
+
+
+def run_in_fresh_worker(target, *args) -> Tuple[int, str]:
+    # a new interpreter per measurement so one run's peak doesn't carry into the next
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures peak RSS per worker for the base64 and streaming image pipelines.")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=SIZES_MB)
+    args = parser.parse_args()
+
+    results = {}
+    with image_server() as images, s3_server() as s3, tempfile.TemporaryDirectory() as spool_dir:
+        os.environ.update({
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            "S3_BUCKET": S3_BUCKET,
+            "S3_ENDPOINT_URL": s3.url,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "ca-central-1",
+            "IMAGE_SPOOL_DIR": spool_dir,
+        })
+
+        idle_kb, _ = run_in_fresh_worker(idle_stage)
+        results["idle_worker_peak_rss_mb"] = round(idle_kb / 1024, 1)
+
+        for size_mb in args.sizes_mb:
+            source_url = f"{images.url}/{size_mb * 1024 * 1024}"
+            for mode in ("base64", "streaming"):
+                download_kb, message = run_in_fresh_worker(download_stage, mode, source_url)
+                interaction_kb, _ = run_in_fresh_worker(interaction_stage, mode, message)
+                results[f"{size_mb}MB_{mode}"] = {
+                    "download_worker_peak_rss_mb": round(download_kb / 1024, 1),
+                    "interaction_worker_peak_rss_mb": round(interaction_kb / 1024, 1),
+                    "result_message_bytes": len(message),
+                }
+
+    print(python_json.dumps({
+        "benchmark": "image_pipeline",
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import json as python_json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import requests
+from nacl.signing import SigningKey
+
+from bench.bench_connection_pool import create_database
+
+SERVERS = {
+    "sync": lambda port, workers, threads: [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--threads", str(threads), "--bind", f"127.0.0.1:{port}", "wsgi:app"],
+    "async": lambda port, workers, threads: [sys.executable, "-m", "uvicorn", "--workers", str(workers), "--port", str(port), "--log-level", "warning", "interactions.asgi:app"],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+def make_payloads(guilds: int, victims: int) -> List[Dict]:
+    payloads = []
+    for i in range(200):
+        guild_id = f"guild{random.randrange(guilds)}"
+        if i % 2:
+            data = {"name": "tally-deaths", "options": []}
+        else:
+            data = {"name": "get-death", "options": [{"name": "dead-person", "value": f"victim{random.randrange(victims)}"}]}
+        payloads.append({"type": 2, "token": f"token{i}", "guild_id": guild_id, "data": data})
+
+    return payloads
+
+
+def run_load(url: str, signing_key: SigningKey, payloads: List[Dict], requests_count: int, concurrency: int) -> Dict:
+    latencies = []
+    deferred = 0
+    lock = threading.Lock()
+    counter = iter(range(requests_count))
+
+    def client():
+        nonlocal deferred
+        session = requests.Session()
+        for i in counter:
+            body = python_json.dumps(payloads[i % len(payloads)]).encode()
+            timestamp = str(int(time.time()))
+            signature = signing_key.sign(timestamp.encode() + body).signature.hex()
+
+            began = time.perf_counter()
+            response = session.post(url, data=body, headers={
+                "Content-Type": "application/json",
+                "X-Signature-Ed25519": signature,
+                "X-Signature-Timestamp": timestamp,
+            })
+            elapsed = time.perf_counter() - began
+
+            with lock:
+                latencies.append(elapsed)
+                deferred += response.json()["type"] == 5
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    began = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    return {
+        "requests_per_second": requests_count / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "deferred": deferred,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares /interactions p50/p99 latency for the sync (gunicorn) and async (uvicorn) apps.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker for the sync app")
+    parser.add_argument("--deaths", type=int, default=200000)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=50)
+    args = parser.parse_args()
+
+    signing_key = SigningKey.generate()
+    payloads = make_payloads(args.guilds, args.victims)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        create_database(database_path, args.guilds, args.victims, args.deaths)
+
+        environment = {
+            **os.environ,
+            "RIP_BOT_PUBLIC_KEY": signing_key.verify_key.encode().hex(),
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            # measure the queries, not the cache
+            "QUERY_CACHE_TTL": "0",
+        }
+
+        for mode, command in SERVERS.items():
+            port = free_port()
+            server = subprocess.Popen(command(port, args.workers, args.threads), env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                results[mode] = run_load(f"http://127.0.0.1:{port}/interactions", signing_key, payloads, args.requests, args.concurrency)
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(python_json.dumps({
+        "benchmark": "interactions_latency",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import glob
+import json as python_json
+import os
+import tempfile
+import time
+import traceback
+from typing import Dict, List, Tuple
+
+from nacl.signing import SigningKey
+
+from bench.bench_connection_pool import create_database
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+# commands without side effects, add-death and remove-death would queue a task per request
+ROUTE_PAYLOADS = ("ping", "tally-deaths", "get-death")
+
+
+def load_payloads(names: Tuple[str, ...] = None) -> Dict[str, bytes]:
+    # recorded interaction bodies, replayed byte for byte
+    payloads = {}
+    for path in sorted(glob.glob(os.path.join(PAYLOAD_DIR, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if names and name not in names:
+            continue
+        with open(path, "rb") as payload:
+            payloads[name] = payload.read()
+
+    return payloads
+
+
+def baseline_app(public_key: str):
+    # the route as it was: discord_interactions' decorator, get_json and jsonify
+    from discord_interactions import verify_key_decorator
+    from flask import Flask, json, request
+
+    from interactions.app import InteractionsHandlers, ERROR_MESSAGE
+
+    baseline = Flask("baseline")
+
+    @baseline.post("/interactions")
+    @verify_key_decorator(public_key)
+    def interactions_post():
+        try:
+            request_body = request.get_json()
+            return json.jsonify(InteractionsHandlers[request_body["type"]](request_body))
+        except Exception:
+            return json.jsonify({"type": 4, "data": {"content": ERROR_MESSAGE + traceback.format_exc()}})
+
+    return baseline
+
+
+def run_route(flask_app, requests: List[Tuple[bytes, Dict[str, str]]], seconds: float) -> Dict:
+    client = flask_app.test_client()
+    # warm up, fills the query cache and the verify key cache
+    for body, headers in requests:
+        assert client.post("/interactions", data=body, headers=headers).status_code == 200
+
+    count = 0
+    began = time.perf_counter()
+    deadline = began + seconds
+    while time.perf_counter() < deadline:
+        for body, headers in requests:
+            client.post("/interactions", data=body, headers=headers)
+        count += len(requests)
+    elapsed = time.perf_counter() - began
+
+    return {
+        "requests_per_second": count / elapsed,
+        "us_per_request": elapsed / count * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second on one core through /interactions with recorded payloads.")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--deaths", type=int, default=20000)
+    args = parser.parse_args()
+
+    signing_key = SigningKey.generate()
+    public_key = signing_key.verify_key.encode().hex()
+    payloads = load_payloads(ROUTE_PAYLOADS)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        create_database(database_path, 10, 50, args.deaths)
+
+        os.environ.update({
+            "RIP_BOT_PUBLIC_KEY": public_key,
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+        })
+
+        import interactions.app as interactions_app
+        import interactions.codec as codec
+
+        apps = {
+            "baseline": baseline_app(public_key),
+            "fast_path": interactions_app.app,
+        }
+
+        results = {}
+        for name, body in payloads.items():
+            timestamp = str(int(time.time()))
+            headers = {
+                "Content-Type": "application/json",
+                "X-Signature-Ed25519": signing_key.sign(timestamp.encode() + body).signature.hex(),
+                "X-Signature-Timestamp": timestamp,
+            }
+            results[name] = {mode: run_route(flask_app, [(body, headers)], args.seconds) for mode, flask_app in apps.items()}
+
+    print(python_json.dumps({
+        "benchmark": "interactions_route",
+        "codec": "orjson" if codec.orjson else "json",
+        "payloads": list(payloads),
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
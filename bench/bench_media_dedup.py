@@ -0,0 +1,114 @@
+import argparse
+import bisect
+import json as python_json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.generate import zipf_cumulative_weights
+from bench.stubs import image_server, s3_server
+from migrations.runner import connect_to_database, run_migrations
+
+S3_BUCKET = "rip-bot-bench"
+S3_COUNTERS = ("put_object_requests", "upload_part_requests", "complete_multipart_requests", "bytes_received")
+
+
+def repost_workload(uploads: int, distinct: int, skew: float, seed: int) -> List[int]:
+    # the image stub's content depends only on the size, so every distinct image gets its own size
+    rng = random.Random(seed)
+    sizes = rng.sample(range(50 * 1024, 2 * 1024 * 1024), distinct)
+    weights = zipf_cumulative_weights(distinct, skew)
+    return [sizes[bisect.bisect(weights, rng.random() * weights[-1])] for _ in range(uploads)]
+
+
+def timestamp_key_upload(source_url: str):
+    # the pipeline before content addressing: every post is a new object under img/{timestamp}-{name}
+    import requests
+
+    from tasks.s3 import get_s3_client, get_transfer_config
+
+    key = f"img/{time.time()}-{os.path.basename(source_url)}"
+    with requests.get(source_url, stream=True) as response:
+        response.raw.decode_content = True
+        get_s3_client().upload_fileobj(response.raw, S3_BUCKET, key, ExtraArgs={"ContentType": response.headers["content-type"]}, Config=get_transfer_config())
+
+
+def content_addressed_upload(source_url: str):
+    import tasks.tasks as app_tasks
+
+    _, _, spool_path, _ = app_tasks.download_image_and_upload_to_s3.run(source_url)["image"]
+    os.remove(spool_path)
+
+
+MODES = {
+    "timestamp_keys": timestamp_key_upload,
+    "content_addressed": content_addressed_upload,
+}
+
+
+def run_mode(upload, s3, images_url: str, workload: List[int]) -> Dict:
+    before = {name: s3.counters.get(name, 0) for name in S3_COUNTERS}
+    began = time.perf_counter()
+    for i, size in enumerate(workload):
+        upload(f"{images_url}/{size}/post{i}.png")
+    elapsed = time.perf_counter() - began
+
+    counters = {name: s3.counters.get(name, 0) - before[name] for name in S3_COUNTERS}
+    return {
+        "s3_requests": counters["put_object_requests"] + counters["upload_part_requests"] + counters["complete_multipart_requests"],
+        "s3_bytes": counters["bytes_received"],
+        "elapsed_seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares S3 PUTs and bytes with and without content-addressed dedup on a repost-heavy workload.")
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100, help="distinct images among the uploads")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf skew of how often each image is reposted")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = repost_workload(args.uploads, args.distinct, args.skew, args.seed)
+
+    with image_server() as images, s3_server() as s3, tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        connection = connect_to_database(database_path)
+        run_migrations(connection)
+        connection.close()
+
+        os.environ.update({
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            "S3_BUCKET": S3_BUCKET,
+            "S3_ENDPOINT_URL": s3.url,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "ca-central-1",
+            "IMAGE_SPOOL_DIR": directory,
+        })
+
+        results = {mode: run_mode(upload, s3, images.url, workload) for mode, upload in MODES.items()}
+
+        from db.db import pooled_cursor
+        with pooled_cursor(database_path) as cursor:
+            stored, thumbnails = cursor.execute("SELECT COUNT(*), COUNT(thumbnail_url) FROM media_objects").fetchone()
+
+    baseline, deduplicated = results["timestamp_keys"], results["content_addressed"]
+    print(python_json.dumps({
+        "benchmark": "media_dedup",
+        "uploads": args.uploads,
+        "distinct_images": len(set(workload)),
+        "stored_objects": stored,
+        "thumbnails": thumbnails,
+        "results": results,
+        "s3_requests_saved": baseline["s3_requests"] - deduplicated["s3_requests"],
+        "s3_bytes_saved": baseline["s3_bytes"] - deduplicated["s3_bytes"],
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
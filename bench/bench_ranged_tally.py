@@ -0,0 +1,111 @@
+import argparse
+import json as python_json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db.db import SELECT_DEADPERSON_COUNT_BY_TIME_SQL, SECONDS_PER_DAY, get_tally_time_db
+from migrations.runner import run_migrations
+
+WINDOW_DAYS = (1, 30, 365, 3 * 365)
+
+
+def create_database(path: str, guilds: int, victims: int, deaths: int, years: int):
+    conn = sqlite3.connect(path)
+    # load the raw rows before the aggregate migrations so their backfill builds the rollups
+    # in one pass instead of firing the triggers millions of times
+    run_migrations(conn, target=2)
+    start = 1500000000
+    rows = (
+        (
+            f"guild{random.randrange(guilds)}",
+            "channel",
+            None,
+            f"victim{random.randrange(victims)}",
+            "caption",
+            "{}",
+            "",
+            start + random.randrange(years * 365 * SECONDS_PER_DAY),
+            "reporter",
+        )
+        for _ in range(deaths)
+    )
+    conn.executemany("INSERT INTO deaths VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    run_migrations(conn)
+    conn.close()
+
+    return start
+
+
+def raw_tally(cursor: sqlite3.Cursor, guild_id: str, start_time: int, end_time: int):
+    return cursor.execute(SELECT_DEADPERSON_COUNT_BY_TIME_SQL, {
+        "start_time": start_time,
+        "end_time": end_time,
+        "guild_id": guild_id,
+        "limit": 50,
+    }).fetchall()
+
+
+def rollup_tally(cursor: sqlite3.Cursor, guild_id: str, start_time: int, end_time: int):
+    return get_tally_time_db(cursor, guild_id, start_time, end_time, 50)
+
+
+def time_queries(query, cursor: sqlite3.Cursor, windows) -> dict:
+    durations = []
+    for guild_id, start_time, end_time in windows:
+        began = time.perf_counter()
+        query(cursor, guild_id, start_time, end_time)
+        durations.append(time.perf_counter() - began)
+
+    return {
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": statistics.median(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares ranged tallies answered from raw rows and from the per-day rollup.")
+    parser.add_argument("--deaths", type=int, default=2000000)
+    parser.add_argument("--guilds", type=int, default=4)
+    parser.add_argument("--victims", type=int, default=25)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "deaths.db")
+        start = create_database(path, args.guilds, args.victims, args.deaths, args.years)
+        cursor = sqlite3.connect(path).cursor()
+
+        for days in WINDOW_DAYS:
+            windows = []
+            for _ in range(args.queries):
+                # windows start mid-day so both partial edge days are exercised
+                start_time = start + random.randrange((args.years * 365 - days) * SECONDS_PER_DAY)
+                windows.append((f"guild{random.randrange(args.guilds)}", start_time, start_time + days * SECONDS_PER_DAY))
+
+            for guild_id, start_time, end_time in windows[:3]:
+                assert raw_tally(cursor, guild_id, start_time, end_time) == rollup_tally(cursor, guild_id, start_time, end_time)
+
+            results[f"{days}_days"] = {
+                "raw": time_queries(raw_tally, cursor, windows),
+                "rollup": time_queries(rollup_tally, cursor, windows),
+            }
+
+    print(python_json.dumps({
+        "benchmark": "ranged_tally",
+        "deaths": args.deaths,
+        "guilds": args.guilds,
+        "victims": args.victims,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
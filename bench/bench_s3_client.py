@@ -0,0 +1,93 @@
+import argparse
+import io
+import json as python_json
+import os
+import statistics
+import time
+
+from bench.stubs import s3_server
+
+S3_BUCKET = "rip-bot-bench"
+SMALL_IMAGE_BYTES = 200 * 1024
+LARGE_IMAGE_BYTES = 25 * 1024 * 1024
+
+
+def summarize(durations) -> dict:
+    return {
+        "p50_ms": statistics.median(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def resource_per_call_upload(body: bytes, key: str):
+    # what the task did before: a new resource (session, credential chain, endpoint resolution) per image
+    import boto3
+
+    from tasks.s3 import S3_ENDPOINT_URL
+
+    s3 = boto3.resource("s3", endpoint_url=S3_ENDPOINT_URL)
+    s3.Bucket(S3_BUCKET).upload_fileobj(io.BytesIO(body), key)
+
+
+def reused_client_upload(body: bytes, key: str):
+    from tasks.s3 import get_s3_client, get_transfer_config
+
+    get_s3_client().upload_fileobj(io.BytesIO(body), S3_BUCKET, key, Config=get_transfer_config())
+
+
+def single_threaded_upload(body: bytes, key: str):
+    from boto3.s3.transfer import TransferConfig
+
+    from tasks.s3 import S3_MULTIPART_CHUNKSIZE, S3_MULTIPART_THRESHOLD, get_s3_client
+
+    config = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD, multipart_chunksize=S3_MULTIPART_CHUNKSIZE, use_threads=False)
+    get_s3_client().upload_fileobj(io.BytesIO(body), S3_BUCKET, key, Config=config)
+
+
+def time_uploads(upload, body: bytes, count: int) -> list:
+    durations = []
+    for i in range(count):
+        began = time.perf_counter()
+        upload(body, f"img/bench-{i}")
+        durations.append(time.perf_counter() - began)
+
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares S3 upload latency with a per-call resource and a reused, multipart-tuned client.")
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--large-uploads", type=int, default=5)
+    parser.add_argument("--endpoint-url", default=None, help="S3-compatible endpoint (MinIO, moto server), defaults to a local stub")
+    args = parser.parse_args()
+
+    small_body = os.urandom(SMALL_IMAGE_BYTES)
+    large_body = os.urandom(LARGE_IMAGE_BYTES)
+
+    with s3_server() as s3:
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url or s3.url
+
+        results = {
+            "small_image": {
+                "resource_per_call": summarize(time_uploads(resource_per_call_upload, small_body, args.uploads)),
+                "reused_client": summarize(time_uploads(reused_client_upload, small_body, args.uploads)),
+            },
+            "large_image": {
+                "single_threaded_multipart": summarize(time_uploads(single_threaded_upload, large_body, args.large_uploads)),
+                "parallel_multipart": summarize(time_uploads(reused_client_upload, large_body, args.large_uploads)),
+            },
+        }
+
+    print(python_json.dumps({
+        "benchmark": "s3_client",
+        "small_image_bytes": SMALL_IMAGE_BYTES,
+        "large_image_bytes": LARGE_IMAGE_BYTES,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
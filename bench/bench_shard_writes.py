@@ -0,0 +1,160 @@
+import argparse
+import json as python_json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from db.bulk import BULK_BATCH_SIZE
+from db.db import add_death_db, update_death_image_url_db, update_death_message_id_db
+from db.storage import ShardedSqliteStorage, SqliteStorage, Storage
+from migrations.runner import connect_to_database, run_migrations
+
+ENGINES = ("sqlite", "sqlite_shards")
+# steady is add-deaths alone, bulk_import adds a process importing into another guild in big transactions,
+# the way db.bulk does, which holds the write lock for as long as each batch takes
+SCENARIOS = ("steady", "bulk_import")
+BULK_GUILD_ID = "bulk"
+
+
+def create_storage(engine: str, directory: str) -> Storage:
+    if engine == "sqlite":
+        return SqliteStorage(os.path.join(directory, "deaths.db"))
+    return ShardedSqliteStorage(os.path.join(directory, "shards"))
+
+
+def add_deaths(engine: str, directory: str, guilds: int, interactions: int, threads: int, seed: int, results):
+    # one Celery worker process, threads each running add-deaths for whichever guild comes next
+    storage = create_storage(engine, directory)
+    rng = random.Random(seed)
+    # skewed like real traffic, a few busy guilds and a long tail
+    guild_ids = rng.choices([f"guild{i}" for i in range(guilds)], weights=[1 / (i + 1) for i in range(guilds)], k=interactions)
+    counters = {"completed": 0, "lock_errors": 0, "other_errors": 0}
+    latencies: List[float] = []
+    lock = threading.Lock()
+    next_interaction = iter(range(interactions))
+
+    def run():
+        for index in next_interaction:
+            guild_id = guild_ids[index]
+            began = time.perf_counter()
+            try:
+                rowid = storage.write(guild_id, lambda cursor: add_death_db(cursor, guild_id, "channel", None, f"victim{index % 50}", "caption", "{}", "", int(time.time()), "reporter"))
+                storage.write(guild_id, lambda cursor: update_death_image_url_db(cursor, rowid, f"https://example.com/{seed}-{index}.png"))
+                storage.write(guild_id, lambda cursor: update_death_message_id_db(cursor, rowid, f"{seed}-{index}"))
+                with lock:
+                    counters["completed"] += 1
+                    latencies.append(time.perf_counter() - began)
+            except sqlite3.OperationalError as e:
+                with lock:
+                    counters["lock_errors" if "locked" in str(e) else "other_errors"] += 1
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    results.put({**counters, "latencies": latencies})
+
+
+def bulk_import(engine: str, directory: str, stop: multiprocessing.Event, results):
+    storage = create_storage(engine, directory)
+
+    def insert_batch(cursor: sqlite3.Cursor):
+        for i in range(BULK_BATCH_SIZE):
+            add_death_db(cursor, BULK_GUILD_ID, "channel", None, f"victim{i % 500}", "caption", "{}", "", int(time.time()), "reporter")
+
+    batches = 0
+    while not stop.is_set():
+        storage.write(BULK_GUILD_ID, insert_batch)
+        batches += 1
+
+    results.put(batches * BULK_BATCH_SIZE)
+
+
+def run_scenario(engine: str, scenario: str, directory: str, guilds: int, interactions: int, processes: int, threads: int) -> Dict:
+    results = multiprocessing.Queue()
+    per_process = interactions // processes
+    workers = [
+        multiprocessing.Process(target=add_deaths, args=(engine, directory, guilds, per_process, threads, i, results))
+        for i in range(processes)
+    ]
+    stop = multiprocessing.Event()
+    bulk_results = multiprocessing.Queue()
+    importer = multiprocessing.Process(target=bulk_import, args=(engine, directory, stop, bulk_results)) if scenario == "bulk_import" else None
+
+    if importer:
+        importer.start()
+    began = time.perf_counter()
+    for process in workers:
+        process.start()
+    totals = {}
+    latencies: List[float] = []
+    for _ in workers:
+        result = results.get()
+        latencies += result.pop("latencies")
+        for name, value in result.items():
+            totals[name] = totals.get(name, 0) + value
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - began
+
+    if importer:
+        stop.set()
+        totals["bulk_rows"] = bulk_results.get()
+        importer.join()
+
+    latencies.sort()
+    return {
+        **totals,
+        "elapsed_seconds": elapsed,
+        "writes_per_second": totals["completed"] * 3 / elapsed,
+        "add_death_p50_ms": statistics.median(latencies) * 1000,
+        "add_death_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent add-death writes across many guilds, into one SQLite file and into a shard per guild.")
+    parser.add_argument("--guilds", type=int, default=32)
+    parser.add_argument("--interactions", type=int, default=4000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in SCENARIOS:
+        results[scenario] = {}
+        for engine in ENGINES:
+            with tempfile.TemporaryDirectory() as directory:
+                storage = create_storage(engine, directory)
+                # created up front so the run measures writes, not each shard's first migration
+                if engine == "sqlite":
+                    connection = connect_to_database(storage.path)
+                    run_migrations(connection)
+                    connection.close()
+                else:
+                    for guild_id in [f"guild{i}" for i in range(args.guilds)] + [BULK_GUILD_ID]:
+                        storage.path_for(guild_id)
+
+                results[scenario][engine] = run_scenario(engine, scenario, directory, args.guilds, args.interactions, args.processes, args.threads)
+
+    print(python_json.dumps({
+        "benchmark": "shard_writes",
+        "guilds": args.guilds,
+        "interactions": args.interactions,
+        "processes": args.processes,
+        "threads": args.threads,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json as python_json
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, Optional
+
+from bench.stubs import discord_server, image_server, s3_server
+from migrations.runner import connect_to_database, run_migrations
+
+FOLLOWUP_TASKS = ("update_database_with_image", "update_interaction_with_image", "update_database_with_message_id")
+MODES = ("without_keys", "with_keys")
+
+
+def deliver(app_tasks, death, token: str, idempotency_key: Optional[str]):
+    # what a worker runs for one add-death, the followups get the lean task's result like the group would
+    result = app_tasks.add_death_and_upload_image.run(*death, interaction_token=token, guild_id="guild", idempotency_key=idempotency_key)
+    for name in FOLLOWUP_TASKS:
+        getattr(app_tasks, name).run(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs every add-death twice, as acks-late redelivery would, with and without idempotency keys.")
+    parser.add_argument("--deaths", type=int, default=50)
+    parser.add_argument("--image-bytes", type=int, default=512 * 1024)
+    args = parser.parse_args()
+
+    with image_server() as images, s3_server() as s3, discord_server() as discord, tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        connection = connect_to_database(database_path)
+        run_migrations(connection)
+
+        os.environ.update({
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            "S3_BUCKET": "rip-bot-bench",
+            "S3_ENDPOINT_URL": s3.url,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "ca-central-1",
+            "DISCORD_API_BASE": discord.url,
+            "DISCORD_BOT_APPLICATION_ID": "bench",
+            "AUTHORIZATION": "Bot bench",
+            "IMAGE_SPOOL_DIR": directory,
+        })
+
+        import tasks.tasks as app_tasks
+
+        stubs = {"images": images, "s3": s3, "discord": discord}
+        results = {}
+        for m, mode in enumerate(MODES):
+            server = f"guild-{mode}"
+            deliveries: Dict[str, Dict] = {}
+
+            for delivery in ("first", "redelivered"):
+                before = {name: dict(stub.counters) for name, stub in stubs.items()}
+                latencies = []
+
+                for i in range(args.deaths):
+                    # the image differs per death so the content-addressed dedup doesn't hide the difference
+                    image_url = f"{images.url}/{args.image_bytes + m * args.deaths + i}/{mode}-{i}.png"
+                    death = (server, "channel", None, "victim", "caption", "{}", image_url, int(time.time()), "reporter")
+                    began = time.perf_counter()
+                    deliver(app_tasks, death, f"{mode}-{i}", f"interaction:{mode}-{i}" if mode == "with_keys" else None)
+                    latencies.append(time.perf_counter() - began)
+
+                deliveries[delivery] = {
+                    "p50_ms": statistics.median(latencies) * 1000,
+                    "max_ms": max(latencies) * 1000,
+                    **{
+                        f"{name}_{counter}": value - before[name].get(counter, 0)
+                        for name, stub in stubs.items()
+                        for counter, value in stub.counters.items()
+                        if counter in ("downloads", "put_object_requests", "requests")
+                    },
+                }
+
+            deaths, = connection.execute("SELECT COUNT(*) FROM deaths WHERE server = ?", (server,)).fetchone()
+            results[mode] = {**deliveries, "deaths_stored": deaths}
+
+        connection.close()
+
+    print(python_json.dumps({
+        "benchmark": "task_redelivery",
+        "deaths": args.deaths,
+        "image_bytes": args.image_bytes,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
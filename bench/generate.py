@@ -0,0 +1,165 @@
+import argparse
+import bisect
+import itertools
+import json as python_json
+import random
+import time
+from typing import Dict, Iterator, List
+
+from db.bulk import defer_schema, insert_deaths, restore_schema
+from db.db import SECONDS_PER_DAY
+from metrics.metrics import DISCORD_EPOCH_MS
+from migrations.runner import connect_to_database, run_migrations
+
+INSERT_BATCH_SIZE = 10000
+CHANNELS_PER_GUILD = 4
+
+
+def zipf_cumulative_weights(count: int, skew: float) -> List[float]:
+    weights = itertools.accumulate(1 / (rank + 1) ** skew for rank in range(count))
+    return list(weights)
+
+
+def snowflake(timestamp: float, sequence: int) -> str:
+    # same layout as a Discord id, so message ids sort and size like the real ones
+    return str(((int(timestamp * 1000) - DISCORD_EPOCH_MS) << 22) | (sequence & 0x3FFFFF))
+
+
+def attachment_json(rng: random.Random, message_id: str, size: int) -> str:
+    file_name = f"{rng.getrandbits(64):016x}.png"
+    attachment = {
+        "id": message_id,
+        "filename": file_name,
+        "size": rng.randrange(50000, 5000000),
+        "url": f"https://cdn.discordapp.com/ephemeral-attachments/1012345678901234567/{message_id}/{file_name}",
+        "proxy_url": f"https://media.discordapp.net/ephemeral-attachments/1012345678901234567/{message_id}/{file_name}",
+        "width": 1920,
+        "height": 1080,
+        "content_type": "image/png",
+        "ephemeral": True,
+    }
+
+    # pad the description so the stored JSON is about the requested size
+    encoded = python_json.dumps(attachment)
+    if len(encoded) < size:
+        attachment["description"] = "x" * max(0, size - len(encoded) - len(', "description": ""'))
+        encoded = python_json.dumps(attachment)
+
+    return encoded
+
+
+def generate_deaths(
+    guilds: int,
+    victims: int,
+    deaths: int,
+    days: int,
+    attachment_bytes: int,
+    victim_skew: float,
+    guild_skew: float,
+    end_time: float,
+    seed: int,
+) -> Iterator[Dict]:
+    rng = random.Random(seed)
+    guild_weights = zipf_cumulative_weights(guilds, guild_skew)
+    victim_weights = zipf_cumulative_weights(victims, victim_skew)
+    start_time = end_time - days * SECONDS_PER_DAY
+
+    for i in range(deaths):
+        guild = bisect.bisect(guild_weights, rng.random() * guild_weights[-1])
+        victim = bisect.bisect(victim_weights, rng.random() * victim_weights[-1])
+        timestamp = rng.uniform(start_time, end_time)
+        message_id = snowflake(timestamp, i)
+
+        yield {
+            "server": f"guild{guild}",
+            "channel_id": f"channel{guild}-{rng.randrange(CHANNELS_PER_GUILD)}",
+            "message_id": message_id,
+            "dead_person": f"victim{victim}",
+            "caption": "caption",
+            "attachment": attachment_json(rng, message_id, attachment_bytes),
+            "image_url": f"https://rip-bot.s3.ca-central-1.amazonaws.com/img/{message_id}.png",
+            "timestamp": int(timestamp),
+            "reporter": f"victim{rng.randrange(victims)}",
+        }
+
+
+def generate_database(
+    path: str,
+    guilds: int = 20,
+    victims: int = 200,
+    deaths: int = 100000,
+    days: int = 365,
+    attachment_bytes: int = 450,
+    victim_skew: float = 1.1,
+    guild_skew: float = 1.0,
+    end_time: float = None,
+    seed: int = 0,
+) -> Dict:
+    """
+    Creates a deaths database at path through the real migrations and the bulk import's insert_deaths.
+
+    Guild sizes and each guild's victims follow Zipf distributions, "guild0" and "victim0"
+    are the busiest. Timestamps are spread uniformly over the days before end_time.
+    """
+    connection = connect_to_database(path)
+    run_migrations(connection)
+
+    # timestamps come out in random order, which the aggregate triggers handle slowly,
+    # so they're dropped for the load and the aggregates are built once at the end like a bulk import
+    defer_schema(connection)
+    rows = generate_deaths(guilds, victims, deaths, days, attachment_bytes, victim_skew, guild_skew, end_time or time.time(), seed)
+    connection.execute("BEGIN")
+    while True:
+        batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+        if not batch:
+            break
+        insert_deaths(connection, batch)
+    connection.execute("COMMIT")
+    restore_schema(connection)
+    connection.execute("ANALYZE")
+    connection.close()
+
+    return {
+        "path": path,
+        "guilds": guilds,
+        "victims": victims,
+        "deaths": deaths,
+        "days": days,
+        "attachment_bytes": attachment_bytes,
+        "victim_skew": victim_skew,
+        "guild_skew": guild_skew,
+        "seed": seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic deaths database.")
+    parser.add_argument("path")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=200)
+    parser.add_argument("--deaths", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--attachment-bytes", type=int, default=450)
+    parser.add_argument("--victim-skew", type=float, default=1.1)
+    parser.add_argument("--guild-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    summary = generate_database(
+        args.path,
+        args.guilds,
+        args.victims,
+        args.deaths,
+        args.days,
+        args.attachment_bytes,
+        args.victim_skew,
+        args.guild_skew,
+        seed=args.seed,
+    )
+
+    print(python_json.dumps({**summary, "elapsed_seconds": time.perf_counter() - began}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import json as python_json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+
+from db.db import pooled_cursor, add_death_db, update_death_image_url_db, update_death_message_id_db
+from db.writer import WRITE_BEHIND_TIMEOUT, get_batch_writer
+from migrations.runner import connect_to_database, run_migrations
+
+
+def direct_writer(path: str, counters: Dict[str, int], lock: threading.Lock) -> Callable:
+    # every write is its own transaction, like the tasks before write-behind
+    def write(operation):
+        with pooled_cursor(path) as cursor:
+            result = operation(cursor)
+        with lock:
+            counters["commits"] += 1
+        return result
+
+    return write
+
+
+def batched_writer(path: str, counters: Dict[str, int], lock: threading.Lock) -> Callable:
+    writer = get_batch_writer(path)
+
+    def write(operation):
+        return writer.submit(operation).result(timeout=WRITE_BEHIND_TIMEOUT)
+
+    return write
+
+
+MODES = {
+    "direct": direct_writer,
+    "write_behind": batched_writer,
+}
+
+
+def worker(mode: str, path: str, interactions: int, offset: int, results):
+    # one Celery worker process running a thread per in-flight add-death interaction
+    counters = {"commits": 0, "lock_errors": 0, "other_errors": 0, "completed": 0}
+    lock = threading.Lock()
+    write = MODES[mode](path, counters, lock)
+
+    def interaction(index: int):
+        try:
+            rowid = write(lambda cursor: add_death_db(cursor, f"guild{index % 10}", "channel", None, f"victim{index % 50}", "caption", "{}", "", int(time.time()), "reporter"))
+            write(lambda cursor: update_death_image_url_db(cursor, rowid, f"https://example.com/{index}.png"))
+            write(lambda cursor: update_death_message_id_db(cursor, rowid, str(index)))
+            with lock:
+                counters["completed"] += 1
+        except sqlite3.OperationalError as e:
+            with lock:
+                counters["lock_errors" if "locked" in str(e) else "other_errors"] += 1
+
+    threads = [threading.Thread(target=interaction, args=(offset + i,)) for i in range(interactions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if mode == "write_behind":
+        writer_stats = get_batch_writer(path).stats()
+        counters["commits"] = writer_stats["commits"]
+        counters["lock_errors"] += writer_stats["lock_errors"]
+
+    results.put(counters)
+
+
+def run_mode(mode: str, path: str, interactions: int, processes: int) -> Dict:
+    results = multiprocessing.Queue()
+    per_process = interactions // processes
+    workers = [
+        multiprocessing.Process(target=worker, args=(mode, path, per_process, i * per_process, results))
+        for i in range(processes)
+    ]
+
+    began = time.perf_counter()
+    for process in workers:
+        process.start()
+    totals = {}
+    for _ in workers:
+        for name, value in results.get().items():
+            totals[name] = totals.get(name, 0) + value
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - began
+
+    return {
+        **totals,
+        "elapsed_seconds": elapsed,
+        "commits_per_second": totals["commits"] / elapsed,
+        "writes_per_second": totals["completed"] * 3 / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates concurrent add-death interactions against one SQLite file.")
+    parser.add_argument("--interactions", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "deaths.db")
+            connection = connect_to_database(path)
+            run_migrations(connection)
+            connection.close()
+
+            results[mode] = run_mode(mode, path, args.interactions, args.processes)
+
+    print(python_json.dumps({
+        "benchmark": "load_add_death",
+        "interactions": args.interactions,
+        "processes": args.processes,
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
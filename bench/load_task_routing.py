@@ -0,0 +1,168 @@
+import argparse
+import contextlib
+import json as python_json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from bench.stubs import discord_server, image_server, s3_server
+from db.db import add_death_db
+from migrations.runner import connect_to_database, run_migrations
+
+# worker pools per mode, (queues, concurrency). shared is one pool for everything like before routing,
+# routed is the run_worker_* targets scaled down, with the same number of threads in total
+WORKERS = {
+    "shared": [(None, 20)],
+    "routed": [(["interactive"], 4), (["io"], 12), (["db"], 4)],
+}
+REPORTED_WAITS = ("add_death_and_upload_image", "update_interaction_with_image", "update_death_message", "update_database_with_image", "delete_from_database")
+
+
+def percentiles(values: List[float]) -> Dict:
+    ordered = sorted(values)
+    return {
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def run_mode(mode: str, environment: Dict[str, str], images_url: str, image_bytes: int, deaths: int, removes: int, results):
+    # a process per mode, routing is read when tasks.tasks is imported
+    os.environ.update(environment)
+    os.environ["TASK_ROUTING"] = "1" if mode == "routed" else "0"
+
+    from celery.contrib.testing.worker import start_worker
+    from celery.signals import task_postrun, task_prerun
+    from kombu.transport import memory
+
+    # workers on transports without an event loop only send acks between drains, which block for up to 2s.
+    # with a prefetch of one that stalls every pool, Redis and AMQP workers ack from their event loop
+    drain_events = memory.Transport.drain_events
+    memory.Transport.drain_events = lambda self, connection, timeout=None: drain_events(self, connection, timeout=0.01)
+
+    import interactions.app as interactions_app
+    import tasks.tasks as app_tasks
+
+    published: Dict[str, float] = {}
+    finished: Dict[str, float] = {}
+    waits = defaultdict(list)
+    done = threading.Condition()
+
+    @task_prerun.connect(weak=False)
+    def record_wait(task=None, **kwargs):
+        published_at = task.request.get("published_at", None)
+        if published_at:
+            waits[task.name.rsplit(".", 1)[-1]].append(time.time() - published_at)
+
+    @task_postrun.connect(weak=False)
+    def record_finish(task=None, args=(), **kwargs):
+        name = task.name.rsplit(".", 1)[-1]
+        if name == "update_interaction_with_image":
+            token = args[0]["interaction_token"]
+        elif name == "update_death_message":
+            token = args[1]
+        else:
+            return
+        with done:
+            finished[token] = time.time()
+            done.notify_all()
+
+    # the in-memory transport polls once a second by default, which would swamp the differences
+    app_tasks.app.conf.broker_transport_options = {"polling_interval": 0.005}
+
+    with contextlib.ExitStack() as workers:
+        for i, (queues, concurrency) in enumerate(WORKERS[mode]):
+            options = {"queues": queues} if queues else {}
+            workers.enter_context(start_worker(app_tasks.app, pool="threads", concurrency=concurrency, perform_ping_check=False, hostname=f"{mode}{i}@bench", **options))
+
+        # a raid: every add-death at once, with removes of older deaths mixed in
+        remove_every = max(1, deaths // removes) if removes else 0
+        for i in range(deaths):
+            token = f"add-{i}"
+            # a different size per death so the content-addressed dedup doesn't skip the uploads
+            death = ("guild", "channel", None, f"victim{i % 20}", "caption", "{}", f"{images_url}/{image_bytes + i}/{i}.png", int(time.time()), "reporter")
+            published[token] = time.time()
+            interactions_app.build_add_death_pipeline(death, death[6], token, "guild", interaction_id=str(10 ** 17 + i)).delay()
+
+            if remove_every and i % remove_every == 0 and i // remove_every < removes:
+                rowid = i // remove_every + 1
+                message_id = f"message-{rowid}"
+                published[message_id] = time.time()
+                (app_tasks.delete_from_database.s(rowid, "guild", f"remove:{rowid}") |
+                    app_tasks.update_death_message.si("channel", message_id, "removed", f"remove:{rowid}")).delay()
+
+        with done:
+            done.wait_for(lambda: len(finished) == len(published), timeout=120)
+
+    adds = [finished[token] - published[token] for token in published if token.startswith("add-") and token in finished]
+    removals = [finished[token] - published[token] for token in published if token.startswith("message-") and token in finished]
+    results.put({
+        "completed": len(finished),
+        "expected": len(published),
+        "time_to_image": percentiles(adds),
+        "time_to_removal": percentiles(removals) if removals else None,
+        "queue_wait": {name: percentiles(waits[name]) for name in REPORTED_WAITS if waits[name]},
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-image under a burst of add-deaths and removes, with every task on one pool and routed to per-queue pools.")
+    parser.add_argument("--deaths", type=int, default=200)
+    parser.add_argument("--removes", type=int, default=50)
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--cdn-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with image_server(args.cdn_latency) as images, s3_server() as s3, discord_server() as discord:
+        for mode in WORKERS:
+            with tempfile.TemporaryDirectory() as directory:
+                database_path = os.path.join(directory, "deaths.db")
+                connection = connect_to_database(database_path)
+                run_migrations(connection)
+                # the deaths the removes delete
+                for i in range(args.removes):
+                    add_death_db(connection.cursor(), "guild", "channel", f"message-{i + 1}", "victim", "caption", "{}", "", int(time.time()), "reporter")
+                connection.commit()
+                connection.close()
+
+                environment = {
+                    "DATABASE_PATH": database_path,
+                    "CELERY_BROKER": "memory://",
+                    "CELERY_RESULT_BACKEND": "cache+memory://",
+                    "S3_BUCKET": "rip-bot-bench",
+                    "S3_ENDPOINT_URL": s3.url,
+                    "AWS_ACCESS_KEY_ID": "bench",
+                    "AWS_SECRET_ACCESS_KEY": "bench",
+                    "AWS_DEFAULT_REGION": "ca-central-1",
+                    "DISCORD_API_BASE": discord.url,
+                    "DISCORD_BOT_APPLICATION_ID": "bench",
+                    "AUTHORIZATION": "Bot bench",
+                    "IMAGE_SPOOL_DIR": directory,
+                }
+                queue = context.Queue()
+                process = context.Process(target=run_mode, args=(mode, environment, images.url, args.image_bytes, args.deaths, args.removes, queue))
+                process.start()
+                results[mode] = queue.get()
+                process.join()
+
+    print(python_json.dumps({
+        "benchmark": "task_routing",
+        "deaths": args.deaths,
+        "removes": args.removes,
+        "image_bytes": args.image_bytes,
+        "cdn_latency": args.cdn_latency,
+        "workers": {mode: [{"queues": queues or ["celery"], "concurrency": concurrency} for queues, concurrency in pools] for mode, pools in WORKERS.items()},
+        "results": results,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import argparse
+import copy
+import json as python_json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from nacl.signing import SigningKey
+
+from bench.bench_interactions_route import load_payloads
+from bench.generate import generate_database
+from bench.stubs import discord_server, image_server, s3_server
+
+SAMPLE_ROWS = 2000
+
+
+def summarize(seconds: List[float]) -> Dict:
+    seconds = sorted(seconds)
+    return {
+        "calls": len(seconds),
+        "mean_us": statistics.fmean(seconds) * 1e6,
+        "p50_us": statistics.median(seconds) * 1e6,
+        "p99_us": seconds[max(0, int(len(seconds) * 0.99) - 1)] * 1e6,
+    }
+
+
+def time_calls(call: Callable, arguments: List, iterations: int) -> Dict:
+    timings = []
+    for i in range(iterations):
+        began = time.perf_counter()
+        call(*arguments[i % len(arguments)])
+        timings.append(time.perf_counter() - began)
+
+    return summarize(timings)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_db_functions(path: str, samples: List, days: int, iterations: int) -> Dict:
+    from db.db import (
+        pooled_cursor, add_death_db, get_tally_db, get_tally_time_db, get_death_count_db, get_death_by_ordinal_db,
+        get_death_db, get_death_by_message_id_db, update_death_image_url_db, update_death_message_id_db, delete_death_db,
+    )
+
+    now = int(time.time())
+    # the same month-long window the ranged tally usually asks for, at a random point in the history
+    windows = [(start, start + 30 * 86400) for start in (now - random.randrange(30, days) * 86400 for _ in range(100))]
+    results = {}
+
+    with pooled_cursor(path) as cursor:
+        reads = {
+            "get_tally_db": (get_tally_db, [(cursor, server, 50) for _, server, _, _ in samples]),
+            "get_tally_time_db": (get_tally_time_db, [(cursor, server, *windows[i % len(windows)], 50) for i, (_, server, _, _) in enumerate(samples)]),
+            "get_death_count_db": (get_death_count_db, [(cursor, server, dead_person) for _, server, dead_person, _ in samples]),
+            "get_death_by_ordinal_db": (get_death_by_ordinal_db, [(cursor, server, dead_person, 0) for _, server, dead_person, _ in samples]),
+            "get_death_db": (get_death_db, [(cursor, server, dead_person) for _, server, dead_person, _ in samples]),
+            "get_death_db_guild": (get_death_db, [(cursor, server) for _, server, _, _ in samples]),
+            "get_death_by_message_id_db": (get_death_by_message_id_db, [(cursor, message_id) for _, _, _, message_id in samples]),
+        }
+        for name, (function, arguments) in reads.items():
+            results[name] = time_calls(function, arguments, iterations)
+
+    # writes commit one at a time like WRITE_BEHIND=0, they only touch rows they added
+    def write(function: Callable) -> Callable:
+        def call(*args):
+            with pooled_cursor(path) as cursor:
+                return function(cursor, *args)
+        return call
+
+    added = []
+    add = write(add_death_db)
+    timings = []
+    for i in range(iterations):
+        _, server, dead_person, _ = samples[i % len(samples)]
+        began = time.perf_counter()
+        added.append(add(server, "channel", None, dead_person, "caption", "{}", "", now, "reporter"))
+        timings.append(time.perf_counter() - began)
+    results["add_death_db"] = summarize(timings)
+
+    results["update_death_image_url_db"] = time_calls(write(update_death_image_url_db), [(rowid, f"https://example.com/{rowid}.png") for rowid in added], iterations)
+    results["update_death_message_id_db"] = time_calls(write(update_death_message_id_db), [(rowid, f"bench{rowid}") for rowid in added], iterations)
+    results["delete_death_db"] = time_calls(write(delete_death_db), [(rowid,) for rowid in added], iterations)
+
+    return results
+
+
+def build_requests(payloads: Dict[str, bytes], samples: List, image_url: str, requests_per_command: int) -> Dict[str, List[Dict]]:
+    # the recorded payloads with the guild, victim and message swapped for generated ones
+    recorded = {name: python_json.loads(body) for name, body in payloads.items()}
+    requests = defaultdict(list)
+
+    for i in range(requests_per_command):
+        rowid, server, dead_person, message_id = samples[i % len(samples)]
+
+        def interaction(name: str, options: Dict = None) -> Dict:
+            body = copy.deepcopy(recorded[name])
+            body["guild_id"] = server
+            body["id"] = str(int(body["id"]) + i)
+            body["token"] = f"{body['token']}-{i}"
+            for option in body.get("data", {}).get("options", []):
+                if option["name"] in (options or {}):
+                    option["value"] = options[option["name"]]
+            return body
+
+        requests["ping"].append(recorded["ping"])
+        requests["tally-deaths"].append(interaction("tally-deaths"))
+
+        ranged = interaction("tally-deaths")
+        ranged["data"]["options"] = [
+            {"name": "start-time", "type": 3, "value": "2000-01-01"},
+            {"name": "end-time", "type": 3, "value": time.strftime("%Y-%m-%d")},
+        ]
+        requests["tally-deaths-ranged"].append(ranged)
+
+        # a cursor deep in the leaderboard, where an OFFSET would have to skip every row before it
+        tally_page = interaction("tally-page")
+        tally_page["data"]["custom_id"] = f"tally:after:{i + 50}:2:"
+        requests["tally-page"].append(tally_page)
+
+        requests["get-death"].append(interaction("get-death", {"dead-person": dead_person}))
+
+        for stat in ("top-reporters", "deaths-per-week", "longest-gaps", "current-gaps"):
+            requests[f"death-stats-{stat}"].append(interaction("death-stats", {"stat": stat}))
+
+        guild_death = interaction("get-death")
+        guild_death["data"].pop("options")
+        requests["get-death-guild"].append(guild_death)
+
+        # only a slice of the rows are removed and added, the reads above stay representative
+        if i % 10 == 0:
+            requests["remove-death"].append(interaction("remove-death", {
+                "death-message-link": f"https://discord.com/channels/{server}/channel/{message_id}",
+            }))
+
+            add_death = interaction("add-death", {"dead-person": dead_person})
+            for attachment in add_death["data"]["resolved"]["attachments"].values():
+                attachment["url"] = f"{image_url}/{i}.png"
+            requests["add-death"].append(add_death)
+
+    return requests
+
+
+def run_handlers(flask_app, signing_key: SigningKey, requests: Dict[str, List[Dict]]) -> Dict:
+    client = flask_app.test_client()
+    results = {}
+
+    for command, bodies in requests.items():
+        timings = []
+        for body in bodies:
+            encoded = python_json.dumps(body).encode()
+            timestamp = str(int(time.time()))
+            headers = {
+                "Content-Type": "application/json",
+                "X-Signature-Ed25519": signing_key.sign(timestamp.encode() + encoded).signature.hex(),
+                "X-Signature-Timestamp": timestamp,
+            }
+
+            began = time.perf_counter()
+            response = client.post("/interactions", data=encoded, headers=headers)
+            timings.append(time.perf_counter() - began)
+
+            if response.status_code != 200 or "Technobabble" in response.get_data(as_text=True):
+                raise RuntimeError(f"{command} failed: {response.get_data(as_text=True)}")
+
+        results[command] = summarize(timings)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the db.db functions, the slash command handlers and the tasks against a generated database.")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--victims", type=int, default=200)
+    parser.add_argument("--deaths", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--attachment-bytes", type=int, default=450)
+    parser.add_argument("--victim-skew", type=float, default=1.1)
+    parser.add_argument("--guild-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per db.db function")
+    parser.add_argument("--requests", type=int, default=200, help="requests per slash command")
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--cache", action="store_true", help="leave the query cache on, off by default to measure the queries")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    signing_key = SigningKey.generate()
+    payloads = load_payloads()
+
+    with image_server() as images, s3_server() as s3, discord_server() as discord, tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "deaths.db")
+        began = time.perf_counter()
+        dataset = generate_database(
+            database_path,
+            args.guilds,
+            args.victims,
+            args.deaths,
+            args.days,
+            args.attachment_bytes,
+            args.victim_skew,
+            args.guild_skew,
+            seed=args.seed,
+        )
+        generate_seconds = time.perf_counter() - began
+
+        os.environ.update({
+            "RIP_BOT_PUBLIC_KEY": signing_key.verify_key.encode().hex(),
+            "DATABASE_PATH": database_path,
+            "CELERY_BROKER": "memory://",
+            "CELERY_RESULT_BACKEND": "cache+memory://",
+            "QUERY_CACHE_TTL": "60" if args.cache else "0",
+            # the worker runs in this process, so its invalidations reach the cache without Redis
+            "QUERY_CACHE_LOCAL_ONLY": "1",
+            "S3_BUCKET": "rip-bot-bench",
+            "S3_ENDPOINT_URL": s3.url,
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "AWS_DEFAULT_REGION": "ca-central-1",
+            "DISCORD_API_BASE": discord.url,
+            "DISCORD_BOT_APPLICATION_ID": "bench",
+            "AUTHORIZATION": "Bot bench",
+            "IMAGE_SPOOL_DIR": directory,
+        })
+
+        from celery.contrib.testing.worker import start_worker
+        from celery.signals import before_task_publish, task_postrun, task_prerun
+
+        from db.db import pooled_cursor
+        import interactions.app as interactions_app
+        import tasks.tasks as app_tasks
+
+        # rows sampled uniformly, so the guilds and victims asked about follow the generated skew
+        with pooled_cursor(database_path) as cursor:
+            cursor.execute("SELECT rowid, server, dead_person, message_id FROM deaths ORDER BY random() LIMIT ?", (SAMPLE_ROWS,))
+            samples = cursor.fetchall()
+
+        db_results = run_db_functions(database_path, samples, args.days, args.iterations)
+
+        published = 0
+        finished = threading.Condition()
+        task_started: Dict[str, float] = {}
+        task_timings = defaultdict(list)
+
+        @before_task_publish.connect(weak=False)
+        def count_publish(**kwargs):
+            nonlocal published
+            with finished:
+                published += 1
+
+        @task_prerun.connect(weak=False)
+        def record_start(task_id=None, **kwargs):
+            task_started[task_id] = time.perf_counter()
+
+        @task_postrun.connect(weak=False)
+        def record_finish(task_id=None, task=None, **kwargs):
+            with finished:
+                task_timings[task.name.rsplit(".", 1)[-1]].append(time.perf_counter() - task_started.pop(task_id))
+                finished.notify_all()
+
+        app_tasks.app.conf.broker_transport_options = {"polling_interval": 0.005}
+        requests = build_requests(payloads, samples, f"{images.url}/{args.image_bytes}", args.requests)
+
+        with start_worker(app_tasks.app, pool="threads", concurrency=8, perform_ping_check=False):
+            handler_results = run_handlers(interactions_app.app, signing_key, requests)
+            with finished:
+                finished.wait_for(lambda: sum(len(timings) for timings in task_timings.values()) >= published, timeout=120)
+
+        task_results = {name: summarize(timings) for name, timings in task_timings.items()}
+
+    results = {
+        "benchmark": "suite",
+        "revision": git_revision(),
+        "dataset": {**dataset, "path": None, "generate_seconds": generate_seconds},
+        "cache": args.cache,
+        "db_functions": db_results,
+        "handlers": handler_results,
+        "tasks": task_results,
+        "stubs": {"images": images.counters, "s3": s3.counters, "discord": discord.counters},
+    }
+
+    encoded = python_json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(encoded + "\n")
+    print(encoded)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import hashlib
+import json as python_json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# local stand-ins for the services the tasks talk to, each runs on its own thread
+# and counts what it received so benchmarks can report requests and bytes
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, Nagle would hold the body back on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = decode_aws_chunked(body)
+        return body
+
+    def respond(self, status: int, body: bytes = b"", headers: Dict[str, str] = {}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+def decode_aws_chunked(body: bytes) -> bytes:
+    # botocore streams uploads as "<hex size>[;signature]\r\n<data>\r\n" chunks followed by trailers
+    decoded = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(decoded)
+        decoded += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serves GET /<bytes>/<name> as an image of that many bytes, streamed like a CDN would."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        size = int(self.path.strip("/").split("/")[0])
+        self.server.count("downloads")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.count("bytes_sent", size)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+
+        # deterministic content per size so repeated downloads hash the same
+        block = hashlib.sha256(str(size).encode()).digest() * (STREAM_CHUNK_SIZE // 32)
+        remaining = size
+        while remaining > 0:
+            chunk = block[:min(remaining, STREAM_CHUNK_SIZE)]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+
+class S3Handler(QuietHandler):
+    """Just enough of the S3 REST API (path-style) for put_object, upload_fileobj, head_object and get_object."""
+
+    def split_path(self) -> Tuple[str, Dict]:
+        parsed = urlparse(self.path)
+        return parsed.path.lstrip("/"), parse_qs(parsed.query, keep_blank_values=True)
+
+    def do_PUT(self):
+        path, query = self.split_path()
+        body = self.read_body()
+        self.server.count("bytes_received", len(body))
+
+        if "uploadId" in query:
+            self.server.count("upload_part_requests")
+            with self.server.lock:
+                self.server.uploads[query["uploadId"][0]][int(query["partNumber"][0])] = body
+        else:
+            self.server.count("put_object_requests")
+            with self.server.lock:
+                self.server.objects[path] = body
+
+        self.respond(200, headers={"ETag": f"\"{hashlib.md5(body).hexdigest()}\""})
+
+    def do_POST(self):
+        path, query = self.split_path()
+        self.read_body()
+        bucket, key = path.split("/", 1)
+
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.uploads[upload_id] = {}
+            self.respond(200, (
+                f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            ).encode())
+            return
+
+        self.server.count("complete_multipart_requests")
+        with self.server.lock:
+            parts = self.server.uploads.pop(query["uploadId"][0])
+            self.server.objects[path] = b"".join(parts[number] for number in sorted(parts))
+        self.respond(200, (
+            f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+            f"<ETag>\"{uuid.uuid4().hex}\"</ETag></CompleteMultipartUploadResult>"
+        ).encode())
+
+    def do_HEAD(self):
+        path, _ = self.split_path()
+        self.server.count("head_object_requests")
+        body = self.server.objects.get(path)
+        if body is None:
+            self.respond(404)
+        else:
+            self.respond(200, body, {"Content-Type": "application/octet-stream"})
+
+    def do_GET(self):
+        path, _ = self.split_path()
+        body = self.server.objects.get(path)
+        if body is None:
+            self.respond(404, b"<Error><Code>NoSuchKey</Code></Error>")
+        else:
+            self.respond(200, body, {"Content-Type": "application/octet-stream"})
+
+
+class DiscordHandler(QuietHandler):
+    """
+    Accepts the webhook and channel message routes the tasks use and answers like Discord,
+    including X-RateLimit-* headers and 429s once a route's bucket is spent.
+    """
+
+    def handle_message_route(self):
+        self.read_body()
+        route = f"{self.command} {self.path.split('?')[0]}"
+        self.server.count("requests")
+
+        remaining, reset_after = self.take_from_bucket(route)
+        headers = {
+            "Content-Type": "application/json",
+            "X-RateLimit-Bucket": hashlib.md5(route.encode()).hexdigest(),
+            "X-RateLimit-Limit": str(self.server.rate_limit or 0),
+            "X-RateLimit-Remaining": str(max(remaining, 0)),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+        }
+        if remaining < 0:
+            self.server.count("rate_limited")
+            headers["Retry-After"] = f"{reset_after:.3f}"
+            self.respond(429, python_json.dumps({"message": "You are being rate limited.", "retry_after": reset_after, "global": False}).encode(), headers)
+            return
+
+        path = urlparse(self.path)
+        if self.command == "GET" and path.path.startswith("/channels/") and path.path.endswith("/messages"):
+            self.server.count("history_requests")
+            query = parse_qs(path.query)
+            history = self.server.channel_history(path.path.split("/")[2], int(query.get("after", ["0"])[0]), int(query.get("limit", ["50"])[0]))
+            self.respond(200, python_json.dumps(history).encode(), headers)
+            return
+
+        message_id = str(self.server.next_message_id())
+        self.respond(200, python_json.dumps({"id": message_id, "content": ""}).encode(), headers)
+
+    def take_from_bucket(self, route: str) -> Tuple[int, float]:
+        if not self.server.rate_limit:
+            return 1, 0.0
+
+        now = time.monotonic()
+        with self.server.lock:
+            used, resets_at = self.server.buckets.get(route, (0, now + self.server.rate_limit_window))
+            if resets_at <= now:
+                used, resets_at = 0, now + self.server.rate_limit_window
+            used += 1
+            self.server.buckets[route] = (used, resets_at)
+
+        return self.server.rate_limit - used, resets_at - now
+
+    do_GET = handle_message_route
+    do_PATCH = handle_message_route
+    do_POST = handle_message_route
+
+
+def image_server(latency: float = 0.0) -> StubServer:
+    # latency seconds before each response starts, a CDN further away than localhost
+    server = StubServer(ImageHandler)
+    server.latency = latency
+    return server
+
+
+def s3_server() -> StubServer:
+    server = StubServer(S3Handler)
+    server.objects: Dict[str, bytes] = {}
+    server.uploads: Dict[str, Dict[int, bytes]] = {}
+    return server
+
+
+def discord_server(rate_limit: int = 0, rate_limit_window: float = 1.0) -> StubServer:
+    # rate_limit requests per route per window, 0 turns rate limiting off
+    server = StubServer(DiscordHandler)
+    server.rate_limit = rate_limit
+    server.rate_limit_window = rate_limit_window
+    server.buckets: Dict[str, Tuple[int, float]] = {}
+    message_ids = iter(range(10 ** 17, 10 ** 18))
+    server.next_message_id = lambda: next(message_ids)
+    # channel ID -> messages, GET /channels/{channel_id}/messages?after= pages through them like Discord
+    server.channel_messages: Dict[str, List[Dict]] = {}
+    server.channel_history = lambda channel_id, after, limit: sorted(
+        (message for message in server.channel_messages.get(channel_id, []) if int(message["id"]) > after),
+        key=lambda message: int(message["id"]),
+    )[:limit][::-1]
+    return server
@@ -0,0 +1,418 @@
+import argparse
+import csv
+import importlib
+import io
+import itertools
+import json as python_json
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from db.db import compress_attachment, configure_connection, decompress_attachment
+from migrations.runner import MIGRATIONS, connect_to_database, get_applied_versions
+
+# pyarrow is optional, only the Parquet format needs it
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DATABASE_PATH = os.getenv("DATABASE_PATH")
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# what an export holds and an import expects, the attachment comes from death_attachments
+DEATH_COLUMNS = ("server", "channel_id", "message_id", "dead_person", "caption", "attachment", "image_url", "timestamp", "reporter")
+HOT_DEATH_COLUMNS = tuple(column for column in DEATH_COLUMNS if column != "attachment")
+# rows already imported are skipped, so re-importing an export is harmless. The unique index catches
+# the same message ID, a death without one is matched on who died when, where and by whose report.
+# rowids are given explicitly so the attachments can be keyed on them without a lookup per row
+IMPORT_DEATH_SQL = f"""INSERT OR IGNORE INTO deaths (rowid, {", ".join(HOT_DEATH_COLUMNS)})
+    SELECT :rowid, {", ".join(":" + column for column in HOT_DEATH_COLUMNS)}
+    WHERE :message_id IS NOT NULL OR NOT EXISTS (SELECT 1 FROM deaths WHERE server = :server AND timestamp = :timestamp
+        AND dead_person = :dead_person AND channel_id IS :channel_id AND reporter IS :reporter)"""
+# what the lookup above for a death without a message ID goes through
+NATURAL_KEY_INDEX = "deaths_server_timestamp_dead_person"
+# only for the rows the insert above didn't skip
+IMPORT_DEATH_ATTACHMENT_SQL = """INSERT OR REPLACE INTO death_attachments (death_rowid, attachment)
+    SELECT :rowid, :attachment WHERE :attachment IS NOT NULL AND EXISTS (SELECT 1 FROM deaths WHERE rowid = :rowid)"""
+SELECT_MAX_DEATH_ROWID_SQL = """SELECT IFNULL(MAX(rowid), 0) FROM deaths"""
+SELECT_DEATHS_SQL = f"""SELECT {", ".join("death_attachments.attachment" if column == "attachment" else "deaths." + column for column in DEATH_COLUMNS)}
+    FROM deaths LEFT JOIN death_attachments ON death_attachments.death_rowid = deaths.rowid"""
+SELECT_GUILD_DEATHS_SQL = f"""{SELECT_DEATHS_SQL} WHERE deaths.server = :guild_id"""
+
+CREATE_BULK_CHECKPOINTS_SQL = """CREATE TABLE IF NOT EXISTS bulk_checkpoints (
+    job TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    completed_at INTEGER
+)"""
+SELECT_CHECKPOINT_SQL = """SELECT position, rows, completed_at FROM bulk_checkpoints WHERE job = :job"""
+UPSERT_CHECKPOINT_SQL = """INSERT INTO bulk_checkpoints VALUES (:job, :position, :rows, :updated_at, :completed_at)
+    ON CONFLICT (job) DO UPDATE SET position = :position, rows = :rows, updated_at = :updated_at, completed_at = :completed_at"""
+DELETE_CHECKPOINT_SQL = """DELETE FROM bulk_checkpoints WHERE job = :job"""
+
+# indexes and triggers dropped for an import are parked here until they're rebuilt,
+# so an import that dies halfway can still put them back
+CREATE_BULK_DEFERRED_SCHEMA_SQL = """CREATE TABLE IF NOT EXISTS bulk_deferred_schema (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    sql TEXT NOT NULL
+)"""
+# the unique message ID index and the natural key index stay, IMPORT_DEATH_SQL needs them to skip rows already imported.
+# triggers are narrowed down to the aggregates' by defer_schema, the cascade deletes stay installed
+SELECT_DEFERRABLE_SCHEMA_SQL = f"""SELECT name, type, sql FROM sqlite_master
+    WHERE tbl_name = 'deaths' AND sql IS NOT NULL
+    AND (type = 'trigger' OR (type = 'index' AND sql NOT LIKE 'CREATE UNIQUE%' AND name != '{NATURAL_KEY_INDEX}'))"""
+CREATE_TRIGGER_NAME = re.compile(r"CREATE TRIGGER IF NOT EXISTS (\w+)")
+INSERT_DEFERRED_SCHEMA_SQL = """INSERT OR IGNORE INTO bulk_deferred_schema VALUES (:name, :type, :sql)"""
+SELECT_DEFERRED_SCHEMA_SQL = """SELECT name, type, sql FROM bulk_deferred_schema"""
+
+ATTACHMENT_INDEX = DEATH_COLUMNS.index("attachment")
+
+FORMATS = ("ndjson", "csv", "parquet")
+FORMAT_EXTENSIONS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".parquet": "parquet"}
+
+# reads the batch after position, returns its parameters and the position after it, or None when done
+BatchReader = Callable[[int], Optional[Tuple[List[Any], int]]]
+# writes one batch's parameters, inside the transaction run_batches opened for it
+BatchWriter = Callable[[sqlite3.Connection, List[Any]], Any]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # autocommit, the engine opens a transaction per batch
+    return configure_connection(connect_to_database(path))
+
+
+def get_checkpoint(connection: sqlite3.Connection, job: str) -> Tuple[int, int, Optional[int]]:
+    connection.execute(CREATE_BULK_CHECKPOINTS_SQL)
+    row = connection.execute(SELECT_CHECKPOINT_SQL, {"job": job}).fetchone()
+    return row if row else (0, 0, None)
+
+
+def save_checkpoint(connection: sqlite3.Connection, job: str, position: int, rows: int, completed: bool = False):
+    now = int(time.time())
+    connection.execute(UPSERT_CHECKPOINT_SQL, {
+        "job": job,
+        "position": position,
+        "rows": rows,
+        "updated_at": now,
+        "completed_at": now if completed else None,
+    })
+
+
+def reset_checkpoint(connection: sqlite3.Connection, job: str):
+    connection.execute(CREATE_BULK_CHECKPOINTS_SQL)
+    connection.execute(DELETE_CHECKPOINT_SQL, {"job": job})
+
+
+def run_batches(connection: sqlite3.Connection, job: str, write_batch: BatchWriter, read_batch: BatchReader) -> Dict:
+    """
+    Applies write_batch to each batch read_batch returns, one transaction per batch.
+
+    The checkpoint for job is saved in the same transaction as its batch, so a job that is
+    interrupted and run again picks up after the last committed batch, and a completed job
+    does nothing until its checkpoint is reset.
+    """
+    position, rows, completed_at = get_checkpoint(connection, job)
+    if completed_at:
+        return {"job": job, "rows": rows, "batches": 0, "resumed": False, "completed": True}
+
+    resumed = position > 0
+    batches = 0
+    while True:
+        batch = read_batch(position)
+        if batch is None:
+            break
+
+        parameters, position = batch
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            write_batch(connection, parameters)
+            rows += len(parameters)
+            save_checkpoint(connection, job, position, rows)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        batches += 1
+
+    save_checkpoint(connection, job, position, rows, completed=True)
+    return {"job": job, "rows": rows, "batches": batches, "resumed": resumed, "completed": True}
+
+
+def update_in_batches(
+    connection: sqlite3.Connection,
+    job: str,
+    columns: Sequence[str],
+    update_sql: str,
+    transform: Callable[[Tuple], Optional[Dict]],
+    where: str = "1",
+    batch_size: int = BULK_BATCH_SIZE,
+) -> Dict:
+    """
+    Walks deaths in rowid order, batch_size rows at a time, and runs update_sql for every row
+    transform returns parameters for. transform gets (rowid, *columns).
+    """
+    select_sql = f"""SELECT rowid, {", ".join(columns)} FROM deaths WHERE rowid > :after AND ({where}) ORDER BY rowid LIMIT :batch_size"""
+
+    def read_batch(after: int) -> Optional[Tuple[List[Dict], int]]:
+        rows = connection.execute(select_sql, {"after": after, "batch_size": batch_size}).fetchall()
+        if not rows:
+            return None
+
+        parameters = [parameter for parameter in map(transform, rows) if parameter is not None]
+        return parameters, rows[-1][0]
+
+    return run_batches(connection, job, lambda connection, parameters: connection.executemany(update_sql, parameters), read_batch)
+
+
+def insert_deaths(connection: sqlite3.Connection, records: List[Dict]):
+    """
+    Inserts records (DEATH_COLUMNS) inside the caller's transaction, deaths first and then
+    the compressed attachments of the ones that weren't already there.
+    """
+    first_rowid = connection.execute(SELECT_MAX_DEATH_ROWID_SQL).fetchone()[0] + 1
+    parameters = [
+        {**record, "rowid": rowid, "attachment": compress_attachment(record.get("attachment"))}
+        for rowid, record in enumerate(records, first_rowid)
+    ]
+    connection.executemany(IMPORT_DEATH_SQL, parameters)
+    connection.executemany(IMPORT_DEATH_ATTACHMENT_SQL, parameters)
+
+
+def get_aggregate_modules(connection: sqlite3.Connection) -> List[Any]:
+    # the aggregates the applied migrations maintain with triggers on deaths
+    applied = get_applied_versions(connection)
+    modules = [importlib.import_module(name) for version, name in MIGRATIONS if version in applied]
+    return [module for module in modules if hasattr(module, "backfill")]
+
+
+def get_aggregate_triggers(connection: sqlite3.Connection) -> Set[str]:
+    # the triggers an aggregate module creates, which its backfill can make up for. The others, like
+    # deaths_attachment_delete, keep side tables in step with deaths and would leave orphans behind
+    return {
+        name
+        for module in get_aggregate_modules(connection)
+        for attribute, sql in vars(module).items() if attribute.endswith("_TRIGGER_SQL")
+        for name in CREATE_TRIGGER_NAME.findall(sql)
+    }
+
+
+def defer_schema(connection: sqlite3.Connection) -> List[str]:
+    """Drops the secondary indexes and the aggregate triggers on deaths, remembering how to rebuild them."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(CREATE_BULK_DEFERRED_SCHEMA_SQL)
+        aggregate_triggers = get_aggregate_triggers(connection)
+        deferred = [
+            (name, kind, sql) for name, kind, sql in connection.execute(SELECT_DEFERRABLE_SCHEMA_SQL)
+            if kind == "index" or name in aggregate_triggers
+        ]
+        for name, kind, sql in deferred:
+            connection.execute(INSERT_DEFERRED_SCHEMA_SQL, {"name": name, "type": kind, "sql": sql})
+            connection.execute(f"DROP {kind.upper()} {name}")
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    return [name for name, _, _ in deferred]
+
+
+def restore_schema(connection: sqlite3.Connection) -> List[str]:
+    """
+    Rebuilds what defer_schema dropped: indexes first, then every aggregate from scratch,
+    then the triggers, all in one transaction so readers never see stale aggregates with live triggers.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(CREATE_BULK_DEFERRED_SCHEMA_SQL)
+        deferred = connection.execute(SELECT_DEFERRED_SCHEMA_SQL).fetchall()
+        for _, kind, sql in deferred:
+            if kind == "index":
+                connection.execute(sql)
+
+        if any(kind == "trigger" for _, kind, _ in deferred):
+            for module in get_aggregate_modules(connection):
+                module.backfill(connection)
+
+        for _, kind, sql in deferred:
+            if kind == "trigger":
+                connection.execute(sql)
+
+        connection.execute("DELETE FROM bulk_deferred_schema")
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    if deferred:
+        connection.execute("ANALYZE deaths")
+
+    return [name for name, _, _ in deferred]
+
+
+def guess_format(path: str) -> str:
+    _, extension = os.path.splitext(path)
+    if extension not in FORMAT_EXTENSIONS:
+        raise ValueError(f"can't tell the format of {path}, pass --format")
+
+    return FORMAT_EXTENSIONS[extension]
+
+
+def require_pyarrow():
+    if not pyarrow:
+        raise RuntimeError("the parquet format needs pyarrow installed")
+
+
+def parquet_schema():
+    return pyarrow.schema([(column, pyarrow.int64() if column == "timestamp" else pyarrow.string()) for column in DEATH_COLUMNS])
+
+
+def read_death_batches(connection: sqlite3.Connection, guild_id: Optional[str], batch_size: int) -> Iterator[List[Tuple]]:
+    # one read transaction streamed with fetchmany, so the export is a consistent snapshot
+    # and only batch_size rows are in memory at a time
+    connection.execute("BEGIN")
+    try:
+        cursor = connection.execute(SELECT_GUILD_DEATHS_SQL if guild_id else SELECT_DEATHS_SQL, {"guild_id": guild_id})
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [row[:ATTACHMENT_INDEX] + (decompress_attachment(row[ATTACHMENT_INDEX]),) + row[ATTACHMENT_INDEX + 1:] for row in rows]
+    finally:
+        connection.execute("COMMIT")
+
+
+def export_deaths(connection: sqlite3.Connection, output: IO[bytes], format: str, guild_id: Optional[str] = None, batch_size: int = BULK_BATCH_SIZE) -> int:
+    exported = 0
+    batches = read_death_batches(connection, guild_id, batch_size)
+
+    if format == "parquet":
+        require_pyarrow()
+        schema = parquet_schema()
+        with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+            for rows in batches:
+                # every batch is a row group
+                writer.write_table(pyarrow.Table.from_pylist([dict(zip(DEATH_COLUMNS, row)) for row in rows], schema))
+                exported += len(rows)
+        return exported
+
+    if format == "csv":
+        text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(DEATH_COLUMNS)
+        for rows in batches:
+            writer.writerows(rows)
+            exported += len(rows)
+        # hand output back to the caller open
+        text.flush()
+        text.detach()
+        return exported
+
+    for rows in batches:
+        output.write(b"".join(python_json.dumps(dict(zip(DEATH_COLUMNS, row))).encode() + b"\n" for row in rows))
+        exported += len(rows)
+    return exported
+
+
+def read_death_records(path: str, format: str) -> Iterator[Dict]:
+    if format == "parquet":
+        require_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=BULK_BATCH_SIZE, columns=list(DEATH_COLUMNS)):
+            yield from batch.to_pylist()
+        return
+
+    with open(path, newline="", encoding="utf-8") as records:
+        if format == "csv":
+            for record in csv.DictReader(records):
+                # CSV has no NULL, an empty message ID is an unresolved one
+                record["message_id"] = record["message_id"] or None
+                record["timestamp"] = int(float(record["timestamp"]))
+                yield record
+            return
+
+        for line in records:
+            if line.strip():
+                yield python_json.loads(line)
+
+
+def import_deaths(connection: sqlite3.Connection, path: str, format: str, job: Optional[str] = None, defer_indexes: bool = True, batch_size: int = BULK_BATCH_SIZE) -> Dict:
+    """
+    Inserts every record in path in batched transactions, resuming after the last committed batch
+    if the same job was interrupted. With defer_indexes the secondary indexes and aggregate triggers
+    are dropped for the import and rebuilt once at the end.
+    """
+    job = job or f"import:{os.path.abspath(path)}"
+    position, _, completed_at = get_checkpoint(connection, job)
+    if completed_at:
+        return {"job": job, "rows": 0, "batches": 0, "resumed": False, "completed": True, "deferred": [], "restored": restore_schema(connection)}
+
+    records = itertools.islice(read_death_records(path, format), position, None)
+
+    def read_batch(position: int) -> Optional[Tuple[List[Dict], int]]:
+        batch = [{column: record.get(column) for column in DEATH_COLUMNS} for record in itertools.islice(records, batch_size)]
+        if not batch:
+            return None
+        return batch, position + len(batch)
+
+    deferred = defer_schema(connection) if defer_indexes else []
+    result = run_batches(connection, job, insert_deaths, read_batch)
+    # also rebuilds whatever an earlier, interrupted run of this job deferred
+    restored = restore_schema(connection)
+
+    return {**result, "deferred": deferred, "restored": restored}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk export and import of the deaths table.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="stream deaths to a file, or stdout with -")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--guild", help="only this guild's deaths")
+    export_parser.add_argument("--format", choices=FORMATS)
+    export_parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+
+    import_parser = commands.add_parser("import", help="insert deaths from an export")
+    import_parser.add_argument("input")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--job", help="checkpoint name, defaults to one per input path")
+    import_parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    import_parser.add_argument("--no-defer-indexes", action="store_true", help="keep indexes and triggers live, for small imports into a busy database")
+    import_parser.add_argument("--restart", action="store_true", help="forget the job's checkpoint and start over")
+
+    commands.add_parser("restore-schema", help="rebuild indexes and triggers left deferred by an interrupted import")
+
+    args = parser.parse_args()
+    connection = connect(DATABASE_PATH)
+    began = time.perf_counter()
+
+    if args.command == "export":
+        format = args.format or ("ndjson" if args.output == "-" else guess_format(args.output))
+        if args.output == "-":
+            result = {"rows": export_deaths(connection, sys.stdout.buffer, format, args.guild, args.batch_size)}
+        else:
+            with open(args.output, "wb") as output:
+                result = {"rows": export_deaths(connection, output, format, args.guild, args.batch_size)}
+    elif args.command == "import":
+        job = args.job or f"import:{os.path.abspath(args.input)}"
+        if args.restart:
+            reset_checkpoint(connection, job)
+        result = import_deaths(connection, args.input, args.format or guess_format(args.input), job, not args.no_defer_indexes, args.batch_size)
+    else:
+        result = {"restored": restore_schema(connection)}
+
+    connection.close()
+    # stdout may be the export itself
+    print(python_json.dumps({**result, "elapsed_seconds": time.perf_counter() - began}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import json as python_json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics.metrics import QUERY_CACHE_EVENTS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# the Celery result backend's Redis doubles as the shared cache when there is one
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "")
+QUERY_CACHE_REDIS_URL = os.getenv(
+    "QUERY_CACHE_REDIS_URL",
+    CELERY_RESULT_BACKEND if CELERY_RESULT_BACKEND.startswith(("redis://", "rediss://")) else "",
+)
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "4096"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# without Redis a Celery worker's invalidate() never reaches the web workers, which would serve removed
+# deaths and stale counts for the whole TTL. So the cache is off unless writes and reads share a process
+QUERY_CACHE_LOCAL_ONLY = os.getenv("QUERY_CACHE_LOCAL_ONLY", "0") == "1"
+
+REDIS_KEY_PREFIX = "rip-bot:query-cache"
+
+
+class QueryCache:
+    """
+    Read-through LRU cache for query results, bounded by entry count and approximate size.
+
+    Every guild has a generation number that writers bump through invalidate(). Entries
+    remember the generation they were computed under and are ignored once it changes.
+    With Redis the generation (and the cached values) are shared, so a Celery worker's
+    write invalidates every web worker. Without Redis only the local process sees the
+    bump, which is why create_query_cache turns the cache off then. A ttl of 0 or less
+    disables it, every lookup computes.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, redis_client: Optional[Any] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.redis_client = redis_client
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[int, float, int, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, guild_id: str, key: Tuple[Hashable, ...], compute: Callable[[], Any]) -> Any:
+        if self.ttl <= 0:
+            return compute()
+
+        generation = self._get_generation(guild_id)
+        entry_key = (guild_id, *key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry:
+                entry_generation, expires_at, _, value = entry
+                if entry_generation == generation and expires_at > now:
+                    self._entries.move_to_end(entry_key)
+                    self.hits += 1
+                    QUERY_CACHE_EVENTS.labels("hit").inc()
+                    return value
+
+        encoded = self._get_shared(guild_id, generation, key)
+        if encoded is not None:
+            value = python_json.loads(encoded)
+            with self._lock:
+                self.shared_hits += 1
+            QUERY_CACHE_EVENTS.labels("shared_hit").inc()
+        else:
+            with self._lock:
+                self.misses += 1
+            QUERY_CACHE_EVENTS.labels("miss").inc()
+            value = compute()
+            encoded = python_json.dumps(value)
+            self._set_shared(guild_id, generation, key, encoded)
+
+        self._store(entry_key, generation, now + self.ttl, len(encoded), value)
+        return value
+
+    def invalidate(self, guild_id: str):
+        with self._lock:
+            self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+
+        if self.redis_client:
+            try:
+                self.redis_client.incr(f"{REDIS_KEY_PREFIX}:generation:{guild_id}")
+            except redis.RedisError:
+                pass # entries expire by TTL
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _get_generation(self, guild_id: str) -> int:
+        if self.redis_client:
+            try:
+                return int(self.redis_client.get(f"{REDIS_KEY_PREFIX}:generation:{guild_id}") or 0)
+            except redis.RedisError:
+                pass
+
+        with self._lock:
+            return self._generations.get(guild_id, 0)
+
+    def _get_shared(self, guild_id: str, generation: int, key: Tuple) -> Optional[bytes]:
+        if not self.redis_client:
+            return None
+
+        try:
+            return self.redis_client.get(self._shared_key(guild_id, generation, key))
+        except redis.RedisError:
+            return None
+
+    def _set_shared(self, guild_id: str, generation: int, key: Tuple, encoded: str):
+        if not self.redis_client:
+            return
+
+        try:
+            self.redis_client.set(self._shared_key(guild_id, generation, key), encoded, ex=max(1, int(self.ttl)))
+        except redis.RedisError:
+            pass
+
+    def _shared_key(self, guild_id: str, generation: int, key: Tuple) -> str:
+        return f"{REDIS_KEY_PREFIX}:{guild_id}:{generation}:{python_json.dumps(key)}"
+
+    def _store(self, entry_key: Tuple, generation: int, expires_at: float, size: int, value: Any):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(entry_key, None)
+            if previous:
+                self._bytes -= previous[2]
+
+            self._entries[entry_key] = (generation, expires_at, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                QUERY_CACHE_EVENTS.labels("eviction").inc()
+
+
+def create_query_cache() -> QueryCache:
+    redis_client = None
+    if QUERY_CACHE_REDIS_URL and redis:
+        redis_client = redis.Redis.from_url(QUERY_CACHE_REDIS_URL, socket_timeout=0.25)
+
+    ttl = QUERY_CACHE_TTL
+    if not redis_client and not QUERY_CACHE_LOCAL_ONLY and ttl > 0:
+        reason = "the redis package isn't installed" if QUERY_CACHE_REDIS_URL else "neither QUERY_CACHE_REDIS_URL nor a redis:// CELERY_RESULT_BACKEND is set"
+        logging.getLogger(__name__).warning(
+            f"query cache disabled, {reason} so invalidations wouldn't reach other processes. "
+            "Set QUERY_CACHE_LOCAL_ONLY=1 if reads and writes run in one process"
+        )
+        ttl = 0
+
+    return QueryCache(ttl, QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_MAX_BYTES, redis_client)
+
+
+query_cache = create_query_cache()
@@ -1,22 +1,167 @@
+import json as python_json
+import math
+import os
 import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from numbers import Number
 import secrets
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
-INSERT_DEATH_SQL = """INSERT INTO deaths VALUES (:server, :channel_id, :message_id, :dead_person, :caption, :attachment, :image_url, :timestamp, :reporter)"""
-SELECT_DEADPERSON_COUNT_SQL = """SELECT dead_person, COUNT(rowid) FROM deaths WHERE server = :guild_id GROUP BY dead_person"""
-SELECT_DEADPERSON_COUNT_BY_TIME_SQL = """SELECT dead_person, COUNT(rowid) FROM deaths WHERE timestamp BETWEEN :start_time AND :end_time AND server = :guild_id GROUP BY dead_person"""
-SELECT_DEADPERSON_SQL = """SELECT caption, attachment, timestamp, reporter FROM deaths WHERE server = :guild_id AND dead_person = :dead_person"""
+from metrics.metrics import timed_sql
+
+INSERT_DEATH_SQL = """INSERT INTO deaths (server, channel_id, message_id, dead_person, caption, image_url, timestamp, reporter) VALUES (:server, :channel_id, :message_id, :dead_person, :caption, :image_url, :timestamp, :reporter)"""
+# attachment JSON is stored compressed in its own table, off the pages the tallies read
+INSERT_DEATH_ATTACHMENT_SQL = """INSERT INTO death_attachments (death_rowid, attachment) VALUES (:death_rowid, :attachment)"""
+SELECT_DEADPERSON_COUNT_SQL = """SELECT dead_person, count FROM death_tallies WHERE server = :guild_id ORDER BY count DESC, dead_person LIMIT :limit"""
+# leaderboard pages are keyset cursors on (count DESC, dead_person), each half of the UNION is one range
+# of the death_tallies_server_count index so a page reads only the rows it returns, however deep it is
+SELECT_DEADPERSON_COUNT_AFTER_SQL = """SELECT dead_person, count FROM (
+    SELECT dead_person, count FROM (SELECT dead_person, count FROM death_tallies WHERE server = :guild_id AND count = :count AND dead_person > :dead_person ORDER BY dead_person LIMIT :limit)
+    UNION ALL
+    SELECT dead_person, count FROM (SELECT dead_person, count FROM death_tallies WHERE server = :guild_id AND count < :count ORDER BY count DESC, dead_person LIMIT :limit)
+) LIMIT :limit"""
+# the page before a cursor, read backwards through the index, nearest row first
+SELECT_DEADPERSON_COUNT_BEFORE_SQL = """SELECT dead_person, count FROM (
+    SELECT dead_person, count FROM (SELECT dead_person, count FROM death_tallies WHERE server = :guild_id AND count = :count AND dead_person < :dead_person ORDER BY dead_person DESC LIMIT :limit)
+    UNION ALL
+    SELECT dead_person, count FROM (SELECT dead_person, count FROM death_tallies WHERE server = :guild_id AND count > :count ORDER BY count, dead_person DESC LIMIT :limit)
+) LIMIT :limit"""
+SELECT_DEADPERSON_COUNT_BY_TIME_SQL = """SELECT dead_person, COUNT(rowid) AS count FROM deaths WHERE timestamp BETWEEN :start_time AND :end_time AND server = :guild_id GROUP BY dead_person ORDER BY count DESC, dead_person LIMIT :limit"""
+# whole days come from the death_day_tallies rollup, only the partial days at either edge read raw rows
+SELECT_DEADPERSON_COUNT_BY_DAY_SQL = """SELECT dead_person, SUM(count) AS count FROM (
+    SELECT dead_person, count FROM death_day_tallies WHERE server = :guild_id AND day BETWEEN :first_day AND :last_day
+    UNION ALL
+    SELECT dead_person, 1 AS count FROM deaths WHERE server = :guild_id AND timestamp BETWEEN :start_time AND :head_end_time
+    UNION ALL
+    SELECT dead_person, 1 AS count FROM deaths WHERE server = :guild_id AND timestamp BETWEEN :tail_start_time AND :end_time
+) GROUP BY dead_person ORDER BY count DESC, dead_person LIMIT :limit"""
+SELECT_DEATH_ORDINAL_COUNT_SQL = """SELECT MAX(ordinal) + 1 FROM death_ordinals WHERE server = :guild_id AND dead_person = :dead_person"""
+SELECT_DEATH_BY_ORDINAL_SQL = """SELECT deaths.dead_person, caption, death_attachments.attachment, timestamp, reporter, media_objects.thumbnail_url FROM death_ordinals JOIN deaths ON deaths.rowid = death_ordinals.death_rowid LEFT JOIN death_attachments ON death_attachments.death_rowid = deaths.rowid LEFT JOIN media_objects ON media_objects.url = deaths.image_url WHERE death_ordinals.server = :guild_id AND death_ordinals.dead_person = :dead_person AND ordinal = :ordinal"""
 SELECT_DEADPERSON_BY_MESSAGE_ID = """SELECT rowid, server, channel_id, dead_person, caption, reporter FROM deaths WHERE message_id = :message_id"""
 UPDATE_DEATH_IMAGE_URL_SQL = """UPDATE deaths SET image_url = :image_url WHERE rowid = :rowid"""
 UPDATE_DEATH_MESSAGE_ID_SQL = """UPDATE deaths SET message_id = :message_id WHERE rowid = :rowid"""
 DELETE_BY_ROWID_SQL = """DELETE FROM deaths WHERE rowid = :rowid"""
+SELECT_MEDIA_OBJECT_SQL = """SELECT url, content_type, size, thumbnail_url FROM media_objects WHERE sha256 = :sha256"""
+# two tasks can upload the same new image at once, the first to commit wins and they stored identical bytes
+INSERT_MEDIA_OBJECT_SQL = """INSERT OR IGNORE INTO media_objects VALUES (:sha256, :url, :content_type, :size, :thumbnail_url, :created_at)"""
+SELECT_TASK_STEP_SQL = """SELECT result FROM task_steps WHERE idempotency_key = :idempotency_key AND step = :step"""
+# a plain INSERT, the primary key is what stops two deliveries of one task both completing its step
+INSERT_TASK_STEP_SQL = """INSERT INTO task_steps VALUES (:idempotency_key, :step, :result, :completed_at)"""
+DELETE_TASK_STEPS_BEFORE_SQL = """DELETE FROM task_steps WHERE completed_at < :before"""
+# /death-stats reads only the aggregates add_death_stats maintains, each one a range of a single index
+SELECT_REPORTER_TALLY_SQL = """SELECT reporter, count FROM reporter_tallies WHERE server = :guild_id ORDER BY count DESC, reporter LIMIT :limit"""
+SELECT_DEATH_WEEK_TALLIES_SQL = """SELECT week, count FROM death_week_tallies WHERE server = :guild_id AND week BETWEEN :first_week AND :last_week"""
+SELECT_LONGEST_GAPS_SQL = """SELECT dead_person, longest_gap, longest_gap_end FROM death_gaps WHERE server = :guild_id AND longest_gap IS NOT NULL ORDER BY longest_gap DESC, dead_person LIMIT :limit"""
+SELECT_CURRENT_GAPS_SQL = """SELECT dead_person, last_timestamp FROM death_gaps WHERE server = :guild_id ORDER BY last_timestamp, dead_person LIMIT :limit"""
+# deaths update_database_with_message_id never got a message ID for, NULL or a GARBAGE<uuid> placeholder
+# a since removed one-off script filled in. The placeholders as a range so both halves are lookups in deaths_message_id
+UNRESOLVED_MESSAGE_ID_CONDITION = """(message_id IS NULL OR (message_id >= 'GARBAGE' AND message_id < 'GARBAGF'))"""
+SELECT_UNRESOLVED_MESSAGE_IDS_SQL = f"""SELECT deaths.rowid, server, channel_id, dead_person, reporter, timestamp FROM deaths
+    LEFT JOIN message_id_attempts ON message_id_attempts.death_rowid = deaths.rowid
+    WHERE {UNRESOLVED_MESSAGE_ID_CONDITION} AND timestamp < :before AND IFNULL(attempts, 0) < :max_attempts
+    ORDER BY timestamp LIMIT :limit"""
+SELECT_EXISTING_MESSAGE_IDS_SQL = """SELECT message_id FROM deaths WHERE message_id IN (SELECT value FROM json_each(:message_ids))"""
+# only while still unresolved, update_database_with_message_id may have got there first. OR IGNORE leaves
+# a death unresolved rather than failing the whole batch if its message ID turned up on another death since
+UPDATE_UNRESOLVED_MESSAGE_ID_SQL = f"""UPDATE OR IGNORE deaths SET message_id = :message_id WHERE rowid = :rowid AND {UNRESOLVED_MESSAGE_ID_CONDITION}"""
+UPSERT_MESSAGE_ID_ATTEMPT_SQL = """INSERT INTO message_id_attempts VALUES (:rowid, 1, :attempted_at)
+    ON CONFLICT (death_rowid) DO UPDATE SET attempts = attempts + 1, last_attempt_at = excluded.last_attempt_at"""
+DELETE_MESSAGE_ID_ATTEMPT_SQL = """DELETE FROM message_id_attempts WHERE death_rowid = :rowid"""
+
+# pragmas applied to every pooled connection, WAL lets the web workers read while a task writes
+POOL_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16384", # negative means KiB, so 16 MiB of page cache per connection
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+# sqlite3 keeps prepared statements in a per-connection LRU keyed by the SQL text,
+# so a long-lived connection prepares each *_SQL constant once and reuses it afterwards
+POOL_CACHED_STATEMENTS = 256
+# connections each thread keeps open, one per database it reads, with a shard per guild the least recently used are closed
+POOL_MAX_CONNECTIONS = int(os.getenv("POOL_MAX_CONNECTIONS", "64"))
+
+SECONDS_PER_DAY = 86400
+# weeks start on Monday, day 0 (1970-01-01) was a Thursday
+WEEK_DAY_OFFSET = 3
+# death_ordinals scope holding every death in a guild
+GUILD_SCOPE = ""
+# a concurrent delete can shrink a scope between the count and the lookup, in which case we pick again
+RANDOM_DEATH_ATTEMPTS = 3
+ATTACHMENT_COMPRESSION_LEVEL = 6
+
+_pool = threading.local()
 
 
 def connect_to_database(path: str) -> sqlite3.Connection:
     return sqlite3.connect(path)
 
 
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    for pragma in POOL_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_pooled_connection(path: str) -> sqlite3.Connection:
+    # one connection per (process, thread, path); the pid check drops connections
+    # inherited over fork (gunicorn --preload, Celery prefork) since those can't be shared
+    if getattr(_pool, "pid", None) != os.getpid():
+        _pool.pid = os.getpid()
+        _pool.connections = OrderedDict()
+
+    conn = _pool.connections.get(path)
+    if conn is None:
+        conn = configure_connection(sqlite3.connect(path, cached_statements=POOL_CACHED_STATEMENTS))
+        _pool.connections[path] = conn
+        while len(_pool.connections) > POOL_MAX_CONNECTIONS:
+            _, evicted = _pool.connections.popitem(last=False)
+            evicted.close()
+    else:
+        _pool.connections.move_to_end(path)
+
+    return conn
+
+
+def close_pooled_connections():
+    if getattr(_pool, "pid", None) != os.getpid():
+        return
+
+    for conn in _pool.connections.values():
+        conn.close()
+    _pool.connections = OrderedDict()
+
+
+def compress_attachment(attachment: Optional[str]) -> Optional[bytes]:
+    return zlib.compress(attachment.encode(), ATTACHMENT_COMPRESSION_LEVEL) if attachment is not None else None
+
+
+def decompress_attachment(attachment: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(attachment).decode() if attachment is not None else None
+
+
+@contextmanager
+def pooled_cursor(path: str) -> Iterator[sqlite3.Cursor]:
+    # borrows this thread's connection, commits on success and rolls back on error
+    # so a failed request never leaves the shared connection inside a transaction
+    conn = get_pooled_connection(path)
+    cursor = conn.cursor()
+    try:
+        yield cursor
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@timed_sql
 def add_death_db(
     cursor: sqlite3.Cursor,
     server: str,
@@ -37,57 +182,269 @@ def add_death_db(
             "message_id": message_id,
             "dead_person": dead_person,
             "caption": caption,
-            "attachment": attachment,
             "image_url": image_url,
             "timestamp": timestamp,
             "reporter": reporter,
         },
     )
+    rowid = cursor.lastrowid
+
+    if attachment is not None:
+        cursor.execute(INSERT_DEATH_ATTACHMENT_SQL, {"death_rowid": rowid, "attachment": compress_attachment(attachment)})
 
-    return cursor.lastrowid
+    return rowid
 
 
-def get_tally_db(cursor: sqlite3.Cursor, guild_id: str) -> List[Tuple[str, int]]:
+# tallies come back sorted by count, highest first
+@timed_sql
+def get_tally_db(cursor: sqlite3.Cursor, guild_id: str, limit: int = -1) -> List[Tuple[str, int]]:
     response = cursor.execute(SELECT_DEADPERSON_COUNT_SQL, {
         "guild_id": guild_id,
+        "limit": limit,
     })
     return response.fetchall()
 
 
-def get_tally_time_db(cursor: sqlite3.Cursor, guild_id: str, start_time: int, end_time: int) -> List[Tuple[str, int]]:
-    response = cursor.execute(SELECT_DEADPERSON_COUNT_BY_TIME_SQL, {
-        "start_time": start_time,
-        "end_time": end_time,
+# the page of the tally after the (count, dead_person) cursor, sorted like get_tally_db
+@timed_sql
+def get_tally_after_db(cursor: sqlite3.Cursor, guild_id: str, count: int, dead_person: str, limit: int) -> List[Tuple[str, int]]:
+    response = cursor.execute(SELECT_DEADPERSON_COUNT_AFTER_SQL, {
         "guild_id": guild_id,
+        "count": count,
+        "dead_person": dead_person,
+        "limit": limit,
     })
     return response.fetchall()
 
-def get_death_db(cursor: sqlite3.Cursor, guild_id: str, dead_person: str) -> Dict:
-    response = cursor.execute(SELECT_DEADPERSON_SQL, {
+
+# the page of the tally before the (count, dead_person) cursor, sorted like get_tally_db
+@timed_sql
+def get_tally_before_db(cursor: sqlite3.Cursor, guild_id: str, count: int, dead_person: str, limit: int) -> List[Tuple[str, int]]:
+    response = cursor.execute(SELECT_DEADPERSON_COUNT_BEFORE_SQL, {
         "guild_id": guild_id,
+        "count": count,
         "dead_person": dead_person,
+        "limit": limit,
+    })
+    return response.fetchall()[::-1]
+
+
+@timed_sql
+def get_tally_time_db(cursor: sqlite3.Cursor, guild_id: str, start_time: int, end_time: int, limit: int = -1) -> List[Tuple[str, int]]:
+    # the range is inclusive on both ends, like BETWEEN
+    first_day = math.ceil(start_time / SECONDS_PER_DAY)
+    last_day = math.floor((end_time + 1) / SECONDS_PER_DAY) - 1
+
+    if first_day > last_day:
+        # no whole day inside the range, the raw rows are all there is to read
+        response = cursor.execute(SELECT_DEADPERSON_COUNT_BY_TIME_SQL, {
+            "start_time": start_time,
+            "end_time": end_time,
+            "guild_id": guild_id,
+            "limit": limit,
+        })
+        return response.fetchall()
+
+    response = cursor.execute(SELECT_DEADPERSON_COUNT_BY_DAY_SQL, {
+        "guild_id": guild_id,
+        "first_day": first_day,
+        "last_day": last_day,
+        "start_time": start_time,
+        "head_end_time": first_day * SECONDS_PER_DAY - 1,
+        "tail_start_time": (last_day + 1) * SECONDS_PER_DAY,
+        "end_time": end_time,
+        "limit": limit,
+    })
+    return response.fetchall()
+
+# number of deaths for dead_person, or for the whole guild when dead_person is None
+@timed_sql
+def get_death_count_db(cursor: sqlite3.Cursor, guild_id: str, dead_person: Optional[str] = None) -> int:
+    response = cursor.execute(SELECT_DEATH_ORDINAL_COUNT_SQL, {
+        "guild_id": guild_id,
+        "dead_person": dead_person if dead_person is not None else GUILD_SCOPE,
+    })
+    return response.fetchone()[0] or 0
+
+
+@timed_sql
+def get_death_by_ordinal_db(cursor: sqlite3.Cursor, guild_id: str, dead_person: Optional[str], ordinal: int) -> Optional[Dict]:
+    response = cursor.execute(SELECT_DEATH_BY_ORDINAL_SQL, {
+        "guild_id": guild_id,
+        "dead_person": dead_person if dead_person is not None else GUILD_SCOPE,
+        "ordinal": ordinal,
     })
-    result = secrets.choice(response.fetchall())
+    result = response.fetchone()
+    if not result:
+        return None
+
     return {
-        "caption": result[0],
-        "attachment": result[1],
-        "timestamp": result[2],
-        "reporter": result[3],
+        "dead_person": result[0],
+        "caption": result[1],
+        "attachment": decompress_attachment(result[2]),
+        "timestamp": result[3],
+        "reporter": result[4],
+        "thumbnail_url": result[5],
     }
 
 
+# picks a random death for dead_person, or for the whole guild when dead_person is None
+@timed_sql
+def get_death_db(cursor: sqlite3.Cursor, guild_id: str, dead_person: Optional[str] = None) -> Optional[Dict]:
+    for _ in range(RANDOM_DEATH_ATTEMPTS):
+        count = get_death_count_db(cursor, guild_id, dead_person)
+        if not count:
+            return None
+
+        result = get_death_by_ordinal_db(cursor, guild_id, dead_person, secrets.randbelow(count))
+        if result:
+            return result
+
+    return None
+
+
+@timed_sql
 def get_death_by_message_id_db(cursor: sqlite3.Cursor, message_id: str) -> Tuple:
     response = cursor.execute(SELECT_DEADPERSON_BY_MESSAGE_ID, { "message_id": message_id })
-    return response.fetchone() # a message ID should only correspond to one death (fingers crossed)
+    return response.fetchone() # the unique index on message_id keeps it to one death
 
 
+@timed_sql
 def update_death_image_url_db(cursor: sqlite3.Cursor, rowid: int, image_url: str):
     cursor.execute(UPDATE_DEATH_IMAGE_URL_SQL, { "rowid": rowid, "image_url": image_url })
 
 
+@timed_sql
 def update_death_message_id_db(cursor: sqlite3.Cursor, rowid: int, message_id: str):
     cursor.execute(UPDATE_DEATH_MESSAGE_ID_SQL, { "rowid": rowid, "message_id": message_id })
 
 
+@timed_sql
 def delete_death_db(cursor: sqlite3.Cursor, rowid: int):
-    cursor.execute(DELETE_BY_ROWID_SQL, { "rowid": rowid })
\ No newline at end of file
+    cursor.execute(DELETE_BY_ROWID_SQL, { "rowid": rowid })
+
+
+# the oldest deaths still without a real message ID, as (rowid, server, channel_id, dead_person, reporter, timestamp).
+# Deaths created after before are left to update_database_with_message_id
+@timed_sql
+def get_unresolved_message_ids_db(cursor: sqlite3.Cursor, before: Number, max_attempts: int, limit: int) -> List[Tuple]:
+    response = cursor.execute(SELECT_UNRESOLVED_MESSAGE_IDS_SQL, {
+        "before": before,
+        "max_attempts": max_attempts,
+        "limit": limit,
+    })
+    return response.fetchall()
+
+
+@timed_sql
+def get_existing_message_ids_db(cursor: sqlite3.Cursor, message_ids: List[str]) -> Set[str]:
+    response = cursor.execute(SELECT_EXISTING_MESSAGE_IDS_SQL, {"message_ids": python_json.dumps(message_ids)})
+    return {message_id for message_id, in response}
+
+
+# fills in the message IDs found and counts an attempt for the deaths looked for without a match,
+# returns how many deaths got their message ID
+@timed_sql
+def resolve_message_ids_db(cursor: sqlite3.Cursor, message_ids: Dict[int, str], missed: List[int], attempted_at: Number) -> int:
+    cursor.executemany(UPDATE_UNRESOLVED_MESSAGE_ID_SQL, [{"rowid": rowid, "message_id": message_id} for rowid, message_id in message_ids.items()])
+    resolved = cursor.rowcount if message_ids else 0
+    cursor.executemany(DELETE_MESSAGE_ID_ATTEMPT_SQL, [{"rowid": rowid} for rowid in message_ids])
+    cursor.executemany(UPSERT_MESSAGE_ID_ATTEMPT_SQL, [{"rowid": rowid, "attempted_at": attempted_at} for rowid in missed])
+    return resolved
+
+
+@timed_sql
+def get_media_object_db(cursor: sqlite3.Cursor, sha256: str) -> Optional[Dict]:
+    result = cursor.execute(SELECT_MEDIA_OBJECT_SQL, {"sha256": sha256}).fetchone()
+    if not result:
+        return None
+
+    return {
+        "url": result[0],
+        "content_type": result[1],
+        "size": result[2],
+        "thumbnail_url": result[3],
+    }
+
+
+@timed_sql
+def add_media_object_db(cursor: sqlite3.Cursor, sha256: str, url: str, content_type: str, size: int, thumbnail_url: Optional[str], created_at: Number):
+    cursor.execute(INSERT_MEDIA_OBJECT_SQL, {
+        "sha256": sha256,
+        "url": url,
+        "content_type": content_type,
+        "size": size,
+        "thumbnail_url": thumbnail_url,
+        "created_at": created_at,
+    })
+
+
+# the stored result is wrapped in a tuple so a step that completed with no result can be told from one that didn't complete
+@timed_sql
+def get_task_step_db(cursor: sqlite3.Cursor, idempotency_key: str, step: str) -> Optional[Tuple[Optional[str]]]:
+    return cursor.execute(SELECT_TASK_STEP_SQL, {"idempotency_key": idempotency_key, "step": step}).fetchone()
+
+
+@timed_sql
+def add_task_step_db(cursor: sqlite3.Cursor, idempotency_key: str, step: str, result: Optional[str], completed_at: Number):
+    cursor.execute(INSERT_TASK_STEP_SQL, {
+        "idempotency_key": idempotency_key,
+        "step": step,
+        "result": result,
+        "completed_at": completed_at,
+    })
+
+
+@timed_sql
+def delete_task_steps_before_db(cursor: sqlite3.Cursor, before: Number) -> int:
+    cursor.execute(DELETE_TASK_STEPS_BEFORE_SQL, {"before": before})
+    return cursor.rowcount
+
+
+def week_of(timestamp: Number) -> int:
+    return (int(timestamp) // SECONDS_PER_DAY + WEEK_DAY_OFFSET) // 7
+
+
+def week_start(week: int) -> int:
+    return (week * 7 - WEEK_DAY_OFFSET) * SECONDS_PER_DAY
+
+
+# reporters sorted by how many deaths they reported, most first
+@timed_sql
+def get_reporter_tally_db(cursor: sqlite3.Cursor, guild_id: str, limit: int = -1) -> List[Tuple[str, int]]:
+    response = cursor.execute(SELECT_REPORTER_TALLY_SQL, {
+        "guild_id": guild_id,
+        "limit": limit,
+    })
+    return response.fetchall()
+
+
+# deaths in every week from first_week to last_week, weeks without any are 0
+@timed_sql
+def get_week_tallies_db(cursor: sqlite3.Cursor, guild_id: str, first_week: int, last_week: int) -> List[Tuple[int, int]]:
+    counts = dict(cursor.execute(SELECT_DEATH_WEEK_TALLIES_SQL, {
+        "guild_id": guild_id,
+        "first_week": first_week,
+        "last_week": last_week,
+    }).fetchall())
+    return [(week, counts.get(week, 0)) for week in range(first_week, last_week + 1)]
+
+
+# the longest anyone went between two deaths, as (dead_person, seconds, when it ended)
+@timed_sql
+def get_longest_gaps_db(cursor: sqlite3.Cursor, guild_id: str, limit: int = -1) -> List[Tuple[str, int, int]]:
+    response = cursor.execute(SELECT_LONGEST_GAPS_SQL, {
+        "guild_id": guild_id,
+        "limit": limit,
+    })
+    return response.fetchall()
+
+
+# everyone by how long ago they last died, longest first, as (dead_person, last death)
+@timed_sql
+def get_current_gaps_db(cursor: sqlite3.Cursor, guild_id: str, limit: int = -1) -> List[Tuple[str, int]]:
+    response = cursor.execute(SELECT_CURRENT_GAPS_SQL, {
+        "guild_id": guild_id,
+        "limit": limit,
+    })
+    return response.fetchall()
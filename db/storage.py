@@ -0,0 +1,193 @@
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Set
+
+from db.db import pooled_cursor
+from db.writer import WRITE_BEHIND_TIMEOUT, get_batch_writer
+from migrations.runner import connect_to_database, run_migrations
+
+# sqlite keeps every guild in DATABASE_PATH, sqlite_shards gives each guild its own file in SHARD_DIRECTORY
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "sqlite")
+DATABASE_PATH = os.getenv("DATABASE_PATH")
+SHARD_DIRECTORY = os.getenv("SHARD_DIRECTORY")
+# writes are queued to the process's batching writer and committed together, WRITE_BEHIND=0
+# goes back to one transaction per write
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"
+
+# guild IDs end up in file names, Discord's are digits and the benchmarks' are guild<n>
+GUILD_ID_PATTERN = re.compile(r"[0-9A-Za-z_-]+")
+SHARD_FILE_PREFIX = "guild-"
+SHARD_FILE_SUFFIX = ".db"
+# two processes can create the same shard at once, the one that loses the race runs the migrations again
+SHARD_MIGRATE_ATTEMPTS = 3
+
+Operation = Callable[[sqlite3.Cursor], Any]
+GroupedOperation = Callable[[sqlite3.Cursor, List[str]], Any]
+
+
+class Storage(ABC):
+    """
+    Where each guild's deaths live. The db.db functions take a cursor, a storage engine decides
+    which database that cursor belongs to for a guild_id.
+
+    read() borrows a cursor for queries, write() runs an operation in a write transaction and
+    returns its result, read_each() and write_each() run an operation once in every database the
+    engine holds. write_grouped() runs an operation once in every database holding any of a list
+    of guilds, with the guilds it holds, so work for many guilds commits in one transaction per database.
+    paths() lists the databases, for the migration runner.
+    """
+
+    @abstractmethod
+    def paths(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def read(self, guild_id: Optional[str]) -> ContextManager[sqlite3.Cursor]:
+        pass
+
+    @abstractmethod
+    def write(self, guild_id: Optional[str], operation: Operation) -> Any:
+        pass
+
+    @abstractmethod
+    def read_each(self, operation: Operation) -> List[Any]:
+        pass
+
+    @abstractmethod
+    def write_each(self, operation: Operation) -> List[Any]:
+        pass
+
+    @abstractmethod
+    def write_grouped(self, guild_ids: Iterable[str], operation: GroupedOperation) -> List[Any]:
+        pass
+
+
+class SqliteStorage(Storage):
+    """Every guild in the one SQLite file at path."""
+
+    def __init__(self, path: str, write_behind: bool = WRITE_BEHIND):
+        self.path = path
+        self.write_behind = write_behind
+
+    def path_for(self, guild_id: Optional[str]) -> str:
+        return self.path
+
+    def paths(self) -> List[str]:
+        return [self.path]
+
+    @contextmanager
+    def read(self, guild_id: Optional[str]) -> Iterator[sqlite3.Cursor]:
+        with pooled_cursor(self.path_for(guild_id)) as cursor:
+            yield cursor
+
+    def write(self, guild_id: Optional[str], operation: Operation) -> Any:
+        return self.write_path(self.path_for(guild_id), operation)
+
+    def read_each(self, operation: Operation) -> List[Any]:
+        results = []
+        for path in self.paths():
+            with pooled_cursor(path) as cursor:
+                results.append(operation(cursor))
+
+        return results
+
+    def write_each(self, operation: Operation) -> List[Any]:
+        return [self.write_path(path, operation) for path in self.paths()]
+
+    def write_grouped(self, guild_ids: Iterable[str], operation: GroupedOperation) -> List[Any]:
+        groups: Dict[str, List[str]] = {}
+        for guild_id in guild_ids:
+            groups.setdefault(self.path_for(guild_id), []).append(guild_id)
+
+        return [
+            self.write_path(path, lambda cursor, guild_ids=guild_ids: operation(cursor, guild_ids))
+            for path, guild_ids in groups.items()
+        ]
+
+    def write_path(self, path: str, operation: Operation) -> Any:
+        if self.write_behind:
+            return get_batch_writer(path).submit(operation).result(timeout=WRITE_BEHIND_TIMEOUT)
+
+        with pooled_cursor(path) as cursor:
+            return operation(cursor)
+
+
+class ShardedSqliteStorage(SqliteStorage):
+    """
+    A SQLite file per guild in directory, so guilds don't share a write lock or a page cache.
+
+    A guild's shard is created and migrated the first time it's used. Open handles are bounded
+    by the connection pool (POOL_MAX_CONNECTIONS per thread) and the writers (WRITE_BEHIND_MAX_WRITERS
+    per process), which close the least recently used shard's.
+    """
+
+    def __init__(self, directory: str, write_behind: bool = WRITE_BEHIND):
+        super().__init__(directory, write_behind)
+        self.directory = directory
+        self._migrated: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def path_for(self, guild_id: Optional[str]) -> str:
+        path = shard_path(self.directory, guild_id)
+        if path not in self._migrated:
+            with self._lock:
+                if path not in self._migrated:
+                    os.makedirs(self.directory, exist_ok=True)
+                    migrate_shard(path)
+                    self._migrated.add(path)
+
+        return path
+
+    def paths(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.startswith(SHARD_FILE_PREFIX) and name.endswith(SHARD_FILE_SUFFIX)
+        )
+
+
+def shard_path(directory: str, guild_id: Optional[str]) -> str:
+    if not guild_id or not GUILD_ID_PATTERN.fullmatch(guild_id):
+        raise ValueError(f"can't pick a shard for guild ID {guild_id!r}")
+
+    return os.path.join(directory, f"{SHARD_FILE_PREFIX}{guild_id}{SHARD_FILE_SUFFIX}")
+
+
+def migrate_shard(path: str) -> List[int]:
+    for attempt in range(SHARD_MIGRATE_ATTEMPTS):
+        connection = connect_to_database(path)
+        try:
+            return run_migrations(connection)
+        except sqlite3.Error:
+            if attempt == SHARD_MIGRATE_ATTEMPTS - 1:
+                raise
+        finally:
+            connection.close()
+
+
+STORAGE_ENGINES: Dict[str, Callable[[], Storage]] = {
+    "sqlite": lambda: SqliteStorage(DATABASE_PATH),
+    "sqlite_shards": lambda: ShardedSqliteStorage(SHARD_DIRECTORY),
+}
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    # created on first use so importing this doesn't need the engine's settings
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_ENGINE not in STORAGE_ENGINES:
+                    raise ValueError(f"unknown STORAGE_ENGINE {STORAGE_ENGINE!r}, expected one of {', '.join(STORAGE_ENGINES)}")
+                _storage = STORAGE_ENGINES[STORAGE_ENGINE]()
+
+    return _storage
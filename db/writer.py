@@ -0,0 +1,203 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from db.db import configure_connection
+from metrics.metrics import WRITER_COMMITS, WRITER_LOCK_ERRORS, WRITER_OPERATIONS
+
+WRITE_BEHIND_MAX_OPS = int(os.getenv("WRITE_BEHIND_MAX_OPS", "100"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "10")) / 1000
+# writer threads (and their connections) a process keeps open, one per database written to,
+# with a shard per guild the least recently used are closed
+WRITE_BEHIND_MAX_WRITERS = int(os.getenv("WRITE_BEHIND_MAX_WRITERS", "16"))
+# how long a caller waits for its write to commit before giving up on the writer
+WRITE_BEHIND_TIMEOUT = float(os.getenv("WRITE_BEHIND_TIMEOUT", "30"))
+
+Operation = Callable[[sqlite3.Cursor], Any]
+
+
+class BatchWriter:
+    """
+    Single writer thread that applies queued write operations in batched transactions.
+
+    A batch closes after max_ops operations or max_delay seconds after its first one,
+    whichever comes first, and commits once. Each operation runs inside its own savepoint
+    so a failing one is rolled back alone, and its Future only resolves after the commit,
+    so callers never see a rowid for a row that isn't durable yet.
+
+    close() lets the thread commit what's queued and exit, operations submitted after that
+    go to the process's current writer for the same database. If the thread can't open the
+    database or dies, everything queued and everything submitted after fails with the error,
+    and get_batch_writer starts a new writer for the next caller.
+    """
+
+    def __init__(self, path: str, max_ops: int = WRITE_BEHIND_MAX_OPS, max_delay: float = WRITE_BEHIND_MAX_DELAY):
+        self.path = path
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[Optional[Tuple[Operation, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.closed = False
+        self.failure: Optional[BaseException] = None
+        self._batch: List[Tuple[Operation, Future]] = []
+
+        self.commits = 0
+        self.operations = 0
+        self.lock_errors = 0
+
+        self._thread = threading.Thread(target=self._run, name="rip-bot-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, operation: Operation) -> Future:
+        future = Future()
+        with self._lock:
+            if self.failure:
+                future.set_exception(self.failure)
+                return future
+            if not self.closed:
+                self._queue.put((operation, future))
+                return future
+
+        # closed between get_batch_writer handing it out and now
+        return get_batch_writer(self.path).submit(operation)
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                # wakes the thread, which stops taking operations once it reaches this
+                self._queue.put(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "commits": self.commits,
+            "operations": self.operations,
+            "lock_errors": self.lock_errors,
+            "queued": self._queue.qsize(),
+        }
+
+    def _take_batch(self) -> Tuple[List[Tuple[Operation, Future]], bool]:
+        # the batch and whether close() was reached
+        first = self._queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_ops:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _run(self):
+        connection = None
+        try:
+            # autocommit mode, the writer issues BEGIN/COMMIT and savepoints itself
+            connection = configure_connection(sqlite3.connect(self.path, isolation_level=None, check_same_thread=False))
+            self._apply_batches(connection)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if connection:
+                connection.close()
+
+    def _fail(self, exception: BaseException):
+        with self._lock:
+            self.failure = exception
+            self.closed = True
+
+        # the batch it was applying, then the queue, nothing is queued after failure is set
+        for _, future in self._batch:
+            if not future.done():
+                future.set_exception(exception)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[1].set_exception(exception)
+
+    def _apply_batches(self, connection: sqlite3.Connection):
+        cursor = connection.cursor()
+
+        closed = False
+        while not closed:
+            batch, closed = self._take_batch()
+            self._batch = batch
+            if not batch:
+                continue
+
+            results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for operation, future in batch:
+                    cursor.execute("SAVEPOINT operation")
+                    try:
+                        results.append((future, operation(cursor), None))
+                        cursor.execute("RELEASE operation")
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO operation")
+                        cursor.execute("RELEASE operation")
+                        results.append((future, None, e))
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                if connection.in_transaction:
+                    connection.rollback()
+                if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+                    self.lock_errors += 1
+                    WRITER_LOCK_ERRORS.inc()
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.commits += 1
+            self.operations += len(batch)
+            WRITER_COMMITS.inc()
+            WRITER_OPERATIONS.inc(len(batch))
+            for future, result, exception in results:
+                if exception:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+
+
+_writers: "OrderedDict[str, BatchWriter]" = OrderedDict()
+_writers_pid: Optional[int] = None
+_writers_lock = threading.Lock()
+
+
+def get_batch_writer(path: str) -> BatchWriter:
+    # one writer thread per database per process, threads don't survive a fork so children start their own
+    global _writers_pid
+    with _writers_lock:
+        if _writers_pid != os.getpid():
+            _writers.clear()
+            _writers_pid = os.getpid()
+
+        writer = _writers.get(path)
+        # a writer whose thread failed is replaced, the database may be reachable again
+        if writer is None or writer.failure:
+            writer = _writers[path] = BatchWriter(path)
+            while len(_writers) > WRITE_BEHIND_MAX_WRITERS:
+                _, evicted = _writers.popitem(last=False)
+                evicted.close()
+        else:
+            _writers.move_to_end(path)
+
+        return writer
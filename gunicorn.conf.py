@@ -0,0 +1,27 @@
+from kombu.exceptions import OperationalError
+
+# gunicorn reads this from the working directory, the run_prod target only adds the TLS and bind options
+
+# the app is imported once in the master and every worker forks with Flask, Celery and the handlers
+# already loaded, so a new or restarted worker starts serving right away and the imported modules'
+# memory is shared between workers
+preload_app = True
+
+
+def post_fork(server, worker):
+    # resources that must belong to one process are set up here, after the fork. The SQLite pool,
+    # the batch writers and the S3 client check the pid themselves
+    from tasks.celery_app import connect_to_broker, reset_after_fork
+
+    reset_after_fork()
+    try:
+        connect_to_broker()
+    except OperationalError:
+        # the first task published connects instead
+        server.log.warning("worker %s couldn't connect to the broker", worker.pid)
+
+
+def child_exit(server, worker):
+    from metrics.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -1,26 +1,36 @@
-import itertools
+import hashlib
 import logging
 import json as python_json
 import os
+import secrets
+import sqlite3
 import time
 import traceback
 from numbers import Number
 from typing import Any, Callable, Dict, List, Tuple, Optional
 from urllib.parse import urlparse
 
-from flask import Flask, json, request
-from discord_interactions import verify_key_decorator
-from celery import group
+from flask import Flask, Response, json, request
+from celery import group, Signature
+from kombu.exceptions import OperationalError
 
-import tasks.tasks as app_tasks
-from db.db import add_death_db, get_tally_db, get_tally_time_db, get_death_db, get_death_by_message_id_db, connect_to_database
+import interactions.codec as codec
+# task signatures by name, importing tasks.tasks would pull boto3, requests and Pillow into every web worker
+import tasks.signatures as app_tasks
+from interactions.verify import verify_key_decorator
+from metrics.metrics import HANDLER_SECONDS, render_metrics, timed
+from tasks.celery_app import CELERY_RESULT_BACKEND
+from tasks.routing import get_queue_depths
+from db.cache import query_cache
+from db.storage import get_storage
+from db.db import get_tally_db, get_tally_after_db, get_tally_before_db, get_tally_time_db, get_death_count_db, get_death_by_ordinal_db, get_death_by_message_id_db, RANDOM_DEATH_ATTEMPTS
+from db.db import get_reporter_tally_db, get_week_tallies_db, get_longest_gaps_db, get_current_gaps_db, week_of, week_start
 
 
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
 
 RIP_BOT_PUBLIC_KEY = os.getenv("RIP_BOT_PUBLIC_KEY")
-DATABASE_PATH = os.getenv("DATABASE_PATH")
 
 DEATH_MESSAGE_TEMPLATE = """<@{dead_person_id}> died!
 Caption by <@{poster_id}>: \"{caption}\""""
@@ -31,6 +41,26 @@ DEATH_MESSAGE_RETRIEVE_TEMPLATE = """<@{dead_person_id}> died on <t:{death_time}
 Caption by <@{poster_id}>: \"{caption}\""""
 REMOVING_DEATH_IN_PROGRESS_TEMPLATE = """Removing death {death_message_link} for <@{dead_person_id}>."""
 ERROR_MESSAGE = """rip-bot failed to process the command."""
+TALLY_LIMIT = 50
+# leaderboard buttons carry their cursor in the custom_id: "tally:<after|before>:<rank>:<count>:<dead person>"
+TALLY_BUTTON_PREFIX = "tally"
+STATS_LIMIT = 10
+STATS_DEFAULT_WEEKS = 12
+# "lean" stores the death and uploads the image in one task then fans out once,
+# "canvas" is the original group -> gather_results -> group pipeline
+ADD_DEATH_PIPELINE = os.getenv("ADD_DEATH_PIPELINE", "lean")
+# gather_results is a chord callback, which Celery can't start without a result backend
+if ADD_DEATH_PIPELINE == "canvas" and not CELERY_RESULT_BACKEND:
+    raise ValueError("Missing CELERY_RESULT_BACKEND value, the canvas pipeline needs one.")
+# static responses are serialized once at import
+PING_RESPONSE_BODY = codec.dumps({"type": 1})
+
+
+def interaction_idempotency_key(interaction_id: Optional[str], interaction_token: str) -> str:
+    # names every task an interaction starts, so a redelivered one finds the steps it already completed
+    if interaction_id:
+        return f"interaction:{interaction_id}"
+    return f"token:{hashlib.sha256(interaction_token.encode()).hexdigest()}"
 
 
 def convert_options_to_map(options: List) -> Dict[str, Any]:
@@ -52,43 +82,88 @@ def parse_discord_message_url(url: str) -> Optional[Tuple[str, str, str]]:
     
     return (path_parts[2], path_parts[3], path_parts[4])
 
+# read-through the query cache, the cursor is only borrowed from the pool on a miss
+def cached_query(guild_id: str, key: Tuple, query: Callable[[sqlite3.Cursor], Any]) -> Any:
+    def compute():
+        with get_storage().read(guild_id) as cursor:
+            return query(cursor)
+
+    return query_cache.get_or_compute(guild_id, key, compute)
+
+def get_random_death(guild_id: str, dead_person: Optional[str]) -> Optional[Dict]:
+    for _ in range(RANDOM_DEATH_ATTEMPTS):
+        count = cached_query(guild_id, ("death_count", dead_person), lambda cursor: get_death_count_db(cursor, guild_id, dead_person))
+        if not count:
+            return None
+
+        ordinal = secrets.randbelow(count)
+        result = cached_query(guild_id, ("death", dead_person, ordinal), lambda cursor: get_death_by_ordinal_db(cursor, guild_id, dead_person, ordinal))
+        if result:
+            return result
+
+    return None
+
 def PingHandler(req: Any) -> Any:
     return {"type": 1}
 
 
+def build_add_death_pipeline(death: Tuple, image_url: str, interaction_token: str, guild_id: str, interaction_id: Optional[str] = None) -> Signature:
+    idempotency_key = interaction_idempotency_key(interaction_id, interaction_token)
+    followups = group(
+        app_tasks.update_database_with_image.s(),
+        app_tasks.update_interaction_with_image.s(),
+        # technically the message takes time to exist in Discord
+        # so this delays the messsage ID fetching for a bit
+        # TODO: readd the countdown/delay once I figure out how
+        # for now this should be fine since we wait are downloding and uploading a whole image
+        # in the first step, which serves as the delay. The ones it misses are found later by reconcile_message_ids
+        app_tasks.update_database_with_message_id.s()
+    )
+
+    if ADD_DEATH_PIPELINE == "canvas":
+        return (
+            group(
+                app_tasks.add_death_to_db.s(*death, idempotency_key=idempotency_key),
+                app_tasks.download_image_and_upload_to_s3.s(image_url, idempotency_key=idempotency_key, guild_id=guild_id),
+            ) |
+            app_tasks.gather_results.s(interaction_token=interaction_token, guild_id=guild_id, interaction_id=interaction_id, idempotency_key=idempotency_key) |
+            followups
+        )
+
+    # a task followed by a group is a plain callback, no chord
+    return app_tasks.add_death_and_upload_image.s(
+        *death,
+        interaction_token=interaction_token,
+        guild_id=guild_id,
+        interaction_id=interaction_id,
+        idempotency_key=idempotency_key,
+    ) | followups
+
+
 def add_death(req: Any):
     interaction_token = req["token"]
     options = convert_options_to_map(req["data"]["options"])
     resolved_attachment = req["data"]["resolved"]["attachments"][options["image"]]
     image_url = resolved_attachment["url"]
 
-    (
-        group(
-            app_tasks.add_death_to_db.s(
-                req["guild_id"],
-                req["channel_id"],
-                "",
-                options["dead-person"],
-                options["caption"],
-                python_json.dumps(resolved_attachment),
-                image_url,
-                int(time.time()),
-                req["member"]["user"]["id"],
-            ),
-            app_tasks.download_image_and_upload_to_s3.s(image_url),
-        ) |
-        app_tasks.gather_results.s(interaction_token=interaction_token) |
-        group(
-            app_tasks.update_database_with_image.s(),
-            app_tasks.update_interaction_with_image.s(),
-            # technically the message takes time to exist in Discord
-            # so this delays the messsage ID fetching for a bit
-            # TODO: readd the countdown/delay once I figure out how
-            # for now this should be fine since we wait are downloding and uploading a whole image
-            # in the first step, which serves as the delay
-            app_tasks.update_database_with_message_id.s()
-        )).delay()
-    
+    build_add_death_pipeline(
+        (
+            req["guild_id"],
+            req["channel_id"],
+            None, # message ID is filled in by update_database_with_message_id
+            options["dead-person"],
+            options["caption"],
+            python_json.dumps(resolved_attachment),
+            image_url,
+            int(time.time()),
+            req["member"]["user"]["id"],
+        ),
+        image_url,
+        interaction_token,
+        req["guild_id"],
+        req.get("id"),
+    ).delay()
+
     log_object = {
         "event": "add_death",
         "guild_id": req["guild_id"],
@@ -138,11 +213,8 @@ def remove_death(req: Any):
             }
         }
 
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    death = get_death_by_message_id_db(cursor, message_id)
-    conn.close()
+    with get_storage().read(guild_id) as cursor:
+        death = get_death_by_message_id_db(cursor, message_id)
 
     if not death:
         return {
@@ -169,9 +241,13 @@ def remove_death(req: Any):
         remover_id=req["member"]["user"]["id"],
     )
     
-    (app_tasks.delete_from_database.s(rowid) | \
-        app_tasks.update_death_message.si(channel_id, message_id, new_message)
+    idempotency_key = interaction_idempotency_key(req.get("id"), req["token"])
+    (app_tasks.delete_from_database.s(rowid, database_guild_id, idempotency_key) | \
+        app_tasks.update_death_message.si(channel_id, message_id, new_message, idempotency_key, database_guild_id)
     ).delay()
+    # delete_from_database invalidates again once the row is gone, this one is for this process
+    # in case its bump doesn't get here, so get-death stops handing out the death right away
+    query_cache.invalidate(database_guild_id)
 
     log_object = {
         "event": "remove_death",
@@ -198,13 +274,9 @@ def tally_deaths(req: Any):
     options = convert_options_to_map(req["data"].get("options", {}))
     start_time, end_time = options.get("start-time", None), options.get("end-time", None)
 
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
-
     if start_time and end_time:
         try:
             start_time_p, end_time_p = time.mktime(time.strptime(start_time, "%Y-%m-%d")), time.mktime(time.strptime(end_time, "%Y-%m-%d"))
-            result = get_tally_time_db(cursor, req["guild_id"], start_time_p, end_time_p)
         except ValueError:
             return {
                 "type": 4,
@@ -212,8 +284,23 @@ def tally_deaths(req: Any):
                     "content": "Both start time and end time are required to be yyyy-mm-dd.",
                 }
             }
+
+        result = cached_query(
+            req["guild_id"],
+            ("tally", start_time_p, end_time_p, TALLY_LIMIT),
+            lambda cursor: get_tally_time_db(cursor, req["guild_id"], start_time_p, end_time_p, TALLY_LIMIT),
+        )
     elif not start_time and not end_time:
-        result = get_tally_db(cursor, req["guild_id"])
+        # the all-time tally is paged with buttons, one row past the page tells whether there's a next one
+        result = cached_query(
+            req["guild_id"],
+            ("tally", None, None, TALLY_LIMIT + 1),
+            lambda cursor: get_tally_db(cursor, req["guild_id"], TALLY_LIMIT + 1),
+        )
+        return {
+            "type": 4,
+            "data": build_tally_page(result[:TALLY_LIMIT], 1, len(result) > TALLY_LIMIT),
+        }
     else:
         return {
             "type": 4,
@@ -222,46 +309,106 @@ def tally_deaths(req: Any):
             }
         }
 
-    conn.close()
-
-    def sort_by_count(row):
-        return row[1]
-
-    result.sort(key=sort_by_count, reverse=True)
+    return {
+        "type": 4,
+        "data": {
+            "content": format_tally(f"Deaths ({start_time} to {end_time})", result, 1),
+        }
+    }
 
-    header_text = "Deaths"
-    if start_time:
-        header_text += f" ({start_time} to {end_time})"
 
+def format_tally(header_text: str, result: List[Tuple[str, int]], first_rank: int) -> str:
     lines_of_text = [f"**{header_text}**"]
-    current_rank = 1
-    for dead_person, death_count in itertools.islice(result, 50):
+    current_rank = first_rank
+    for dead_person, death_count in result:
         lines_of_text.append(f"{current_rank}. <@{dead_person}> - {death_count}")
         current_rank += 1
 
-    content = "\n".join(lines_of_text)
+    return "\n".join(lines_of_text)
+
+
+def build_tally_page(result: List[Tuple[str, int]], first_rank: int, has_next: bool) -> Dict:
+    if not result:
+        return {"content": format_tally("Deaths", result, first_rank), "components": []}
+
+    first_dead_person, first_count = result[0]
+    last_dead_person, last_count = result[-1]
+    last_rank = first_rank + len(result) - 1
 
     return {
-        "type": 4,
-        "data": {
-            "content": content,
-        }
+        "content": format_tally("Deaths", result, first_rank),
+        "components": [
+            {
+                "type": 1,
+                "components": [
+                    {
+                        "type": 2,
+                        "style": 2,
+                        "label": "Previous",
+                        "custom_id": f"{TALLY_BUTTON_PREFIX}:before:{first_rank}:{first_count}:{first_dead_person}",
+                        "disabled": first_rank <= 1,
+                    },
+                    {
+                        "type": 2,
+                        "style": 2,
+                        "label": "Next",
+                        "custom_id": f"{TALLY_BUTTON_PREFIX}:after:{last_rank}:{last_count}:{last_dead_person}",
+                        "disabled": not has_next,
+                    },
+                ],
+            },
+        ],
+    }
+
+
+def tally_page_button(req: Any):
+    _, direction, rank, count, dead_person = req["data"]["custom_id"].split(":", 4)
+    guild_id, rank, count = req["guild_id"], int(rank), int(count)
+
+    if direction == "after":
+        result = cached_query(
+            guild_id,
+            ("tally_after", count, dead_person, TALLY_LIMIT + 1),
+            lambda cursor: get_tally_after_db(cursor, guild_id, count, dead_person, TALLY_LIMIT + 1),
+        )
+        page = build_tally_page(result[:TALLY_LIMIT], rank + 1, len(result) > TALLY_LIMIT)
+    else:
+        result = cached_query(
+            guild_id,
+            ("tally_before", count, dead_person, TALLY_LIMIT),
+            lambda cursor: get_tally_before_db(cursor, guild_id, count, dead_person, TALLY_LIMIT),
+        )
+        # ranks in the custom_id go stale as deaths are added, a short page can only be the first one
+        first_rank = max(rank - len(result), 1) if len(result) == TALLY_LIMIT else 1
+        page = build_tally_page(result, first_rank, True)
+
+    # type 7 edits the message the button is on
+    return {
+        "type": 7,
+        "data": page,
     }
 
 
 def get_death(req: Any):
-    options = convert_options_to_map(req["data"]["options"])
+    options = convert_options_to_map(req["data"].get("options", []))
 
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
-    result = get_death_db(cursor, req["guild_id"], options["dead-person"])
-    conn.close()
+    # without a dead person, a random death from the whole server
+    result = get_random_death(req["guild_id"], options.get("dead-person", None))
 
+    if not result:
+        return {
+            "type": 4,
+            "data": {
+                "content": "No deaths found.",
+            }
+        }
+
+    thumbnail_url = result.get("thumbnail_url", None)
     return {
         "type": 4,
         "data": {
             "content": DEATH_MESSAGE_RETRIEVE_TEMPLATE.format(
-                dead_person_id=options["dead-person"],
+                dead_person_id=result["dead_person"],
                 caption=result["caption"],
                 death_time=result["timestamp"],
                 poster_id=result["reporter"],
@@ -269,15 +416,91 @@ def get_death(req: Any):
             "embeds": [
                 {
                     "type": "image",
-                    "image": python_json.loads(result["attachment"]),
+                    # the downscaled copy when the upload made one, the original attachment otherwise
+                    "image": {"url": thumbnail_url} if thumbnail_url else python_json.loads(result["attachment"]),
                 },
             ],
         }
     }
 
+def format_duration(seconds: Number) -> str:
+    for unit, unit_seconds in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= unit_seconds:
+            amount = int(seconds // unit_seconds)
+            return f"{amount} {unit}{'s' if amount != 1 else ''}"
+
+    return "under a minute"
+
+
+def top_reporters_stat(guild_id: str, options: Dict[str, Any]) -> str:
+    result = cached_query(guild_id, ("stats", "top-reporters", STATS_LIMIT), lambda cursor: get_reporter_tally_db(cursor, guild_id, STATS_LIMIT))
+    return format_tally("Top reporters", result, 1)
+
+
+def deaths_per_week_stat(guild_id: str, options: Dict[str, Any]) -> str:
+    weeks = options.get("weeks", STATS_DEFAULT_WEEKS)
+    last_week = week_of(time.time())
+    result = cached_query(
+        guild_id,
+        ("stats", "deaths-per-week", last_week, weeks),
+        lambda cursor: get_week_tallies_db(cursor, guild_id, last_week - weeks + 1, last_week),
+    )
+
+    lines_of_text = ["**Deaths per week**"]
+    for week, death_count in result:
+        lines_of_text.append(f"<t:{week_start(week)}:d> - {death_count}")
+    return "\n".join(lines_of_text)
+
+
+def longest_gaps_stat(guild_id: str, options: Dict[str, Any]) -> str:
+    result = cached_query(guild_id, ("stats", "longest-gaps", STATS_LIMIT), lambda cursor: get_longest_gaps_db(cursor, guild_id, STATS_LIMIT))
+
+    lines_of_text = ["**Longest time between deaths**"]
+    for rank, (dead_person, gap, gap_end) in enumerate(result, 1):
+        lines_of_text.append(f"{rank}. <@{dead_person}> - {format_duration(gap)}, until <t:{gap_end}:d>")
+    return "\n".join(lines_of_text)
+
+
+def current_gaps_stat(guild_id: str, options: Dict[str, Any]) -> str:
+    result = cached_query(guild_id, ("stats", "current-gaps", STATS_LIMIT), lambda cursor: get_current_gaps_db(cursor, guild_id, STATS_LIMIT))
+
+    now = time.time()
+    lines_of_text = ["**Longest alive right now**"]
+    for rank, (dead_person, last_timestamp) in enumerate(result, 1):
+        lines_of_text.append(f"{rank}. <@{dead_person}> - {format_duration(now - last_timestamp)}, last died <t:{last_timestamp}:R>")
+    return "\n".join(lines_of_text)
+
+
+DeathStats: Dict[str, Callable[[str, Dict[str, Any]], str]] = {
+    "top-reporters": top_reporters_stat,
+    "deaths-per-week": deaths_per_week_stat,
+    "longest-gaps": longest_gaps_stat,
+    "current-gaps": current_gaps_stat,
+}
+
+def death_stats(req: Any):
+    options = convert_options_to_map(req["data"].get("options", []))
+    stat = DeathStats.get(options.get("stat", None), None)
+
+    if not stat:
+        return {
+            "type": 4,
+            "data": {
+                "content": "Unknown statistic.",
+            }
+        }
+
+    return {
+        "type": 4,
+        "data": {
+            "content": stat(req["guild_id"], options),
+        }
+    }
+
 SlashCommandHandlers: Dict[str, Callable[[Any], Any]] = {
     "add-death": add_death,
     "add-death-beta": add_death_beta,
+    "death-stats": death_stats,
     "get-death": get_death,
     "remove-death": remove_death,
     "tally-deaths": tally_deaths,
@@ -285,21 +508,53 @@ SlashCommandHandlers: Dict[str, Callable[[Any], Any]] = {
 
 def ApplicationCommandHandler(req: Any) -> Any:
     command_name = req["data"]["name"]
-    return SlashCommandHandlers[command_name](req)
+    with timed(HANDLER_SECONDS.labels(command_name)):
+        return SlashCommandHandlers[command_name](req)
+
+ComponentHandlers: Dict[str, Callable[[Any], Any]] = {
+    TALLY_BUTTON_PREFIX: tally_page_button,
+}
+
+def MessageComponentHandler(req: Any) -> Any:
+    prefix = req["data"]["custom_id"].split(":", 1)[0]
+    with timed(HANDLER_SECONDS.labels(f"component:{prefix}")):
+        return ComponentHandlers[prefix](req)
 
 InteractionsHandlers: Dict[Number, Callable[[Any], Any]] = {
     1: PingHandler,
     2: ApplicationCommandHandler,
+    3: MessageComponentHandler,
 }
 
+@app.get("/cache-stats")
+def cache_stats_get():
+    return json.jsonify(query_cache.stats())
+
+@app.get("/queue-stats")
+def queue_stats_get():
+    return json.jsonify(get_queue_depths(app_tasks.app))
+
+@app.get("/metrics")
+def metrics_get():
+    try:
+        get_queue_depths(app_tasks.app)
+    except OperationalError:
+        # the rest of the metrics are still worth serving without the broker
+        app.logger.warning("couldn't read queue depths from the broker")
+
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.post("/interactions")
 @verify_key_decorator(RIP_BOT_PUBLIC_KEY)
 def interactions_post():
     try:
-        request_body = request.get_json()
+        request_body = codec.loads(request.get_data())
         interaction_type = request_body["type"]
+        if interaction_type == 1:
+            return Response(PING_RESPONSE_BODY, mimetype="application/json")
         response = InteractionsHandlers[interaction_type](request_body)
-        return json.jsonify(response)
+        return Response(codec.dumps(response), mimetype="application/json")
     except Exception as e:
         return json.jsonify({
             "type": 4,
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import interactions.codec as codec
+import tasks.signatures as app_tasks
+from interactions.app import InteractionsHandlers, RIP_BOT_PUBLIC_KEY, ERROR_MESSAGE, PING_RESPONSE_BODY, interaction_idempotency_key
+from interactions.verify import verify_request
+
+# ASGI variant of the /interactions endpoint, run with `uvicorn interactions.asgi:app`.
+# Handlers are the same synchronous functions the Flask app dispatches to, they run on a
+# bounded thread pool so a slow SQLite query never blocks the event loop.
+
+ASGI_DB_THREADS = int(os.getenv("ASGI_DB_THREADS", "16"))
+# Discord drops the interaction if it has no response after 3 seconds
+ASGI_DEFER_AFTER = float(os.getenv("ASGI_DEFER_AFTER", "2.0"))
+# commands whose recent latency is above this are deferred up front instead of raced against the deadline
+ASGI_SLOW_COMMAND_SECONDS = float(os.getenv("ASGI_SLOW_COMMAND_SECONDS", "1.0"))
+
+# only read commands are deferred, add-death's own tasks edit @original with the image
+DEFERRABLE_COMMANDS = {"death-stats", "get-death", "remove-death", "tally-deaths"}
+DEFERRED_RESPONSE = {"type": 5}
+
+executor = ThreadPoolExecutor(ASGI_DB_THREADS, thread_name_prefix="rip-bot-handler")
+
+
+class CommandLatency:
+    """Exponentially weighted moving average of each command's handler latency."""
+
+    def __init__(self, weight: float = 0.2):
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._averages: Dict[str, float] = {}
+
+    def record(self, command: str, seconds: float):
+        with self._lock:
+            average = self._averages.get(command)
+            self._averages[command] = seconds if average is None else average + self.weight * (seconds - average)
+
+    def is_slow(self, command: str) -> bool:
+        return self._averages.get(command, 0.0) > ASGI_SLOW_COMMAND_SECONDS
+
+
+command_latency = CommandLatency()
+pending_followups = set()
+
+
+def error_response() -> Dict:
+    return {
+        "type": 4,
+        "data": {
+            "content": ERROR_MESSAGE + "Technobabble: ||" + traceback.format_exc() + "||"
+        }
+    }
+
+
+def run_handler(request_body: Dict, command: Optional[str]) -> Dict:
+    began = time.perf_counter()
+    try:
+        return InteractionsHandlers[request_body["type"]](request_body)
+    except Exception:
+        return error_response()
+    finally:
+        if command:
+            command_latency.record(command, time.perf_counter() - began)
+
+
+async def follow_up(handler: "asyncio.Future[Dict]", interaction_token: str, idempotency_key: str, guild_id: Optional[str]):
+    response = await handler
+    loop = asyncio.get_running_loop()
+    # publishing to the broker blocks, keep it off the event loop
+    await loop.run_in_executor(executor, app_tasks.edit_interaction_response.delay, interaction_token, response.get("data", {}), idempotency_key, guild_id)
+
+
+def defer(handler: "asyncio.Future[Dict]", request_body: Dict) -> Dict:
+    interaction_token = request_body["token"]
+    idempotency_key = interaction_idempotency_key(request_body.get("id"), interaction_token)
+    followup = asyncio.ensure_future(follow_up(handler, interaction_token, idempotency_key, request_body.get("guild_id")))
+    pending_followups.add(followup)
+    followup.add_done_callback(pending_followups.discard)
+    return DEFERRED_RESPONSE
+
+
+async def handle_interaction(request_body: Dict) -> Dict:
+    command = request_body.get("data", {}).get("name") if request_body["type"] == 2 else None
+    deferrable = command in DEFERRABLE_COMMANDS
+
+    loop = asyncio.get_running_loop()
+    handler = loop.run_in_executor(executor, run_handler, request_body, command)
+
+    if deferrable and command_latency.is_slow(command):
+        return defer(handler, request_body)
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(handler), ASGI_DEFER_AFTER if deferrable else None)
+    except asyncio.TimeoutError:
+        return defer(handler, request_body)
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def send_response(send, status: int, body: bytes, content_type: bytes = b"application/json"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def get_signature_headers(scope: Dict) -> Tuple[Optional[str], Optional[str]]:
+    headers = dict(scope["headers"])
+    signature, timestamp = headers.get(b"x-signature-ed25519"), headers.get(b"x-signature-timestamp")
+    return (signature.decode() if signature else None, timestamp.decode() if timestamp else None)
+
+
+async def app(scope: Dict, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/interactions":
+        await send_response(send, 404, b"Not Found", b"text/plain")
+        return
+
+    raw_body = await read_body(receive)
+    signature, timestamp = get_signature_headers(scope)
+    if not verify_request(raw_body, signature, timestamp, RIP_BOT_PUBLIC_KEY):
+        await send_response(send, 401, b"Bad request signature", b"text/plain")
+        return
+
+    try:
+        request_body = codec.loads(raw_body)
+        if request_body["type"] == 1:
+            await send_response(send, 200, PING_RESPONSE_BODY)
+            return
+        response = await handle_interaction(request_body)
+    except Exception:
+        response = error_response()
+
+    await send_response(send, 200, codec.dumps(response))
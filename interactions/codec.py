@@ -0,0 +1,22 @@
+import json as python_json
+from typing import Any
+
+# orjson is optional, when it's installed request and response bodies go through it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson:
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+else:
+    def loads(data: bytes) -> Any:
+        return python_json.loads(data)
+
+    def dumps(value: Any) -> bytes:
+        return python_json.dumps(value, separators=(",", ":")).encode()
@@ -0,0 +1,140 @@
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, Optional, Tuple
+
+# prometheus_client is optional, without it every metric below is a no-op.
+# With several processes (gunicorn workers, Celery prefork children) point PROMETHEUS_MULTIPROC_DIR
+# at an empty directory shared by all of them before they start, each process then writes its
+# samples to mmapped files there and whoever serves /metrics adds them up.
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_WORKER_PORT = int(os.getenv("METRICS_WORKER_PORT", "0"))
+
+# Discord snowflakes count milliseconds from the start of 2015
+DISCORD_EPOCH_MS = 1420070400000
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class NullMetric:
+    def labels(self, *args, **kwargs) -> "NullMetric":
+        return self
+
+    def observe(self, amount: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+
+def histogram(name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = FAST_BUCKETS):
+    if not prometheus_client:
+        return NullMetric()
+
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def counter(name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+    if not prometheus_client:
+        return NullMetric()
+
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+    if not prometheus_client:
+        return NullMetric()
+
+    # with several processes the last one to set it wins, rather than them being added up
+    return prometheus_client.Gauge(name, documentation, labelnames, multiprocess_mode="mostrecent")
+
+
+HANDLER_SECONDS = histogram("rip_bot_handler_seconds", "Slash command handler latency.", ("command",))
+SQL_SECONDS = histogram("rip_bot_sql_seconds", "Time spent in each db.db query function.", ("function",))
+TASK_SECONDS = histogram("rip_bot_task_seconds", "Celery task run time.", ("task",), SLOW_BUCKETS)
+TASK_STAGE_SECONDS = histogram("rip_bot_task_stage_seconds", "Time spent in each stage of a Celery task.", ("task", "stage"), SLOW_BUCKETS)
+END_TO_END_SECONDS = histogram("rip_bot_add_death_end_to_end_seconds", "Time from the add-death interaction to its image being attached.", buckets=SLOW_BUCKETS)
+TASK_QUEUE_WAIT_SECONDS = histogram("rip_bot_task_queue_wait_seconds", "Time a Celery task waited in its queue before a worker started it.", ("queue", "task"), SLOW_BUCKETS)
+
+QUERY_CACHE_EVENTS = counter("rip_bot_query_cache_events", "Query cache lookups and evictions.", ("event",))
+WRITER_COMMITS = counter("rip_bot_writer_commits", "Transactions committed by the write-behind writer.")
+WRITER_OPERATIONS = counter("rip_bot_writer_operations", "Write operations applied by the write-behind writer.")
+MEDIA_UPLOADS = counter("rip_bot_media_uploads", "Images uploaded to S3 or found already stored by their hash.", ("result",))
+MEDIA_BYTES = counter("rip_bot_media_bytes", "Bytes of images uploaded to S3 or found already stored by their hash.", ("result",))
+WRITER_LOCK_ERRORS = counter("rip_bot_writer_lock_errors", "Write-behind batches that failed on a locked database.")
+
+QUEUE_DEPTH = gauge("rip_bot_queue_depth", "Messages waiting in each Celery queue, sampled when /metrics or /queue-stats is read.", ("queue",))
+
+
+@contextmanager
+def timed(metric) -> Iterator[None]:
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric.observe(time.perf_counter() - began)
+
+
+def timed_sql(f: Callable) -> Callable:
+    metric = SQL_SECONDS.labels(f.__name__)
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        began = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            metric.observe(time.perf_counter() - began)
+
+    return wrapper
+
+
+def snowflake_time(snowflake: str) -> float:
+    return ((int(snowflake) >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+def observe_since_interaction(interaction_id: Optional[str]):
+    # tasks queued before interaction_id was passed along don't report end to end time
+    if interaction_id:
+        END_TO_END_SECONDS.observe(time.time() - snowflake_time(interaction_id))
+
+
+def get_registry():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    return prometheus_client.REGISTRY
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if not prometheus_client:
+        return b"", "text/plain; version=0.0.4; charset=utf-8"
+
+    return prometheus_client.generate_latest(get_registry()), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_worker_exporter(**kwargs):
+    # connected to Celery's worker_init, so only the main worker process serves, the pool children
+    # report through PROMETHEUS_MULTIPROC_DIR
+    if prometheus_client and METRICS_WORKER_PORT:
+        prometheus_client.start_http_server(METRICS_WORKER_PORT, registry=get_registry())
+
+
+
+def mark_process_dead(pid: int):
+    # connected to gunicorn's child_exit, so a dead worker's gauges stop being reported
+    if prometheus_client and PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,41 @@
+import sqlite3
+
+# per-day rollup of deaths, day is the UTC day number (timestamp / 86400)
+CREATE_DEATH_DAY_TALLIES_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_day_tallies (
+    server TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    dead_person TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (server, day, dead_person)
+) WITHOUT ROWID"""
+
+CREATE_INSERT_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_day_tally_insert AFTER INSERT ON deaths BEGIN
+    INSERT INTO death_day_tallies (server, day, dead_person, count) VALUES (NEW.server, CAST(NEW.timestamp AS INTEGER) / 86400, NEW.dead_person, 1)
+        ON CONFLICT (server, day, dead_person) DO UPDATE SET count = count + 1;
+END"""
+CREATE_DELETE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_day_tally_delete AFTER DELETE ON deaths BEGIN
+    UPDATE death_day_tallies SET count = count - 1 WHERE server = OLD.server AND day = CAST(OLD.timestamp AS INTEGER) / 86400 AND dead_person = OLD.dead_person;
+    DELETE FROM death_day_tallies WHERE server = OLD.server AND day = CAST(OLD.timestamp AS INTEGER) / 86400 AND dead_person = OLD.dead_person AND count <= 0;
+END"""
+CREATE_UPDATE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_day_tally_update AFTER UPDATE OF server, dead_person, timestamp ON deaths BEGIN
+    UPDATE death_day_tallies SET count = count - 1 WHERE server = OLD.server AND day = CAST(OLD.timestamp AS INTEGER) / 86400 AND dead_person = OLD.dead_person;
+    DELETE FROM death_day_tallies WHERE server = OLD.server AND day = CAST(OLD.timestamp AS INTEGER) / 86400 AND dead_person = OLD.dead_person AND count <= 0;
+    INSERT INTO death_day_tallies (server, day, dead_person, count) VALUES (NEW.server, CAST(NEW.timestamp AS INTEGER) / 86400, NEW.dead_person, 1)
+        ON CONFLICT (server, day, dead_person) DO UPDATE SET count = count + 1;
+END"""
+
+BACKFILL_DEATH_DAY_TALLIES_SQL = """INSERT INTO death_day_tallies (server, day, dead_person, count)
+    SELECT server, CAST(timestamp AS INTEGER) / 86400 AS day, dead_person, COUNT(*) FROM deaths GROUP BY server, day, dead_person"""
+
+
+def backfill(connection: sqlite3.Connection):
+    connection.execute("DELETE FROM death_day_tallies")
+    connection.execute(BACKFILL_DEATH_DAY_TALLIES_SQL)
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_DEATH_DAY_TALLIES_TABLE_SQL)
+    connection.execute(CREATE_INSERT_TRIGGER_SQL)
+    connection.execute(CREATE_DELETE_TRIGGER_SQL)
+    connection.execute(CREATE_UPDATE_TRIGGER_SQL)
+    backfill(connection)
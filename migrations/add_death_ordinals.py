@@ -0,0 +1,61 @@
+import sqlite3
+
+# dense 0..n-1 ordinals per (server, dead_person) so get_death_db can pick a random death
+# with one indexed lookup, dead_person = '' holds the guild-wide ordinals
+CREATE_DEATH_ORDINALS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_ordinals (
+    server TEXT NOT NULL,
+    dead_person TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    death_rowid INTEGER NOT NULL,
+    PRIMARY KEY (server, dead_person, ordinal)
+) WITHOUT ROWID"""
+CREATE_DEATH_ORDINALS_ROWID_INDEX_SQL = """CREATE INDEX IF NOT EXISTS death_ordinals_death_rowid ON death_ordinals (death_rowid)"""
+
+# appends the death at the end of a scope
+APPEND_SQL = """INSERT INTO death_ordinals (server, dead_person, ordinal, death_rowid) VALUES (
+        NEW.server,
+        {scope},
+        (SELECT COALESCE(MAX(ordinal) + 1, 0) FROM death_ordinals WHERE server = NEW.server AND dead_person = {scope}),
+        NEW.rowid
+    );"""
+# removes the death from a scope by moving the last death into its slot, which keeps the ordinals dense
+SWAP_REMOVE_SQL = """UPDATE death_ordinals
+        SET death_rowid = (SELECT death_rowid FROM death_ordinals WHERE server = OLD.server AND dead_person = {scope} ORDER BY ordinal DESC LIMIT 1)
+        WHERE server = OLD.server AND dead_person = {scope} AND death_rowid = OLD.rowid;
+    DELETE FROM death_ordinals
+        WHERE server = OLD.server AND dead_person = {scope}
+        AND ordinal = (SELECT MAX(ordinal) FROM death_ordinals WHERE server = OLD.server AND dead_person = {scope});"""
+
+APPEND_TO_SCOPES_SQL = APPEND_SQL.format(scope="NEW.dead_person") + "\n    " + APPEND_SQL.format(scope="''")
+SWAP_REMOVE_FROM_SCOPES_SQL = SWAP_REMOVE_SQL.format(scope="OLD.dead_person") + "\n    " + SWAP_REMOVE_SQL.format(scope="''")
+
+CREATE_INSERT_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_ordinal_insert AFTER INSERT ON deaths BEGIN
+    {APPEND_TO_SCOPES_SQL}
+END"""
+CREATE_DELETE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_ordinal_delete AFTER DELETE ON deaths BEGIN
+    {SWAP_REMOVE_FROM_SCOPES_SQL}
+END"""
+CREATE_UPDATE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_ordinal_update AFTER UPDATE OF server, dead_person ON deaths BEGIN
+    {SWAP_REMOVE_FROM_SCOPES_SQL}
+    {APPEND_TO_SCOPES_SQL}
+END"""
+
+BACKFILL_DEATH_ORDINALS_SQL = """INSERT INTO death_ordinals (server, dead_person, ordinal, death_rowid)
+    SELECT server, dead_person, ROW_NUMBER() OVER (PARTITION BY server, dead_person ORDER BY rowid) - 1, rowid FROM deaths"""
+BACKFILL_GUILD_DEATH_ORDINALS_SQL = """INSERT INTO death_ordinals (server, dead_person, ordinal, death_rowid)
+    SELECT server, '', ROW_NUMBER() OVER (PARTITION BY server ORDER BY rowid) - 1, rowid FROM deaths"""
+
+
+def backfill(connection: sqlite3.Connection):
+    connection.execute("DELETE FROM death_ordinals")
+    connection.execute(BACKFILL_DEATH_ORDINALS_SQL)
+    connection.execute(BACKFILL_GUILD_DEATH_ORDINALS_SQL)
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_DEATH_ORDINALS_TABLE_SQL)
+    connection.execute(CREATE_DEATH_ORDINALS_ROWID_INDEX_SQL)
+    connection.execute(CREATE_INSERT_TRIGGER_SQL)
+    connection.execute(CREATE_DELETE_TRIGGER_SQL)
+    connection.execute(CREATE_UPDATE_TRIGGER_SQL)
+    backfill(connection)
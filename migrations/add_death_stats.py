@@ -0,0 +1,149 @@
+import sqlite3
+
+# the aggregates behind /death-stats, kept by triggers like death_tallies so the task that writes
+# a death updates them in the same transaction and the command never scans deaths
+CREATE_REPORTER_TALLIES_TABLE_SQL = """CREATE TABLE IF NOT EXISTS reporter_tallies (
+    server TEXT NOT NULL,
+    reporter TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (server, reporter)
+) WITHOUT ROWID"""
+CREATE_REPORTER_TALLIES_RANK_INDEX_SQL = """CREATE INDEX IF NOT EXISTS reporter_tallies_server_count ON reporter_tallies (server, count DESC, reporter)"""
+
+# week is counted in Monday-based weeks since the epoch, 1970-01-01 was a Thursday hence the + 3
+CREATE_DEATH_WEEK_TALLIES_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_week_tallies (
+    server TEXT NOT NULL,
+    week INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (server, week)
+) WITHOUT ROWID"""
+
+# per victim, the latest death and the longest time they went between two deaths, which ended at longest_gap_end.
+# longest_gap is NULL until there's a second death
+CREATE_DEATH_GAPS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_gaps (
+    server TEXT NOT NULL,
+    dead_person TEXT NOT NULL,
+    last_timestamp INTEGER NOT NULL,
+    longest_gap INTEGER,
+    longest_gap_end INTEGER,
+    PRIMARY KEY (server, dead_person)
+) WITHOUT ROWID"""
+CREATE_DEATH_GAPS_LONGEST_INDEX_SQL = """CREATE INDEX IF NOT EXISTS death_gaps_server_longest_gap ON death_gaps (server, longest_gap DESC, dead_person)"""
+CREATE_DEATH_GAPS_LAST_INDEX_SQL = """CREATE INDEX IF NOT EXISTS death_gaps_server_last_timestamp ON death_gaps (server, last_timestamp, dead_person)"""
+
+WEEK_SQL = "(CAST({row}.timestamp AS INTEGER) / 86400 + 3) / 7"
+
+
+def count_sql(table: str, key_columns: str, key_values: str) -> str:
+    return f"""INSERT INTO {table} ({key_columns}, count) VALUES ({key_values}, 1)
+        ON CONFLICT ({key_columns}) DO UPDATE SET count = count + 1;"""
+
+
+def uncount_sql(table: str, where: str) -> str:
+    return f"""UPDATE {table} SET count = count - 1 WHERE {where};
+    DELETE FROM {table} WHERE {where} AND count <= 0;"""
+
+
+def recompute_gaps_sql(row: str) -> str:
+    # one victim's deaths in order, the gap before each one and the longest of them (earliest on ties)
+    victim = f"server = {row}.server AND dead_person = {row}.dead_person"
+    return f"""DELETE FROM death_gaps WHERE {victim};
+    INSERT INTO death_gaps (server, dead_person, last_timestamp, longest_gap, longest_gap_end)
+        SELECT {row}.server, {row}.dead_person, (SELECT MAX(timestamp) FROM deaths WHERE {victim}), gap, CASE WHEN gap IS NULL THEN NULL ELSE timestamp END
+        FROM (SELECT timestamp, timestamp - LAG(timestamp) OVER (ORDER BY timestamp) AS gap FROM deaths WHERE {victim})
+        ORDER BY gap DESC, timestamp LIMIT 1;"""
+
+
+REPORTER_WHERE_SQL = "server = {row}.server AND reporter = {row}.reporter"
+WEEK_WHERE_SQL = "server = {row}.server AND week = " + WEEK_SQL
+
+CREATE_REPORTER_INSERT_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_reporter_tally_insert AFTER INSERT ON deaths BEGIN
+    {count_sql("reporter_tallies", "server, reporter", "NEW.server, NEW.reporter")}
+END"""
+CREATE_REPORTER_DELETE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_reporter_tally_delete AFTER DELETE ON deaths BEGIN
+    {uncount_sql("reporter_tallies", REPORTER_WHERE_SQL.format(row="OLD"))}
+END"""
+CREATE_REPORTER_UPDATE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_reporter_tally_update AFTER UPDATE OF server, reporter ON deaths BEGIN
+    {uncount_sql("reporter_tallies", REPORTER_WHERE_SQL.format(row="OLD"))}
+    {count_sql("reporter_tallies", "server, reporter", "NEW.server, NEW.reporter")}
+END"""
+
+CREATE_WEEK_INSERT_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_week_tally_insert AFTER INSERT ON deaths BEGIN
+    {count_sql("death_week_tallies", "server, week", "NEW.server, " + WEEK_SQL.format(row="NEW"))}
+END"""
+CREATE_WEEK_DELETE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_week_tally_delete AFTER DELETE ON deaths BEGIN
+    {uncount_sql("death_week_tallies", WEEK_WHERE_SQL.format(row="OLD"))}
+END"""
+CREATE_WEEK_UPDATE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_week_tally_update AFTER UPDATE OF server, timestamp ON deaths BEGIN
+    {uncount_sql("death_week_tallies", WEEK_WHERE_SQL.format(row="OLD"))}
+    {count_sql("death_week_tallies", "server, week", "NEW.server, " + WEEK_SQL.format(row="NEW"))}
+END"""
+
+# new deaths are almost always the victim's latest, which only needs their row compared against.
+# SET expressions see the row as it was, so last_timestamp below is still the previous death
+CREATE_GAPS_APPEND_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_gap_append AFTER INSERT ON deaths
+WHEN NEW.timestamp >= IFNULL((SELECT last_timestamp FROM death_gaps WHERE server = NEW.server AND dead_person = NEW.dead_person), NEW.timestamp) BEGIN
+    INSERT INTO death_gaps (server, dead_person, last_timestamp, longest_gap, longest_gap_end) VALUES (NEW.server, NEW.dead_person, NEW.timestamp, NULL, NULL)
+        ON CONFLICT (server, dead_person) DO UPDATE SET
+            longest_gap = CASE WHEN longest_gap IS NULL OR NEW.timestamp - last_timestamp > longest_gap THEN NEW.timestamp - last_timestamp ELSE longest_gap END,
+            longest_gap_end = CASE WHEN longest_gap IS NULL OR NEW.timestamp - last_timestamp > longest_gap THEN NEW.timestamp ELSE longest_gap_end END,
+            last_timestamp = NEW.timestamp;
+END"""
+# a death backdated before the latest one splits a gap, as does removing one, those rescan that victim's deaths
+CREATE_GAPS_BACKDATED_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_gap_backdated AFTER INSERT ON deaths
+WHEN NEW.timestamp < (SELECT last_timestamp FROM death_gaps WHERE server = NEW.server AND dead_person = NEW.dead_person) BEGIN
+    {recompute_gaps_sql("NEW")}
+END"""
+CREATE_GAPS_DELETE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_gap_delete AFTER DELETE ON deaths BEGIN
+    {recompute_gaps_sql("OLD")}
+END"""
+CREATE_GAPS_UPDATE_TRIGGER_SQL = f"""CREATE TRIGGER IF NOT EXISTS deaths_gap_update AFTER UPDATE OF server, dead_person, timestamp ON deaths BEGIN
+    {recompute_gaps_sql("OLD")}
+    {recompute_gaps_sql("NEW")}
+END"""
+
+BACKFILL_REPORTER_TALLIES_SQL = """INSERT INTO reporter_tallies (server, reporter, count)
+    SELECT server, reporter, COUNT(*) FROM deaths GROUP BY server, reporter"""
+BACKFILL_DEATH_WEEK_TALLIES_SQL = """INSERT INTO death_week_tallies (server, week, count)
+    SELECT server, (CAST(timestamp AS INTEGER) / 86400 + 3) / 7 AS week, COUNT(*) FROM deaths GROUP BY server, week"""
+BACKFILL_DEATH_GAPS_SQL = """INSERT INTO death_gaps (server, dead_person, last_timestamp, longest_gap, longest_gap_end)
+    SELECT server, dead_person, last_timestamp, gap, CASE WHEN gap IS NULL THEN NULL ELSE timestamp END FROM (
+        SELECT *, MAX(timestamp) OVER victim AS last_timestamp, ROW_NUMBER() OVER (victim ORDER BY gap DESC, timestamp) AS rank FROM (
+            SELECT server, dead_person, timestamp, timestamp - LAG(timestamp) OVER (PARTITION BY server, dead_person ORDER BY timestamp) AS gap FROM deaths
+        ) WINDOW victim AS (PARTITION BY server, dead_person)
+    ) WHERE rank = 1"""
+
+STATS_TABLES = ("reporter_tallies", "death_week_tallies", "death_gaps")
+
+
+def backfill(connection: sqlite3.Connection):
+    for table in STATS_TABLES:
+        connection.execute(f"DELETE FROM {table}")
+    connection.execute(BACKFILL_REPORTER_TALLIES_SQL)
+    connection.execute(BACKFILL_DEATH_WEEK_TALLIES_SQL)
+    connection.execute(BACKFILL_DEATH_GAPS_SQL)
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_REPORTER_TALLIES_TABLE_SQL)
+    connection.execute(CREATE_REPORTER_TALLIES_RANK_INDEX_SQL)
+    connection.execute(CREATE_DEATH_WEEK_TALLIES_TABLE_SQL)
+    connection.execute(CREATE_DEATH_GAPS_TABLE_SQL)
+    connection.execute(CREATE_DEATH_GAPS_LONGEST_INDEX_SQL)
+    connection.execute(CREATE_DEATH_GAPS_LAST_INDEX_SQL)
+
+    for trigger_sql in (
+        CREATE_REPORTER_INSERT_TRIGGER_SQL,
+        CREATE_REPORTER_DELETE_TRIGGER_SQL,
+        CREATE_REPORTER_UPDATE_TRIGGER_SQL,
+        CREATE_WEEK_INSERT_TRIGGER_SQL,
+        CREATE_WEEK_DELETE_TRIGGER_SQL,
+        CREATE_WEEK_UPDATE_TRIGGER_SQL,
+        CREATE_GAPS_APPEND_TRIGGER_SQL,
+        CREATE_GAPS_BACKDATED_TRIGGER_SQL,
+        CREATE_GAPS_DELETE_TRIGGER_SQL,
+        CREATE_GAPS_UPDATE_TRIGGER_SQL,
+    ):
+        connection.execute(trigger_sql)
+
+    backfill(connection)
@@ -0,0 +1,45 @@
+import sqlite3
+
+CREATE_DEATH_TALLIES_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_tallies (
+    server TEXT NOT NULL,
+    dead_person TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (server, dead_person)
+) WITHOUT ROWID"""
+
+# the leaderboard reads this index in order and stops after LIMIT rows
+CREATE_DEATH_TALLIES_RANK_INDEX_SQL = """CREATE INDEX IF NOT EXISTS death_tallies_server_count ON death_tallies (server, count DESC, dead_person)"""
+
+# the triggers keep the tally in the same transaction as the write to deaths,
+# so every writer (tasks, migrations, sqlite3 shell) keeps it consistent
+CREATE_INSERT_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_tally_insert AFTER INSERT ON deaths BEGIN
+    INSERT INTO death_tallies (server, dead_person, count) VALUES (NEW.server, NEW.dead_person, 1)
+        ON CONFLICT (server, dead_person) DO UPDATE SET count = count + 1;
+END"""
+CREATE_DELETE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_tally_delete AFTER DELETE ON deaths BEGIN
+    UPDATE death_tallies SET count = count - 1 WHERE server = OLD.server AND dead_person = OLD.dead_person;
+    DELETE FROM death_tallies WHERE server = OLD.server AND dead_person = OLD.dead_person AND count <= 0;
+END"""
+CREATE_UPDATE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_tally_update AFTER UPDATE OF server, dead_person ON deaths BEGIN
+    UPDATE death_tallies SET count = count - 1 WHERE server = OLD.server AND dead_person = OLD.dead_person;
+    DELETE FROM death_tallies WHERE server = OLD.server AND dead_person = OLD.dead_person AND count <= 0;
+    INSERT INTO death_tallies (server, dead_person, count) VALUES (NEW.server, NEW.dead_person, 1)
+        ON CONFLICT (server, dead_person) DO UPDATE SET count = count + 1;
+END"""
+
+BACKFILL_DEATH_TALLIES_SQL = """INSERT INTO death_tallies (server, dead_person, count)
+    SELECT server, dead_person, COUNT(*) FROM deaths GROUP BY server, dead_person"""
+
+
+def backfill(connection: sqlite3.Connection):
+    connection.execute("DELETE FROM death_tallies")
+    connection.execute(BACKFILL_DEATH_TALLIES_SQL)
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_DEATH_TALLIES_TABLE_SQL)
+    connection.execute(CREATE_DEATH_TALLIES_RANK_INDEX_SQL)
+    connection.execute(CREATE_INSERT_TRIGGER_SQL)
+    connection.execute(CREATE_DELETE_TRIGGER_SQL)
+    connection.execute(CREATE_UPDATE_TRIGGER_SQL)
+    backfill(connection)
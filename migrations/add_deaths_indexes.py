@@ -0,0 +1,33 @@
+import sqlite3
+
+# message IDs on more than one death, which the unique index below would refuse to build over
+SELECT_DUPLICATE_MESSAGE_IDS_SQL = """SELECT message_id, MIN(rowid), COUNT(*) FROM deaths
+    WHERE message_id IS NOT NULL GROUP BY message_id HAVING COUNT(*) > 1"""
+# the earliest death keeps the message ID, the rest go back to unresolved rather than being deleted,
+# whether they're the same death reported twice is for someone to look at, not the migration
+CLEAR_DUPLICATE_MESSAGE_IDS_SQL = """UPDATE deaths SET message_id = NULL WHERE message_id = :message_id AND rowid != :kept_rowid"""
+
+
+def collapse_duplicate_message_ids(connection: sqlite3.Connection) -> int:
+    duplicates = connection.execute(SELECT_DUPLICATE_MESSAGE_IDS_SQL).fetchall()
+    for message_id, kept_rowid, count in duplicates:
+        print(f"message ID {message_id} was on {count} deaths, kept it on rowid {kept_rowid} and cleared the other {count - 1}")
+        connection.execute(CLEAR_DUPLICATE_MESSAGE_IDS_SQL, {"message_id": message_id, "kept_rowid": kept_rowid})
+
+    return len(duplicates)
+
+
+def migrate(connection: sqlite3.Connection):
+    # unresolved message IDs used to be "", which a unique index would reject after the first row,
+    # NULLs are distinct from each other so they can stay unresolved until update_database_with_message_id runs
+    connection.execute("UPDATE deaths SET message_id = NULL WHERE message_id = ''")
+    collapse_duplicate_message_ids(connection)
+
+    # get_death_db and get_tally_db, the tally is answered from the index alone
+    connection.execute("CREATE INDEX IF NOT EXISTS deaths_server_dead_person ON deaths (server, dead_person)")
+    # get_tally_time_db, covering so the range scan never touches the table
+    connection.execute("CREATE INDEX IF NOT EXISTS deaths_server_timestamp_dead_person ON deaths (server, timestamp, dead_person)")
+    # get_death_by_message_id_db, a message ID only corresponds to one death
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS deaths_message_id ON deaths (message_id)")
+
+    connection.execute("ANALYZE deaths")
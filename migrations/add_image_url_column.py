@@ -1,31 +1,36 @@
 import json as python_json
-import sqlite3
 import os
+from typing import Dict, Optional, Tuple
+
+from db.bulk import connect, update_in_batches
+from db.db import decompress_attachment
 
 DATABASE_PATH = os.getenv("DATABASE_PATH")
 
-def connect_to_database() -> sqlite3.Connection:
-    return sqlite3.connect(DATABASE_PATH)
+UPDATE_IMAGE_URL_SQL = """UPDATE deaths SET image_url = :image_url WHERE rowid = :rowid"""
+ATTACHMENT_COLUMN = """(SELECT attachment FROM death_attachments WHERE death_rowid = deaths.rowid)"""
 
-def migrate():
-    connection = connect_to_database()
-    readCursor = connection.cursor()
-    writeCursor = connection.cursor()
-
-    readCursor.execute("SELECT rowid, attachment FROM deaths")
-    for row in readCursor:
-        rowid, attachmentJson = row
-        attachment = python_json.loads(attachmentJson)
-        image_url = attachment["url"]
-
-        print (rowid, image_url)
-        writeCursor.execute(
-            "UPDATE deaths SET image_url = :image_url WHERE rowid = :rowid",
-            { "rowid": rowid, "image_url": image_url }
-        )
-        connection.commit()
 
+def image_url_from_attachment(row: Tuple[int, str]) -> Optional[Dict]:
+    rowid, attachment_json = row
+    if attachment_json is None:
+        return None
+    attachment = python_json.loads(decompress_attachment(attachment_json))
+    return { "rowid": rowid, "image_url": attachment["url"] }
+
+
+def migrate():
+    connection = connect(DATABASE_PATH)
+    result = update_in_batches(
+        connection,
+        "add_image_url_column",
+        [ATTACHMENT_COLUMN],
+        UPDATE_IMAGE_URL_SQL,
+        image_url_from_attachment,
+        where="image_url IS NULL OR image_url = ''",
+    )
+    print(f"updated {result['rows']} rows in {result['batches']} batches")
     connection.close()
 
 if __name__ == "__main__":
-    migrate()
\ No newline at end of file
+    migrate()
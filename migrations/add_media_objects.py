@@ -0,0 +1,19 @@
+import sqlite3
+
+# one row per distinct image uploaded to S3, keyed by the SHA-256 of its bytes, so a repost
+# is recognised before it's uploaded again
+CREATE_MEDIA_OBJECTS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS media_objects (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    url TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    thumbnail_url TEXT,
+    created_at INTEGER NOT NULL
+) WITHOUT ROWID"""
+# get_death_db finds a death's thumbnail through deaths.image_url
+CREATE_MEDIA_OBJECTS_URL_INDEX_SQL = """CREATE UNIQUE INDEX IF NOT EXISTS media_objects_url ON media_objects (url)"""
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_MEDIA_OBJECTS_TABLE_SQL)
+    connection.execute(CREATE_MEDIA_OBJECTS_URL_INDEX_SQL)
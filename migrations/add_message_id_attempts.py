@@ -0,0 +1,18 @@
+import sqlite3
+
+# how often reconcile_message_ids looked for a death's message in its channel without finding it,
+# so a death whose message is gone stops costing a Discord request every run
+CREATE_MESSAGE_ID_ATTEMPTS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS message_id_attempts (
+    death_rowid INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    last_attempt_at INTEGER NOT NULL
+)"""
+# rowids are reused, a new death mustn't inherit the attempts of a deleted one
+CREATE_DELETE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_message_id_attempts_delete AFTER DELETE ON deaths BEGIN
+    DELETE FROM message_id_attempts WHERE death_rowid = OLD.rowid;
+END"""
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_MESSAGE_ID_ATTEMPTS_TABLE_SQL)
+    connection.execute(CREATE_DELETE_TRIGGER_SQL)
@@ -0,0 +1,18 @@
+import sqlite3
+
+# one row per completed task step, keyed by the interaction the task works for. Redelivered or
+# retried tasks find their row and return the stored result instead of doing the work again
+CREATE_TASK_STEPS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS task_steps (
+    idempotency_key TEXT NOT NULL,
+    step TEXT NOT NULL,
+    result TEXT,
+    completed_at INTEGER NOT NULL,
+    PRIMARY KEY (idempotency_key, step)
+) WITHOUT ROWID"""
+# prune_task_steps deletes by age
+CREATE_TASK_STEPS_COMPLETED_AT_INDEX_SQL = """CREATE INDEX IF NOT EXISTS task_steps_completed_at ON task_steps (completed_at)"""
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_TASK_STEPS_TABLE_SQL)
+    connection.execute(CREATE_TASK_STEPS_COMPLETED_AT_INDEX_SQL)
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import sys
+from typing import Dict, List
+
+from migrations.add_death_stats import STATS_TABLES, backfill
+
+DATABASE_PATH = os.getenv("DATABASE_PATH")
+
+
+def read_stats(connection: sqlite3.Connection) -> Dict[str, List]:
+    return {table: connection.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in STATS_TABLES}
+
+
+def check_death_stats(repair: bool = False) -> bool:
+    connection = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+    # the stats are rebuilt from scratch inside the transaction and compared with what the triggers kept,
+    # the rebuild is only kept when repairing
+    connection.execute("BEGIN IMMEDIATE")
+    maintained = read_stats(connection)
+    backfill(connection)
+    rebuilt = read_stats(connection)
+
+    mismatched = [table for table in STATS_TABLES if maintained[table] != rebuilt[table]]
+    for table in mismatched:
+        differences = set(maintained[table]) ^ set(rebuilt[table])
+        print(f"{table}: {len(differences)} rows differ from a rebuild")
+
+    if mismatched and repair:
+        connection.execute("COMMIT")
+        print(f"rebuilt {', '.join(mismatched)}")
+    else:
+        connection.execute("ROLLBACK")
+
+    connection.close()
+    return not mismatched or repair
+
+if __name__ == "__main__":
+    sys.exit(0 if check_death_stats(repair="--repair" in sys.argv) else 1)
@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import sys
+from typing import List, Tuple
+
+from migrations.add_death_tallies import backfill
+
+DATABASE_PATH = os.getenv("DATABASE_PATH")
+
+# rows where the aggregate disagrees with the raw table, in either direction
+SELECT_TALLY_MISMATCHES_SQL = """
+SELECT raw.server, raw.dead_person, raw.count, death_tallies.count
+    FROM (SELECT server, dead_person, COUNT(*) AS count FROM deaths GROUP BY server, dead_person) AS raw
+    LEFT JOIN death_tallies ON death_tallies.server = raw.server AND death_tallies.dead_person = raw.dead_person
+    WHERE death_tallies.count IS NOT raw.count
+UNION ALL
+SELECT death_tallies.server, death_tallies.dead_person, NULL, death_tallies.count
+    FROM death_tallies
+    WHERE NOT EXISTS (SELECT 1 FROM deaths WHERE deaths.server = death_tallies.server AND deaths.dead_person = death_tallies.dead_person)
+"""
+
+
+def get_tally_mismatches(connection: sqlite3.Connection) -> List[Tuple[str, str, int, int]]:
+    return connection.execute(SELECT_TALLY_MISMATCHES_SQL).fetchall()
+
+
+def check_tallies(repair: bool = False) -> bool:
+    connection = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+    # a single read snapshot so concurrent writes can't show up as mismatches,
+    # IMMEDIATE when repairing so no write lands between the check and the rebuild
+    connection.execute("BEGIN IMMEDIATE" if repair else "BEGIN")
+    mismatches = get_tally_mismatches(connection)
+
+    for server, dead_person, raw_count, tally_count in mismatches:
+        print(f"server {server} dead_person {dead_person}: deaths has {raw_count}, death_tallies has {tally_count}")
+
+    if mismatches and repair:
+        backfill(connection)
+        print(f"rebuilt death_tallies, {len(mismatches)} mismatches repaired")
+
+    connection.execute("COMMIT")
+    connection.close()
+    return not mismatches or repair
+
+if __name__ == "__main__":
+    sys.exit(0 if check_tallies(repair="--repair" in sys.argv) else 1)
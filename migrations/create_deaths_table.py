@@ -0,0 +1,17 @@
+import sqlite3
+
+# baseline schema, attachment moves to death_attachments in move_attachments_to_side_table
+CREATE_DEATHS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS deaths (
+    server TEXT,
+    channel_id TEXT,
+    message_id TEXT,
+    dead_person TEXT,
+    caption TEXT,
+    attachment TEXT,
+    image_url TEXT,
+    timestamp INTEGER,
+    reporter TEXT
+)"""
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_DEATHS_TABLE_SQL)
@@ -0,0 +1,35 @@
+import sqlite3
+
+from db.db import compress_attachment
+
+# the attachment JSON is only ever read by get_death_db, keeping it in deaths made every page the
+# tallies and scans touch a few times larger. It moves here, zlib-compressed, keyed by the death's rowid.
+CREATE_DEATH_ATTACHMENTS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS death_attachments (
+    death_rowid INTEGER PRIMARY KEY,
+    attachment BLOB NOT NULL
+)"""
+CREATE_DELETE_TRIGGER_SQL = """CREATE TRIGGER IF NOT EXISTS deaths_attachment_delete AFTER DELETE ON deaths BEGIN
+    DELETE FROM death_attachments WHERE death_rowid = OLD.rowid;
+END"""
+
+SELECT_ATTACHMENTS_SQL = """SELECT rowid, attachment FROM deaths WHERE attachment IS NOT NULL"""
+INSERT_ATTACHMENT_SQL = """INSERT OR REPLACE INTO death_attachments (death_rowid, attachment) VALUES (?, ?)"""
+
+BATCH_SIZE = 5000
+# no VACUUM afterwards to give the freed pages back, new rows reuse them. deaths has no INTEGER PRIMARY KEY
+# and VACUUM may renumber implicit rowids, which death_attachments and the other side tables are keyed on
+
+
+def migrate(connection: sqlite3.Connection):
+    connection.execute(CREATE_DEATH_ATTACHMENTS_TABLE_SQL)
+    connection.execute(CREATE_DELETE_TRIGGER_SQL)
+
+    attachments = connection.execute(SELECT_ATTACHMENTS_SQL)
+    while True:
+        rows = attachments.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        connection.executemany(INSERT_ATTACHMENT_SQL, [(rowid, compress_attachment(attachment)) for rowid, attachment in rows])
+
+    # needs SQLite 3.35+
+    connection.execute("ALTER TABLE deaths DROP COLUMN attachment")
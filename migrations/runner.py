@@ -0,0 +1,78 @@
+import importlib
+import sqlite3
+import time
+from typing import List, Optional, Set, Tuple
+
+CREATE_SCHEMA_MIGRATIONS_SQL = """CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at INTEGER NOT NULL)"""
+SELECT_APPLIED_VERSIONS_SQL = """SELECT version FROM schema_migrations"""
+INSERT_APPLIED_VERSION_SQL = """INSERT INTO schema_migrations VALUES (:version, :name, :applied_at)"""
+
+# versioned migrations, in order. Each module exposes migrate(connection) and runs inside
+# a transaction the runner opens, so a failed migration leaves nothing half-applied.
+# add_image_url_column.py is a one-off data fix that predates the runner and was already
+# applied to the production database by hand.
+# Never VACUUM these databases: the side tables reference deaths by its implicit rowid, which VACUUM may renumber.
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, "migrations.create_deaths_table"),
+    (2, "migrations.add_deaths_indexes"),
+    (3, "migrations.add_death_tallies"),
+    (4, "migrations.add_death_day_tallies"),
+    (5, "migrations.add_death_ordinals"),
+    (6, "migrations.add_media_objects"),
+    (7, "migrations.move_attachments_to_side_table"),
+    (8, "migrations.add_task_steps"),
+    (9, "migrations.add_death_stats"),
+    (10, "migrations.add_message_id_attempts"),
+]
+
+
+def connect_to_database(path: str) -> sqlite3.Connection:
+    # autocommit mode so the runner controls BEGIN/COMMIT itself, DDL included
+    return sqlite3.connect(path, isolation_level=None)
+
+
+def get_applied_versions(connection: sqlite3.Connection) -> Set[int]:
+    connection.execute(CREATE_SCHEMA_MIGRATIONS_SQL)
+    return {row[0] for row in connection.execute(SELECT_APPLIED_VERSIONS_SQL)}
+
+
+def run_migrations(connection: sqlite3.Connection, target: Optional[int] = None) -> List[int]:
+    applied = get_applied_versions(connection)
+    newly_applied = []
+
+    for version, module_name in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+
+        module = importlib.import_module(module_name)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            module.migrate(connection)
+            connection.execute(INSERT_APPLIED_VERSION_SQL, {
+                "version": version,
+                "name": module_name,
+                "applied_at": int(time.time()),
+            })
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        newly_applied.append(version)
+
+    return newly_applied
+
+
+def migrate():
+    # imported here, db.storage migrates new shards with this module
+    from db.storage import get_storage
+
+    # DATABASE_PATH, or every guild's shard with STORAGE_ENGINE=sqlite_shards
+    for path in get_storage().paths():
+        connection = connect_to_database(path)
+        for version in run_migrations(connection):
+            print(f"{path}: applied migration {version}")
+        connection.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,102 @@
+import argparse
+import json as python_json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from db.bulk import BULK_BATCH_SIZE, HOT_DEATH_COLUMNS, connect, defer_schema, get_checkpoint, restore_schema, run_batches
+from db.storage import DATABASE_PATH, SHARD_DIRECTORY, migrate_shard, shard_path
+
+# copies every guild in DATABASE_PATH into its own shard in SHARD_DIRECTORY for STORAGE_ENGINE=sqlite_shards.
+# DATABASE_PATH is only read, it stays as it was until it's removed by hand. Stop the bot and let the queues
+# drain first, task_steps aren't copied and queued tasks carry rowids from the single database
+
+ATTACH_SOURCE_SQL = """ATTACH DATABASE :path AS source"""
+SELECT_GUILDS_SQL = """SELECT DISTINCT server FROM deaths"""
+SELECT_GUILD_ROWIDS_SQL = """SELECT rowid FROM source.deaths WHERE server = :guild_id AND rowid > :after ORDER BY rowid LIMIT :batch_size"""
+# rowids are kept, so a shard's deaths are numbered as they were and a rerun skips what it already copied
+COPY_DEATH_SQL = f"""INSERT OR IGNORE INTO deaths (rowid, {", ".join(HOT_DEATH_COLUMNS)})
+    SELECT rowid, {", ".join(HOT_DEATH_COLUMNS)} FROM source.deaths WHERE rowid = :rowid"""
+# already compressed, copied as they are
+COPY_DEATH_ATTACHMENT_SQL = """INSERT OR IGNORE INTO death_attachments (death_rowid, attachment)
+    SELECT death_rowid, attachment FROM source.death_attachments WHERE death_rowid = :rowid"""
+# the images this guild's deaths point at, for the thumbnails and so a repost isn't uploaded again
+COPY_MEDIA_OBJECTS_SQL = """INSERT OR IGNORE INTO media_objects
+    SELECT * FROM source.media_objects WHERE url IN (SELECT image_url FROM deaths)"""
+SELECT_SOURCE_COUNT_SQL = """SELECT COUNT(*) FROM source.deaths WHERE server = :guild_id"""
+SELECT_SHARD_COUNT_SQL = """SELECT COUNT(*) FROM deaths"""
+
+
+def copy_deaths(connection: sqlite3.Connection, parameters: List[Dict]):
+    connection.executemany(COPY_DEATH_SQL, parameters)
+    connection.executemany(COPY_DEATH_ATTACHMENT_SQL, parameters)
+
+
+def split_guild(connection: sqlite3.Connection, guild_id: str, batch_size: int) -> Dict:
+    """
+    Copies guild_id's deaths from the attached source into the shard connection is open on,
+    with the indexes and aggregate triggers deferred until the end like a bulk import.
+    """
+    def read_batch(after: int) -> Optional[Tuple[List[Dict], int]]:
+        rows = connection.execute(SELECT_GUILD_ROWIDS_SQL, {"guild_id": guild_id, "after": after, "batch_size": batch_size}).fetchall()
+        if not rows:
+            return None
+        return [{"rowid": rowid} for rowid, in rows], rows[-1][0]
+
+    job = f"split:{guild_id}"
+    _, _, completed_at = get_checkpoint(connection, job)
+    # a rerun only puts back what an interrupted one left deferred
+    deferred = defer_schema(connection) if not completed_at else []
+    result = run_batches(connection, job, copy_deaths, read_batch)
+    restore_schema(connection)
+
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute(COPY_MEDIA_OBJECTS_SQL)
+    connection.execute("COMMIT")
+
+    source_count, = connection.execute(SELECT_SOURCE_COUNT_SQL, {"guild_id": guild_id}).fetchone()
+    shard_count, = connection.execute(SELECT_SHARD_COUNT_SQL).fetchone()
+
+    return {**result, "deferred": len(deferred), "source_deaths": source_count, "shard_deaths": shard_count}
+
+
+def split_into_shards(source_path: str, directory: str, batch_size: int = BULK_BATCH_SIZE) -> bool:
+    source = sqlite3.connect(source_path)
+    guilds = [guild_id for guild_id, in source.execute(SELECT_GUILDS_SQL)]
+    source.close()
+
+    os.makedirs(directory, exist_ok=True)
+    matched = True
+    for guild_id in guilds:
+        began = time.perf_counter()
+        path = shard_path(directory, guild_id)
+        migrate_shard(path)
+
+        connection = connect(path)
+        connection.execute(ATTACH_SOURCE_SQL, {"path": source_path})
+        result = split_guild(connection, guild_id, batch_size)
+        connection.close()
+
+        matched = matched and result["source_deaths"] == result["shard_deaths"]
+        print(python_json.dumps({"guild_id": guild_id, "shard": path, **result, "elapsed_seconds": time.perf_counter() - began}))
+
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copies each guild's deaths from the single database into a shard of its own.")
+    parser.add_argument("--source", default=DATABASE_PATH)
+    parser.add_argument("--directory", default=SHARD_DIRECTORY)
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not args.source or not args.directory:
+        parser.error("needs DATABASE_PATH and SHARD_DIRECTORY, or --source and --directory")
+
+    # a guild whose shard ended up with a different count fails the run
+    sys.exit(0 if split_into_shards(args.source, args.directory, args.batch_size) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import time
+from typing import Dict
+
+from celery import Celery
+from celery.signals import before_task_publish
+
+from tasks.routing import get_task_queues, get_task_routes
+
+# the Celery app on its own, without the tasks, so the web side can publish them without importing
+# tasks.tasks and with it boto3, requests and Pillow. tasks.tasks registers the tasks on this app.
+CELERY_BROKER = os.getenv("CELERY_BROKER")
+# Celery reads CELERY_RESULT_BACKEND from the environment itself. Only the canvas add-death pipeline
+# needs one, its chord waits on results, interactions.app checks for it when that pipeline is picked
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
+TASKS_MODULE = "tasks.tasks"
+
+# every task records the step it completed under the interaction's idempotency key, so a message
+# redelivered after a worker dies mid-task is cheap to run again and acking late is safe
+TASK_ACKS_LATE = os.getenv("TASK_ACKS_LATE", "1") == "1"
+
+app = Celery("tasks", broker=CELERY_BROKER)
+app.conf.task_acks_late = TASK_ACKS_LATE
+app.conf.task_reject_on_worker_lost = TASK_ACKS_LATE
+app.conf.task_queues = get_task_queues()
+app.conf.task_routes = get_task_routes(TASKS_MODULE)
+# a worker only reserves the message it's about to run, the rest stay in the queue for an idle one
+app.conf.worker_prefetch_multiplier = 1
+
+
+@before_task_publish.connect
+def record_publish_time(headers: Dict = None, **kwargs):
+    # a header, so it arrives with the message whichever process picks it up
+    headers.setdefault("published_at", time.time())
+
+
+def reset_after_fork():
+    # broker connections a preloading parent opened aren't safe to share with its children. This is
+    # the cleanup Celery runs itself in multiprocessing children, gunicorn forks without telling it
+    app._after_fork()
+
+
+def connect_to_broker():
+    # opens this process's publishing connection ahead of its first task instead of during a request
+    with app.producer_pool.acquire(block=True) as producer:
+        producer.connection.ensure_connection(max_retries=1)
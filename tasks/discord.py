@@ -0,0 +1,134 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE", "https://discord.com/api/v10")
+DISCORD_POOL_MAXSIZE = int(os.getenv("DISCORD_POOL_MAXSIZE", "32"))
+DISCORD_TIMEOUT = 10
+
+# Discord shares a rate-limit bucket between requests to the same route with the same major parameters
+MAJOR_PARAMETERS = ("channel_id", "guild_id", "application_id", "interaction_token")
+ROUTE_PARAMETER_PATTERN = re.compile(r"{(\w+)}")
+# how often buckets past their reset are dropped, there's one per channel and interaction token
+BUCKET_PRUNE_INTERVAL = 60
+
+
+class RateLimited(Exception):
+    """Raised instead of sending (or after a 429) with how long the route is blocked for."""
+
+    def __init__(self, route: str, retry_after: float, is_global: bool = False):
+        super().__init__(f"rate limited on {route}, retry after {retry_after:.2f}s")
+        self.route = route
+        self.retry_after = retry_after
+        self.is_global = is_global
+
+
+class DiscordClient:
+    """
+    Discord REST client holding one keep-alive connection pool for the process.
+
+    Tracks the X-RateLimit-* headers per bucket and major parameters, like Discord scopes them,
+    and raises RateLimited rather than sleeping, so Celery tasks can schedule their retry for when
+    the bucket resets. Buckets are forgotten once they've reset.
+    """
+
+    def __init__(self, base_url: str, authorization: str, pool_maxsize: int = DISCORD_POOL_MAXSIZE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = authorization
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        # "method route" -> Discord bucket hash, one per route so it stays small.
+        # (bucket hash, major parameters) -> (remaining, resets at), the route until its hash is known
+        self._route_buckets: Dict[str, str] = {}
+        self._buckets: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._pruned_at = time.monotonic()
+        self._global_reset_at = 0.0
+
+    def request(self, method: str, route: str, **kwargs) -> requests.Response:
+        route_parameters = {name: kwargs.pop(name) for name in ROUTE_PARAMETER_PATTERN.findall(route)}
+        route_key = f"{method} {route}"
+        major = self._major(route_parameters)
+
+        retry_after = self._get_retry_after(route_key, major)
+        if retry_after:
+            raise RateLimited(f"{route_key} {major}", retry_after)
+
+        response = self.session.request(
+            method,
+            self.base_url + route.format(**route_parameters),
+            timeout=DISCORD_TIMEOUT,
+            **kwargs,
+        )
+        self._update_bucket(route_key, major, response)
+
+        if response.status_code == 429:
+            is_global = response.headers.get("X-RateLimit-Global") == "true"
+            retry_after = float(response.headers.get("Retry-After", 1))
+            if is_global:
+                with self._lock:
+                    self._global_reset_at = time.monotonic() + retry_after
+            raise RateLimited(f"{route_key} {major}", retry_after, is_global)
+
+        response.raise_for_status()
+        return response
+
+    def _major(self, route_parameters: Dict[str, str]) -> str:
+        return ":".join(str(route_parameters[name]) for name in MAJOR_PARAMETERS if name in route_parameters)
+
+    def _get_retry_after(self, route_key: str, major: str) -> Optional[float]:
+        now = time.monotonic()
+        with self._lock:
+            if self._global_reset_at > now:
+                return self._global_reset_at - now
+
+            bucket = self._buckets.get((self._route_buckets.get(route_key, route_key), major))
+            if bucket:
+                remaining, reset_at = bucket
+                if remaining <= 0 and reset_at > now:
+                    return reset_at - now
+
+        return None
+
+    def _update_bucket(self, route_key: str, major: str, response: requests.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_after = response.headers.get("X-RateLimit-Reset-After")
+        if remaining is None or reset_after is None:
+            return
+
+        bucket = response.headers.get("X-RateLimit-Bucket", route_key)
+        now = time.monotonic()
+        with self._lock:
+            self._route_buckets[route_key] = bucket
+            self._buckets[(bucket, major)] = (int(remaining), now + float(reset_after))
+
+            # a bucket past its reset has its full limit again, which is what an unknown one is assumed to have
+            if now - self._pruned_at >= BUCKET_PRUNE_INTERVAL:
+                self._buckets = {key: state for key, state in self._buckets.items() if state[1] > now}
+                self._pruned_at = now
+
+
+_client: Optional[DiscordClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def get_discord_client() -> DiscordClient:
+    # one client per worker process, a forked child builds its own instead of sharing sockets,
+    # and threads share one rather than each tracking the rate limits on their own
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = DiscordClient(DISCORD_API_BASE, os.getenv("AUTHORIZATION"))
+                _client_pid = os.getpid()
+
+    return _client
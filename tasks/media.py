@@ -0,0 +1,61 @@
+import hashlib
+import io
+import mimetypes
+import os
+from typing import Optional
+
+# Pillow is optional, without it no thumbnails are made and get_death keeps embedding the original
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_CONTENT_TYPE = "image/jpeg"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class HashingReader:
+    """File-like wrapper that copies everything read from source into spool and hashes it on the way."""
+
+    def __init__(self, source, spool):
+        self.source = source
+        self.spool = spool
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        self.spool.write(data)
+        return data
+
+    def drain(self):
+        while self.read(STREAM_CHUNK_SIZE):
+            pass
+
+
+def content_key(prefix: str, sha256: str, content_type: str) -> str:
+    # the same bytes always land on the same key, whatever the file was called when it was posted
+    extension = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return f"{prefix}/{sha256[:2]}/{sha256}{extension}"
+
+
+def make_thumbnail(path: str) -> Optional[bytes]:
+    if not Image:
+        return None
+
+    try:
+        with Image.open(path) as image:
+            # draft lets the JPEG decoder downscale while decoding, the first frame stands in for animations
+            image.draft("RGB", (THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+            image.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+            thumbnail = io.BytesIO()
+            image.convert("RGB").save(thumbnail, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            return thumbnail.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # not an image Pillow can read, the original is still uploaded
+        return None
@@ -0,0 +1,64 @@
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+from metrics.metrics import DISCORD_EPOCH_MS, snowflake_time
+
+# what Discord returns from a channel's message history at most per request
+CHANNEL_HISTORY_LIMIT = 100
+
+
+def snowflake_at(seconds: float) -> int:
+    # the smallest snowflake Discord would have given something created at seconds, for after=/before=
+    return max(0, int(seconds * 1000) - DISCORD_EPOCH_MS) << 22
+
+
+def is_death_message(message: Dict, dead_person: str, reporter: str, bot_id: Optional[str]) -> bool:
+    # the bot's answer to add-death, sent on behalf of the reporter's interaction and starting
+    # like DEATH_MESSAGE_TEMPLATE. A removed death's message is struck through and doesn't match
+    if bot_id and message.get("author", {}).get("id") != bot_id:
+        return False
+
+    # interaction on API versions before interaction_metadata
+    interaction = message.get("interaction_metadata") or message.get("interaction") or {}
+    if interaction.get("user", {}).get("id") != reporter:
+        return False
+
+    return message.get("content", "").startswith(f"<@{dead_person}> died!")
+
+
+def match_death_messages(
+    deaths: List[Tuple],
+    messages: List[Dict],
+    taken: Set[str],
+    bot_id: Optional[str],
+    window: float,
+) -> Tuple[Dict[int, str], List[int]]:
+    """
+    Pairs a channel's deaths, (rowid, server, channel_id, dead_person, reporter, timestamp) oldest first,
+    with messages from one page of its history fetched from before the oldest of them. A death gets the
+    closest message for its victim and reporter sent within window seconds of it that no other death has.
+
+    Returns the matches by rowid and the rowids the page covered without a match. A full page stops
+    somewhere, deaths past where it stops (other than the oldest) weren't looked for and are in neither.
+    """
+    sent = [(snowflake_time(message["id"]), message) for message in messages if message["id"] not in taken]
+    covered_until = snowflake_time(max(int(message["id"]) for message in messages)) if len(messages) >= CHANNEL_HISTORY_LIMIT else math.inf
+
+    matched: Dict[int, str] = {}
+    missed: List[int] = []
+    used: Set[str] = set()
+    for rowid, _, _, dead_person, reporter, timestamp in deaths:
+        candidates = [
+            (abs(sent_at - timestamp), message["id"]) for sent_at, message in sent
+            if abs(sent_at - timestamp) <= window and message["id"] not in used and is_death_message(message, dead_person, reporter, bot_id)
+        ]
+        if candidates:
+            _, message_id = min(candidates)
+            matched[rowid] = message_id
+            used.add(message_id)
+        elif timestamp + window <= covered_until or rowid == deaths[0][0]:
+            # the oldest counts either way, the page starts at it, so a channel busy enough to fill
+            # a page within its window can't hold the job on the same page forever
+            missed.append(rowid)
+
+    return matched, missed
@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from celery import Celery
+from kombu import Queue
+
+from metrics.metrics import QUEUE_DEPTH
+
+# user-visible Discord calls, network transfers and tasks that only write to SQLite each get a queue and a
+# worker of their own (see the run_worker_* targets in the Makefile), so a burst of uploads can't hold up the
+# messages users are watching or the deletes and image URL updates behind it. TASK_ROUTING=0 puts everything
+# back on the default queue for a single worker.
+# This doesn't serialize the writes. Tasks on the other queues write too: the lean pipeline's insert and
+# media objects, message IDs and every task's step record, so each worker process has its own BatchWriter
+# and they take turns on SQLite's write lock through busy_timeout.
+TASK_ROUTING = os.getenv("TASK_ROUTING", "1") == "1"
+QUEUE_DEPTH_INTERVAL = float(os.getenv("QUEUE_DEPTH_INTERVAL", "5"))
+
+INTERACTIVE_QUEUE = "interactive"
+IO_QUEUE = "io"
+DB_QUEUE = "db"
+TASK_QUEUES = (INTERACTIVE_QUEUE, IO_QUEUE, DB_QUEUE)
+
+TASK_QUEUE_NAMES = {
+    "update_interaction_with_image": INTERACTIVE_QUEUE,
+    "update_death_message": INTERACTIVE_QUEUE,
+    "edit_interaction_response": INTERACTIVE_QUEUE,
+    # no I/O of its own, only the barrier in front of the user-visible followups
+    "gather_results": INTERACTIVE_QUEUE,
+    # the upload overlaps the insert in add_death_and_upload_image, both write to SQLite from here
+    "download_image_and_upload_to_s3": IO_QUEUE,
+    "add_death_and_upload_image": IO_QUEUE,
+    # a Discord GET before the write, it would hold a db thread for the round trip
+    "update_database_with_message_id": IO_QUEUE,
+    "reconcile_message_ids": IO_QUEUE,
+    "clean_image_spool": IO_QUEUE,
+    "add_death_to_db": DB_QUEUE,
+    "update_database_with_image": DB_QUEUE,
+    "delete_from_database": DB_QUEUE,
+    "prune_task_steps": DB_QUEUE,
+}
+
+_queue_depths: Dict[str, int] = {}
+_queue_depths_at = 0.0
+
+
+def get_task_queues() -> Optional[Tuple[Queue, ...]]:
+    # declared up front so a worker started without -Q still consumes all of them
+    if not TASK_ROUTING:
+        return None
+
+    return tuple(Queue(queue) for queue in TASK_QUEUES)
+
+
+def get_task_routes(module: str) -> Dict[str, Dict]:
+    if not TASK_ROUTING:
+        return {}
+
+    return {f"{module}.{name}": {"queue": queue} for name, queue in TASK_QUEUE_NAMES.items()}
+
+
+def get_queue_depths(app: Celery) -> Dict[str, int]:
+    # asks the broker at most once per QUEUE_DEPTH_INTERVAL, however often it's scraped
+    global _queue_depths, _queue_depths_at
+    if time.monotonic() - _queue_depths_at < QUEUE_DEPTH_INTERVAL:
+        return _queue_depths
+
+    depths = {}
+    with app.connection_for_read() as connection:
+        # fail fast when the broker is down rather than hold up the scrape retrying
+        connection.ensure_connection(max_retries=1)
+        channel = connection.default_channel
+        for queue in TASK_QUEUES if TASK_ROUTING else (app.conf.task_default_queue,):
+            try:
+                _, depth, _ = channel.queue_declare(queue, passive=True)
+            except connection.channel_errors:
+                # not declared yet, no worker has consumed from it
+                channel = connection.channel()
+                depth = 0
+            depths[queue] = depth
+            QUEUE_DEPTH.labels(queue).set(depth)
+
+    _queue_depths, _queue_depths_at = depths, time.monotonic()
+    return depths
@@ -0,0 +1,68 @@
+import os
+import threading
+from typing import Any, Optional
+
+# boto3 takes a tenth of a second to import, it's imported on first use so processes that never
+# upload (beat, the web side) don't pay for it
+
+# lets the S3 client point at a local stand-in (MinIO, moto) instead of AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "10"))
+
+# uploads above the threshold are split into chunksize parts, max_concurrency of them in flight,
+# which also bounds the memory an upload of a non-seekable stream holds to chunksize * max_concurrency
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "4"))
+
+_client: Optional[Any] = None
+_client_pid: Optional[int] = None
+# worker threads asking at once would each build a client
+_client_lock = threading.Lock()
+_transfer_config: Optional[Any] = None
+
+
+def get_transfer_config() -> Any:
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            use_threads=S3_MAX_CONCURRENCY > 1,
+        )
+
+    return _transfer_config
+
+
+def create_s3_client() -> Any:
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=max(S3_MAX_POOL_CONNECTIONS, S3_MAX_CONCURRENCY),
+        s3={"addressing_style": "path"} if S3_ENDPOINT_URL else None,
+    )
+    # a dedicated session, the default one is shared module state and not safe to build clients from concurrently
+    return boto3.session.Session().client("s3", endpoint_url=S3_ENDPOINT_URL, config=config)
+
+
+def get_s3_client() -> Any:
+    # one client per worker process, building it resolves credentials and endpoints which costs
+    # tens of milliseconds, and a client inherited over fork would share its connection pool
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = create_s3_client()
+                _client_pid = os.getpid()
+
+    return _client
+
+
+def init_s3_client(**kwargs):
+    # connected to Celery's worker_init for the threads pool, whose tasks run in the worker process,
+    # and worker_process_init for prefork's children, so the cost is paid before the first task arrives
+    get_s3_client()
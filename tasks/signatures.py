@@ -0,0 +1,36 @@
+from celery import Signature
+from celery.result import AsyncResult
+
+from tasks.celery_app import TASKS_MODULE, app
+
+
+class TaskByName:
+    """
+    The s()/si()/delay() half of a tasks.tasks task, built from its name, so the web side can
+    start pipelines without importing tasks.tasks. In a process that did import it (a worker,
+    the benchmarks) the signatures resolve to the registered task as usual.
+    """
+
+    def __init__(self, name: str):
+        self.name = f"{TASKS_MODULE}.{name}"
+
+    def s(self, *args, **kwargs) -> Signature:
+        return app.signature(self.name, args=args, kwargs=kwargs)
+
+    def si(self, *args, **kwargs) -> Signature:
+        return app.signature(self.name, args=args, kwargs=kwargs, immutable=True)
+
+    def delay(self, *args, **kwargs) -> AsyncResult:
+        return self.s(*args, **kwargs).delay()
+
+
+add_death_to_db = TaskByName("add_death_to_db")
+download_image_and_upload_to_s3 = TaskByName("download_image_and_upload_to_s3")
+add_death_and_upload_image = TaskByName("add_death_and_upload_image")
+gather_results = TaskByName("gather_results")
+update_database_with_image = TaskByName("update_database_with_image")
+update_interaction_with_image = TaskByName("update_interaction_with_image")
+update_database_with_message_id = TaskByName("update_database_with_message_id")
+delete_from_database = TaskByName("delete_from_database")
+update_death_message = TaskByName("update_death_message")
+edit_interaction_response = TaskByName("edit_interaction_response")
@@ -1,29 +1,178 @@
-import base64
+import json as python_json
 import os
+import sqlite3
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from numbers import Number
 from urllib.parse import urlparse
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import boto3
 import requests
-from celery import Celery, Task
+from celery import Task
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init
+
+from db.cache import query_cache
+from tasks.discord import RateLimited, get_discord_client
+from tasks.celery_app import app
+from tasks.s3 import get_s3_client, get_transfer_config, init_s3_client
+from db.storage import get_storage
+from db.db import (
+    add_death_db, add_media_object_db, get_media_object_db, update_death_image_url_db, update_death_message_id_db, delete_death_db,
+    get_task_step_db, add_task_step_db, delete_task_steps_before_db, get_unresolved_message_ids_db, get_existing_message_ids_db,
+    resolve_message_ids_db,
+)
+from metrics.metrics import MEDIA_BYTES, MEDIA_UPLOADS, TASK_QUEUE_WAIT_SECONDS, TASK_SECONDS, TASK_STAGE_SECONDS, observe_since_interaction, start_worker_exporter, timed
+from tasks.media import THUMBNAIL_CONTENT_TYPE, HashingReader, content_key, make_thumbnail
+from tasks.reconcile import CHANNEL_HISTORY_LIMIT, match_death_messages, snowflake_at
+
+TASK_STEP_RETENTION = int(os.getenv("TASK_STEP_RETENTION_DAYS", "7")) * 86400
+
+# reconcile_message_ids looks up the message IDs update_database_with_message_id missed, from each channel's
+# history. Deaths younger than the grace period are still that task's, and a death whose message can't be
+# found after the max attempts (it was deleted, or the channel was) isn't looked for again
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_MESSAGE_IDS_INTERVAL", "600"))
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", "300"))
+RECONCILE_MAX_ATTEMPTS = int(os.getenv("RECONCILE_MAX_ATTEMPTS", "5"))
+RECONCILE_MAX_DEATHS = int(os.getenv("RECONCILE_MAX_DEATHS", "1000"))
+# history requests per run, one per channel, the channels past it wait for the next run. Kept well under
+# Discord's global 50/s so the user-visible tasks sharing the bot token aren't the ones rate limited
+RECONCILE_REQUEST_BUDGET = int(os.getenv("RECONCILE_REQUEST_BUDGET", "20"))
+# the death message is the interaction's response, sent within seconds of the death's timestamp
+RECONCILE_MATCH_WINDOW = 60
+
+# the app and its configuration live in tasks.celery_app, the web side publishes these tasks
+# by name through tasks.signatures without importing this module
+worker_process_init.connect(init_s3_client)
+worker_init.connect(init_s3_client)
+worker_init.connect(start_worker_exporter)
 
-from db.db import connect_to_database, add_death_db, update_death_image_url_db, update_death_message_id_db, delete_death_db
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL", f"https://{S3_BUCKET}.s3.ca-central-1.amazonaws.com")
 
-CELERY_BROKER = os.getenv("CELERY_BROKER")
-CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
-# just make sure it's defined, we don't need to pass it in below manually
-if not CELERY_RESULT_BACKEND:
-    raise ValueError("Missing CELERY_RESULT_BACKEND value.")
+# downloaded images are spooled here and only the path travels through the broker,
+# the web and worker processes share a host with the SQLite database so the path stays valid
+IMAGE_SPOOL_DIR = os.getenv("IMAGE_SPOOL_DIR", tempfile.gettempdir())
+IMAGE_SPOOL_PREFIX = "rip-bot-"
+# spooled images older than this are left over from pipelines that never reached update_interaction_with_image
+IMAGE_SPOOL_MAX_AGE = int(os.getenv("IMAGE_SPOOL_MAX_AGE", "3600"))
+DOWNLOAD_TIMEOUT = 30
 
-app = Celery("tasks", broker=CELERY_BROKER)
+DISCORD_BOT_APPLICATION_ID = os.getenv("DISCORD_BOT_APPLICATION_ID")
 
-DATABASE_PATH = os.getenv("DATABASE_PATH")
-S3_BUCKET = os.getenv("S3_BUCKET")
+# threads for I/O a task overlaps with its own work, kept for the life of the worker process
+# so their pooled SQLite connections and HTTP sessions are reused between tasks
+IO_THREADS = int(os.getenv("IO_THREADS", "4"))
+_io_executor: Optional[ThreadPoolExecutor] = None
+_io_executor_pid: Optional[int] = None
+_task_started: Dict[str, float] = {}
 
-DISCORD_BOT_APPLICATION_ID = os.getenv("DISCORD_BOT_APPLICATION_ID")
-AUTHORIZATION = os.getenv("AUTHORIZATION")
+
+def write_to_database(guild_id: Optional[str], operation: Callable) -> Any:
+    # in the guild's database, see db.storage
+    return get_storage().write(guild_id, operation)
+
+
+def get_completed_step(guild_id: Optional[str], idempotency_key: Optional[str], step: str) -> Optional[Tuple[Any]]:
+    # (result,) when an earlier delivery already completed step, None otherwise
+    if not idempotency_key:
+        return None
+
+    with get_storage().read(guild_id) as cursor:
+        completed = get_task_step_db(cursor, idempotency_key, step)
+
+    return (python_json.loads(completed[0]),) if completed else None
+
+
+def record_step(cursor: sqlite3.Cursor, idempotency_key: str, step: str, result: Any):
+    add_task_step_db(cursor, idempotency_key, step, python_json.dumps(result), int(time.time()))
+
+
+def write_step(guild_id: Optional[str], idempotency_key: Optional[str], step: str, operation: Callable) -> Any:
+    """
+    Runs a database write and records step in the same transaction, so the write and the record
+    of it commit together. If an earlier delivery already completed step its result is returned instead.
+    """
+    if not idempotency_key:
+        return write_to_database(guild_id, operation)
+
+    # a read is enough to skip a step that's done, without waiting on the writer's next batch
+    completed = get_completed_step(guild_id, idempotency_key, step)
+    if completed:
+        return completed[0]
+
+    def write_once(cursor: sqlite3.Cursor) -> Any:
+        completed = get_task_step_db(cursor, idempotency_key, step)
+        if completed:
+            return python_json.loads(completed[0])
+
+        result = operation(cursor)
+        record_step(cursor, idempotency_key, step, result)
+        return result
+
+    try:
+        return write_to_database(guild_id, write_once)
+    except sqlite3.IntegrityError:
+        # another delivery recorded the step between our check and insert, our write was rolled back with it
+        completed = get_completed_step(guild_id, idempotency_key, step)
+        if not completed:
+            raise
+        return completed[0]
+
+
+def complete_step(guild_id: Optional[str], idempotency_key: Optional[str], step: str, result: Any = None):
+    # for steps whose work happens outside the database, recorded once it's done
+    if not idempotency_key:
+        return
+
+    try:
+        write_to_database(guild_id, lambda cursor: record_step(cursor, idempotency_key, step, result))
+    except sqlite3.IntegrityError:
+        pass
+
+
+def is_spool_path(path: str) -> bool:
+    # the path comes from the broker message, only files this worker could have spooled are opened or removed
+    spool_dir = os.path.realpath(IMAGE_SPOOL_DIR)
+    path = os.path.realpath(path)
+    return os.path.dirname(path) == spool_dir and os.path.basename(path).startswith(IMAGE_SPOOL_PREFIX)
+
+
+def remove_spool(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor, _io_executor_pid
+    if _io_executor is None or _io_executor_pid != os.getpid():
+        _io_executor = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="rip-bot-io")
+        _io_executor_pid = os.getpid()
+
+    return _io_executor
+
+
+@task_prerun.connect
+def record_task_start(task_id: str = None, task: Task = None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+    published_at = task.request.get("published_at", None)
+    if published_at:
+        # a retry's countdown is time it was meant to wait, not queueing
+        eta = task.request.eta
+        ready_at = max(published_at, datetime.fromisoformat(eta).timestamp()) if isinstance(eta, str) else published_at
+        queue = (task.request.delivery_info or {}).get("routing_key", "")
+        TASK_QUEUE_WAIT_SECONDS.labels(queue, task.name.rsplit(".", 1)[-1]).observe(max(0.0, time.time() - ready_at))
+
+
+@task_postrun.connect
+def observe_task_time(task_id: str = None, task: Task = None, **kwargs):
+    began = _task_started.pop(task_id, None)
+    if began is not None:
+        TASK_SECONDS.labels(task.name.rsplit(".", 1)[-1]).observe(time.perf_counter() - began)
 
 
 @app.task
@@ -37,11 +186,9 @@ def add_death_to_db(
     image_url: str,
     timestamp: Number,
     reporter: str,
+    idempotency_key: Optional[str] = None,
 ) -> int:
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    rowid = add_death_db(
+    rowid = write_step(server, idempotency_key, "add_death_to_db", lambda cursor: add_death_db(
         cursor,
         server,
         channel_id,
@@ -52,35 +199,121 @@ def add_death_to_db(
         image_url,
         timestamp,
         reporter,
-    )
-    conn.commit()
-    conn.close()
+    ))
+    query_cache.invalidate(server)
 
     return { "rowid": rowid }
     
 
+def upload_new_media(guild_id: Optional[str], spool_path: str, sha256: str, content_type: str, size: int) -> Dict:
+    key = content_key("img", sha256, content_type)
+    with timed(TASK_STAGE_SECONDS.labels("download_image_and_upload_to_s3", "s3_put")):
+        # from the spool the transfer can read parts in parallel for a multipart upload
+        get_s3_client().upload_file(spool_path, S3_BUCKET, key, ExtraArgs={"ContentType": content_type}, Config=get_transfer_config())
+
+    thumbnail_url = None
+    with timed(TASK_STAGE_SECONDS.labels("download_image_and_upload_to_s3", "thumbnail")):
+        thumbnail = make_thumbnail(spool_path)
+        if thumbnail:
+            thumbnail_key = content_key("thumb", sha256, THUMBNAIL_CONTENT_TYPE)
+            get_s3_client().put_object(Bucket=S3_BUCKET, Key=thumbnail_key, Body=thumbnail, ContentType=THUMBNAIL_CONTENT_TYPE)
+            thumbnail_url = f"{S3_PUBLIC_URL}/{thumbnail_key}"
+
+    media = {"url": f"{S3_PUBLIC_URL}/{key}", "content_type": content_type, "size": size, "thumbnail_url": thumbnail_url}
+    # only recorded once the objects exist, a failed upload is simply retried by the next repost
+    write_to_database(guild_id, lambda cursor: add_media_object_db(cursor, sha256, created_at=int(time.time()), **media))
+
+    return media
+
+
 @app.task
-def download_image_and_upload_to_s3(source_url: str) -> Dict:
-    s3 = boto3.resource("s3")
+def download_image_and_upload_to_s3(source_url: str, idempotency_key: Optional[str] = None, guild_id: Optional[str] = None) -> Dict:
+    completed = get_completed_step(guild_id, idempotency_key, "download_image_and_upload_to_s3")
+    if completed:
+        # the spool may be gone by now, update_interaction_with_image falls back to the S3 copy
+        return completed[0]
 
     image_name = os.path.basename(urlparse(source_url).path)
     timestamp = time.time()
     file_name = f"{timestamp}-{image_name}"
-    key = f"img/{file_name}"
-
-    response = requests.get(source_url)
-    content_type = response.headers["content-type"]
 
-    object = s3.Bucket(S3_BUCKET).put_object(
-        Key=key,
-        Body=response.content,
-        ContentType=content_type,
-    )
-    
-    encoded_image = base64.b64encode(response.content).decode("utf-8")
-    s3_url = f"https://{S3_BUCKET}.s3.ca-central-1.amazonaws.com/{key}"
+    spool_fd, spool_path = tempfile.mkstemp(prefix=IMAGE_SPOOL_PREFIX, suffix=f"-{image_name}", dir=IMAGE_SPOOL_DIR)
+    # wrapped before the request, so a download that fails still closes the descriptor
+    spool = os.fdopen(spool_fd, "wb")
+    try:
+        with timed(TASK_STAGE_SECONDS.labels("download_image_and_upload_to_s3", "download")), \
+                spool, \
+                requests.get(source_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            content_type = response.headers["content-type"]
+            response.raw.decode_content = True
+
+            # the key is the hash of the bytes, so the image is spooled and hashed before anything is uploaded,
+            # the spool also keeps a copy on disk for update_interaction_with_image
+            reader = HashingReader(response.raw, spool)
+            reader.drain()
+
+        sha256 = reader.sha256.hexdigest()
+        with get_storage().read(guild_id) as cursor:
+            media = get_media_object_db(cursor, sha256)
+
+        if media:
+            MEDIA_UPLOADS.labels("deduplicated").inc()
+            MEDIA_BYTES.labels("deduplicated").inc(reader.size)
+        else:
+            media = upload_new_media(guild_id, spool_path, sha256, content_type, reader.size)
+            MEDIA_UPLOADS.labels("uploaded").inc()
+            MEDIA_BYTES.labels("uploaded").inc(reader.size)
+    except BaseException:
+        os.remove(spool_path)
+        raise
+
+    result = { "image": (file_name, content_type, spool_path, media["url"]) }
+    complete_step(guild_id, idempotency_key, "download_image_and_upload_to_s3", result)
+
+    return result
+
+# does the work of add_death_to_db and download_image_and_upload_to_s3 in one task, the upload runs
+# on an I/O thread while this thread inserts, so the result is the same Dict gather_results builds
+# without the group, the chord barrier and the extra task in between
+@app.task
+def add_death_and_upload_image(
+    server: str,
+    channel_id: str,
+    message_id: str,
+    dead_person: str,
+    caption: str,
+    attachment: str,
+    image_url: str,
+    timestamp: Number,
+    reporter: str,
+    **kwargs,
+) -> Dict:
+    idempotency_key = kwargs.get("idempotency_key", None)
+    upload = get_io_executor().submit(download_image_and_upload_to_s3.run, image_url, idempotency_key, server)
+
+    try:
+        result = add_death_to_db.run(
+            server,
+            channel_id,
+            message_id,
+            dead_person,
+            caption,
+            attachment,
+            image_url,
+            timestamp,
+            reporter,
+            idempotency_key,
+        )
+    except BaseException:
+        # the death was never stored, don't leave its spooled image behind
+        if not upload.exception():
+            _, _, spool_path, _ = upload.result()["image"]
+            remove_spool(spool_path)
+        raise
+
+    return { **result, **upload.result(), **kwargs }
 
-    return { "image": (file_name, content_type, encoded_image, s3_url) }
 
 # combines results from a Celery group into a Dict to passed to future Tasks as a single Dict
 @app.task
@@ -107,84 +340,244 @@ def update_database_with_image(input: Dict):
     if not new_url:
         raise ValueError("missing image field")
 
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
+    guild_id = input.get("guild_id", None)
+    write_step(guild_id, input.get("idempotency_key", None), "update_database_with_image", lambda cursor: update_death_image_url_db(cursor, rowid, new_url))
 
-    update_death_image_url_db(cursor, rowid, new_url)
-    conn.commit()
-    conn.close()
+    if guild_id:
+        query_cache.invalidate(guild_id)
 
 
 # update_interaction_with_image is chained from download_image_and_upload_to_s3,
-# so file_name, image_content and new_url has to be first
-@app.task(autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
-def update_interaction_with_image(input: Dict):
+# so file_name, content_type, spool_path and new_url has to be first
+@app.task(bind=True, autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
+def update_interaction_with_image(self: Task, input: Dict):
     image: Tuple[str, str, str, str] = input.get("image", None)
     interaction_token: str = input.get("interaction_token", None)
 
     if not image or not interaction_token:
         raise ValueError("missing image")
     
-    file_name, file_content_type, image_content, _ = image
-    if not file_name or not file_content_type or not image_content:
+    file_name, file_content_type, spool_path, s3_url = image
+    if not file_name or not file_content_type or not spool_path:
         raise ValueError("missing image field")
-
-    response = requests.patch(
-        f"https://discord.com/api/v10/webhooks/{DISCORD_BOT_APPLICATION_ID}/{interaction_token}/messages/@original",
-        json={
-            "attachments": [{"id": 0}]
-        },
-        headers={"Authorization": AUTHORIZATION},
-        files={
-            "files[0]": (file_name, base64.b64decode(image_content.encode("utf-8")), file_content_type),
-        },
-    )
-
-    response.raise_for_status()
-
-
-@app.task(autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
-def update_database_with_message_id(input: Dict):
+    if not is_spool_path(spool_path):
+        raise ValueError("spool path outside IMAGE_SPOOL_DIR")
+
+    guild_id: Optional[str] = input.get("guild_id", None)
+    idempotency_key: Optional[str] = input.get("idempotency_key", None)
+    if get_completed_step(guild_id, idempotency_key, "update_interaction_with_image"):
+        remove_spool(spool_path)
+        return
+
+    try:
+        if os.path.exists(spool_path):
+            image_file = open(spool_path, "rb")
+        else:
+            # the spool is gone (a failed earlier delivery removed it, or another host), fall back to the uploaded copy
+            s3_response = requests.get(s3_url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            s3_response.raise_for_status()
+            image_file = s3_response.raw
+
+        with image_file, timed(TASK_STAGE_SECONDS.labels("update_interaction_with_image", "discord_patch")):
+            get_discord_client().request(
+                "PATCH",
+                "/webhooks/{application_id}/{interaction_token}/messages/@original",
+                application_id=DISCORD_BOT_APPLICATION_ID,
+                interaction_token=interaction_token,
+                json={
+                    "attachments": [{"id": 0}]
+                },
+                files={
+                    "files[0]": (file_name, image_file, file_content_type),
+                },
+            )
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+    finally:
+        # removed whether or not the PATCH went through, a retry reads the S3 copy instead
+        remove_spool(spool_path)
+
+    complete_step(guild_id, idempotency_key, "update_interaction_with_image")
+    observe_since_interaction(input.get("interaction_id", None))
+
+
+@app.task(bind=True, autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
+def update_database_with_message_id(self: Task, input: Dict):
     rowid: int = input.get("rowid", None)
     interaction_token: str = input.get("interaction_token", None)
 
     if not rowid or not interaction_token:
         raise ValueError("missing argument")
 
-    response = requests.get(
-        f"https://discord.com/api/v10/webhooks/{DISCORD_BOT_APPLICATION_ID}/{interaction_token}/messages/@original",
-        headers={"Authorization": AUTHORIZATION},
-    )
+    guild_id: Optional[str] = input.get("guild_id", None)
+    idempotency_key: Optional[str] = input.get("idempotency_key", None)
+    if get_completed_step(guild_id, idempotency_key, "update_database_with_message_id"):
+        return
+
+    try:
+        with timed(TASK_STAGE_SECONDS.labels("update_database_with_message_id", "discord_get")):
+            response = get_discord_client().request(
+                "GET",
+                "/webhooks/{application_id}/{interaction_token}/messages/@original",
+                application_id=DISCORD_BOT_APPLICATION_ID,
+                interaction_token=interaction_token,
+            )
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
 
-    response.raise_for_status()
     message = response.json()
 
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
+    write_step(guild_id, idempotency_key, "update_database_with_message_id", lambda cursor: update_death_message_id_db(cursor, rowid, message["id"]))
 
-    update_death_message_id_db(cursor, rowid, message["id"])
-    conn.commit()
-    conn.close()
+
+@app.task
+def delete_from_database(rowid: str, guild_id: str = None, idempotency_key: Optional[str] = None):
+    # rowids are reused once the last row is deleted, a redelivered delete must not remove the next death
+    write_step(guild_id, idempotency_key, "delete_from_database", lambda cursor: delete_death_db(cursor, rowid))
+
+    # tasks queued before guild_id was passed rely on the cache TTL instead, and only work with a single database
+    if guild_id:
+        query_cache.invalidate(guild_id)
+
+
+@app.task(bind=True, autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
+def update_death_message(self: Task, channel_id: str, message_id: str, new_content: str, idempotency_key: Optional[str] = None, guild_id: Optional[str] = None):
+    if get_completed_step(guild_id, idempotency_key, "update_death_message"):
+        return
+
+    try:
+        with timed(TASK_STAGE_SECONDS.labels("update_death_message", "discord_patch")):
+            get_discord_client().request(
+                "PATCH",
+                "/channels/{channel_id}/messages/{message_id}",
+                channel_id=channel_id,
+                message_id=message_id,
+                json={
+                    "content": new_content,
+                },
+            )
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+
+    complete_step(guild_id, idempotency_key, "update_death_message")
+
+# finishes a deferred (type 5) interaction response with the content the handler produced
+@app.task(bind=True, autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
+def edit_interaction_response(self: Task, interaction_token: str, data: Dict, idempotency_key: Optional[str] = None, guild_id: Optional[str] = None):
+    if get_completed_step(guild_id, idempotency_key, "edit_interaction_response"):
+        return
+
+    try:
+        with timed(TASK_STAGE_SECONDS.labels("edit_interaction_response", "discord_patch")):
+            get_discord_client().request(
+                "PATCH",
+                "/webhooks/{application_id}/{interaction_token}/messages/@original",
+                application_id=DISCORD_BOT_APPLICATION_ID,
+                interaction_token=interaction_token,
+                json=data,
+            )
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+
+    complete_step(guild_id, idempotency_key, "edit_interaction_response")
+
+
+# steps only need to outlive redelivery and retries, which are over within hours
+@app.task
+def prune_task_steps():
+    # every guild's database keeps its own steps
+    deleted = get_storage().write_each(lambda cursor: delete_task_steps_before_db(cursor, int(time.time()) - TASK_STEP_RETENTION))
+    return { "deleted": sum(deleted) }
+
+
+@app.task
+def clean_image_spool() -> Dict:
+    # spooled images whose pipeline stopped before update_interaction_with_image, a worker dying mid-task
+    # or a chain that failed earlier. Only this bot's files, IMAGE_SPOOL_DIR defaults to the shared tmp
+    removed = 0
+    cutoff = time.time() - IMAGE_SPOOL_MAX_AGE
+    with os.scandir(IMAGE_SPOOL_DIR) as entries:
+        for entry in entries:
+            if not entry.name.startswith(IMAGE_SPOOL_PREFIX) or not entry.is_file(follow_symlinks=False):
+                continue
+
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                # the task it belonged to got there first
+                pass
+
+    return { "removed": removed }
 
 
 @app.task
-def delete_from_database(rowid: str):
-    conn = connect_to_database(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    delete_death_db(cursor, rowid)
-    conn.commit()
-    conn.close()
-
-
-@app.task(autoretry_for=(requests.exceptions.HTTPError,), default_retry_delay=5)
-def update_death_message(channel_id: str, message_id: str, new_content: str):
-    response = requests.patch(
-        f"https://discord.com/api/v10/channels/{channel_id}/messages/{message_id}",
-        json={
-            "content": new_content,
-        },
-        headers={"Authorization": AUTHORIZATION},
+def reconcile_message_ids() -> Dict:
+    attempted_at = int(time.time())
+    storage = get_storage()
+    deaths = [
+        death
+        for deaths in storage.read_each(lambda cursor: get_unresolved_message_ids_db(cursor, attempted_at - RECONCILE_GRACE_SECONDS, RECONCILE_MAX_ATTEMPTS, RECONCILE_MAX_DEATHS))
+        for death in deaths
+    ]
+
+    # oldest first, so the channels with the longest-unresolved deaths get the budget
+    channels: Dict[Tuple[str, str], List[Tuple]] = {}
+    for death in sorted(deaths, key=lambda death: death[5]):
+        channels.setdefault((death[1], death[2]), []).append(death)
+
+    matched: Dict[str, Dict[int, str]] = {}
+    missed: Dict[str, List[int]] = {}
+    discord_requests = 0
+    for (guild_id, channel_id), channel_deaths in channels.items():
+        if discord_requests >= RECONCILE_REQUEST_BUDGET:
+            break
+
+        discord_requests += 1
+        try:
+            with timed(TASK_STAGE_SECONDS.labels("reconcile_message_ids", "discord_get")):
+                messages = get_discord_client().request(
+                    "GET",
+                    "/channels/{channel_id}/messages",
+                    channel_id=channel_id,
+                    params={
+                        "after": snowflake_at(channel_deaths[0][5] - RECONCILE_MATCH_WINDOW),
+                        "limit": CHANNEL_HISTORY_LIMIT,
+                    },
+                ).json()
+        except RateLimited:
+            # what was found so far is still written, the next run carries on
+            break
+        except requests.exceptions.HTTPError as e:
+            # the channel is gone or the bot can't read it, which counts as not finding the messages
+            if e.response is None or e.response.status_code not in (403, 404):
+                raise
+            messages = []
+
+        with storage.read(guild_id) as cursor:
+            taken = get_existing_message_ids_db(cursor, [message["id"] for message in messages])
+
+        channel_matched, channel_missed = match_death_messages(channel_deaths, messages, taken, DISCORD_BOT_APPLICATION_ID, RECONCILE_MATCH_WINDOW)
+        matched.setdefault(guild_id, {}).update(channel_matched)
+        missed.setdefault(guild_id, []).extend(channel_missed)
+
+    # every guild's updates in one transaction per database
+    resolved = storage.write_grouped(
+        [guild_id for guild_id in matched if matched[guild_id] or missed[guild_id]],
+        lambda cursor, guild_ids: sum(resolve_message_ids_db(cursor, matched[guild_id], missed[guild_id], attempted_at) for guild_id in guild_ids),
     )
 
-    response.raise_for_status()
\ No newline at end of file
+    return {
+        "unresolved": len(deaths),
+        "discord_requests": discord_requests,
+        "resolved": sum(resolved),
+        "missed": sum(len(rowids) for rowids in missed.values()),
+    }
+
+
+app.conf.beat_schedule = {
+    "prune-task-steps": {"task": prune_task_steps.name, "schedule": 3600},
+    "reconcile-message-ids": {"task": reconcile_message_ids.name, "schedule": RECONCILE_INTERVAL},
+    "clean-image-spool": {"task": clean_image_spool.name, "schedule": IMAGE_SPOOL_MAX_AGE / 2},
+}
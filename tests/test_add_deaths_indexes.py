@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+from migrations.runner import connect_to_database, run_migrations
+
+INSERT_DEATH_SQL = """INSERT INTO deaths (server, channel_id, message_id, dead_person, caption, timestamp, reporter) VALUES ('guild', 'channel', ?, 'victim', 'caption', 0, 'reporter')"""
+
+
+def test_duplicate_message_ids_are_collapsed_before_the_unique_index(capsys):
+    connection = connect_to_database(":memory:")
+    # the schema as it was before the indexes, with the duplicates production may have
+    run_migrations(connection, target=1)
+    for message_id in ("1", "2", "1", "", "", "1", "2", None):
+        connection.execute(INSERT_DEATH_SQL, (message_id,))
+
+    run_migrations(connection)
+
+    rows = connection.execute("SELECT rowid, message_id FROM deaths ORDER BY rowid").fetchall()
+    assert rows == [(1, "1"), (2, "2"), (3, None), (4, None), (5, None), (6, None), (7, None), (8, None)]
+    assert connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'deaths_message_id'").fetchone()
+    output = capsys.readouterr().out
+    assert "message ID 1 was on 3 deaths, kept it on rowid 1" in output
+    assert "message ID 2 was on 2 deaths, kept it on rowid 2" in output
+
+
+def test_unique_index_still_refuses_new_duplicates():
+    connection = connect_to_database(":memory:")
+    run_migrations(connection)
+    connection.execute(INSERT_DEATH_SQL, ("1",))
+
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute(INSERT_DEATH_SQL, ("1",))
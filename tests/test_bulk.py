@@ -0,0 +1,55 @@
+import json as python_json
+
+import db.bulk as bulk
+from db.bulk import NATURAL_KEY_INDEX, import_deaths
+from migrations.runner import connect_to_database, run_migrations
+
+
+def death(message_id, dead_person="victim", timestamp=100):
+    return {
+        "server": "guild", "channel_id": "channel", "message_id": message_id, "dead_person": dead_person,
+        "caption": "caption", "attachment": None, "image_url": "", "timestamp": timestamp, "reporter": "reporter",
+    }
+
+
+def test_reimporting_an_export_skips_deaths_with_and_without_message_ids(tmp_path):
+    path = tmp_path / "deaths.ndjson"
+    records = [death("1", timestamp=50), death(None), death(None, dead_person="other"), death(None, timestamp=200)]
+    path.write_text("".join(python_json.dumps(record) + "\n" for record in records))
+    connection = connect_to_database(str(tmp_path / "deaths.db"))
+    run_migrations(connection)
+
+    first = import_deaths(connection, str(path), "ndjson", job="first")
+    second = import_deaths(connection, str(path), "ndjson", job="second")
+
+    rows = connection.execute("SELECT message_id, dead_person, timestamp FROM deaths ORDER BY rowid").fetchall()
+    assert rows == [("1", "victim", 50), (None, "victim", 100), (None, "other", 100), (None, "victim", 200)]
+    assert second["rows"] == len(records)
+    # the lookup for a death without a message ID stays indexed while the others are deferred
+    assert first["deferred"] and NATURAL_KEY_INDEX not in first["deferred"]
+
+
+def test_deleting_a_death_mid_import_leaves_no_orphans(tmp_path, monkeypatch):
+    path = tmp_path / "deaths.ndjson"
+    records = [{**death(str(message_id), timestamp=message_id), "attachment": '{"url": "image"}'} for message_id in range(1, 5)]
+    path.write_text("".join(python_json.dumps(record) + "\n" for record in records))
+    connection = connect_to_database(str(tmp_path / "deaths.db"))
+    run_migrations(connection)
+    batches = []
+    insert_deaths = bulk.insert_deaths
+
+    def insert_then_delete(connection, batch):
+        insert_deaths(connection, batch)
+        batches.append(batch)
+        if len(batches) == 2:
+            # a remove-death on the live database while the import is still going
+            connection.execute("INSERT INTO message_id_attempts (death_rowid, attempts, last_attempt_at) SELECT MAX(rowid), 1, 0 FROM deaths")
+            connection.execute("DELETE FROM deaths WHERE rowid = (SELECT MAX(rowid) FROM deaths)")
+
+    monkeypatch.setattr(bulk, "insert_deaths", insert_then_delete)
+    result = import_deaths(connection, str(path), "ndjson", job="import", batch_size=2)
+
+    assert "deaths_attachment_delete" not in result["deferred"]
+    assert "deaths_message_id_attempts_delete" not in result["deferred"]
+    assert connection.execute("SELECT death_rowid FROM death_attachments WHERE death_rowid NOT IN (SELECT rowid FROM deaths)").fetchall() == []
+    assert connection.execute("SELECT death_rowid FROM message_id_attempts WHERE death_rowid NOT IN (SELECT rowid FROM deaths)").fetchall() == []
@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tasks.discord as discord
+import tasks.s3 as s3
+
+
+def build_concurrently(get_client, threads: int = 16):
+    start = threading.Barrier(threads)
+
+    def build(_):
+        start.wait()
+        return get_client()
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(build, range(threads)))
+
+
+def test_threads_share_one_s3_client(monkeypatch):
+    built = []
+
+    def create_s3_client():
+        # as slow as resolving credentials, so the threads overlap
+        time.sleep(0.05)
+        built.append(object())
+        return built[-1]
+
+    monkeypatch.setattr(s3, "_client", None)
+    monkeypatch.setattr(s3, "create_s3_client", create_s3_client)
+
+    clients = build_concurrently(s3.get_s3_client)
+
+    assert len(built) == 1
+    assert all(client is built[0] for client in clients)
+
+
+def test_threads_share_one_discord_client(monkeypatch):
+    built = []
+
+    class SlowDiscordClient:
+        def __init__(self, *args):
+            time.sleep(0.05)
+            built.append(self)
+
+    monkeypatch.setattr(discord, "_client", None)
+    monkeypatch.setattr(discord, "DiscordClient", SlowDiscordClient)
+
+    clients = build_concurrently(discord.get_discord_client)
+
+    assert len(built) == 1
+    assert all(client is built[0] for client in clients)
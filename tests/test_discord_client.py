@@ -0,0 +1,45 @@
+import pytest
+import requests
+
+from tasks.discord import BUCKET_PRUNE_INTERVAL, DiscordClient, RateLimited
+
+ROUTE = "/webhooks/{application_id}/{interaction_token}/messages/@original"
+
+
+def respond(remaining: int, reset_after: float):
+    def request(method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        # every interaction token's webhook route maps to the same hash, like on Discord
+        response.headers.update({"X-RateLimit-Bucket": "webhook", "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset-After": str(reset_after)})
+        return response
+
+    return request
+
+
+def patch(client: DiscordClient, interaction_token: str):
+    return client.request("PATCH", ROUTE, application_id="1", interaction_token=interaction_token)
+
+
+def test_buckets_are_scoped_by_major_parameters():
+    client = DiscordClient("https://discord.test", "Bot test")
+    client.session.request = respond(remaining=0, reset_after=30)
+    patch(client, "busy")
+
+    with pytest.raises(RateLimited):
+        patch(client, "busy")
+    # a different interaction shares the hash but not the limit
+    patch(client, "other")
+
+
+def test_buckets_past_their_reset_are_forgotten():
+    client = DiscordClient("https://discord.test", "Bot test")
+    client.session.request = respond(remaining=4, reset_after=0)
+    for token in range(1000):
+        patch(client, str(token))
+
+    client._pruned_at -= BUCKET_PRUNE_INTERVAL
+    patch(client, "last")
+
+    assert len(client._route_buckets) == 1
+    assert len(client._buckets) <= 1
@@ -0,0 +1,79 @@
+import gc
+import os
+import time
+
+import pytest
+import requests
+
+import tasks.tasks as app_tasks
+
+
+class FailingDiscordClient:
+    def request(self, *args, **kwargs):
+        raise requests.exceptions.HTTPError("500 Server Error")
+
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_tasks, "IMAGE_SPOOL_DIR", str(tmp_path))
+    return tmp_path
+
+
+def spool(spool_dir, name: str = "rip-bot-abc-image.png", age: float = 0) -> str:
+    path = spool_dir / name
+    path.write_bytes(b"image")
+    os.utime(path, (time.time() - age, time.time() - age))
+    return str(path)
+
+
+def interaction(spool_path: str):
+    return {"image": ("image.png", "image/png", spool_path, "https://s3.example/image.png"), "interaction_token": "token"}
+
+
+def test_spool_paths_outside_the_spool_dir_are_rejected(spool_dir, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside") / "rip-bot-abc-image.png"
+    outside.write_bytes(b"not ours")
+
+    for path in (str(outside), str(spool_dir / ".." / outside.parent.name / outside.name), spool(spool_dir, "image.png")):
+        with pytest.raises(ValueError):
+            app_tasks.update_interaction_with_image.run(interaction(path))
+
+    assert outside.exists()
+    assert (spool_dir / "image.png").exists()
+
+
+def test_spool_is_removed_when_the_patch_fails(spool_dir, monkeypatch):
+    monkeypatch.setattr(app_tasks, "get_discord_client", FailingDiscordClient)
+    path = spool(spool_dir)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        app_tasks.update_interaction_with_image.run(interaction(path))
+
+    assert not os.path.exists(path)
+
+
+def test_clean_image_spool_only_removes_old_spool_files(spool_dir):
+    old = spool(spool_dir, "rip-bot-old-image.png", age=app_tasks.IMAGE_SPOOL_MAX_AGE + 60)
+    new = spool(spool_dir, "rip-bot-new-image.png")
+    unrelated = spool(spool_dir, "someone-else.png", age=app_tasks.IMAGE_SPOOL_MAX_AGE + 60)
+
+    assert app_tasks.clean_image_spool.run() == {"removed": 1}
+    assert not os.path.exists(old)
+    assert os.path.exists(new) and os.path.exists(unrelated)
+
+
+def test_failed_downloads_close_and_remove_their_spool(spool_dir, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(app_tasks.requests, "get", refuse)
+    # whatever earlier tests left for the garbage collector would otherwise close during the loop
+    gc.collect()
+    open_fds = len(os.listdir("/proc/self/fd"))
+
+    for _ in range(20):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            app_tasks.download_image_and_upload_to_s3.run("https://cdn.example/image.png")
+
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+    assert os.listdir(spool_dir) == []
@@ -0,0 +1,137 @@
+import itertools
+import sqlite3
+import time
+from typing import Dict, Optional
+
+import pytest
+
+import tasks.tasks as app_tasks
+from bench.stubs import discord_server
+from db.db import add_death_db
+from db.storage import SqliteStorage
+from migrations.runner import connect_to_database, run_migrations
+from tasks.discord import DiscordClient
+from tasks.reconcile import snowflake_at
+
+# runs reconcile_message_ids against the Discord stub, with deaths it should resolve, decoy messages
+# it shouldn't take, a death whose message is gone and more channels than one run's request budget
+
+BOT_ID = "1000"
+REQUEST_BUDGET = 2
+GUILD_ID = "guild"
+
+_sequence = itertools.count()
+
+
+def bot_message(sent_at: float, dead_person: str, reporter: str, author: str = BOT_ID) -> Dict:
+    return {
+        # unique even for messages sent in the same millisecond
+        "id": str(snowflake_at(sent_at) + next(_sequence)),
+        "author": {"id": author},
+        "content": f"<@{dead_person}> died!\nCaption by <@{reporter}>: \"caption\"",
+        "interaction_metadata": {"id": str(next(_sequence)), "type": 2, "user": {"id": reporter}},
+    }
+
+
+def get_message_id(connection: sqlite3.Connection, rowid: int) -> Optional[str]:
+    return connection.execute("SELECT message_id FROM deaths WHERE rowid = ?", (rowid,)).fetchone()[0]
+
+
+def get_attempts(connection: sqlite3.Connection, rowid: int) -> int:
+    row = connection.execute("SELECT attempts FROM message_id_attempts WHERE death_rowid = ?", (rowid,)).fetchone()
+    return row[0] if row else 0
+
+
+@pytest.fixture
+def discord(monkeypatch):
+    # the module settings rather than the environment, tasks.tasks read that when it was first imported
+    with discord_server() as discord:
+        client = DiscordClient(discord.url, "Bot test")
+        monkeypatch.setattr(app_tasks, "get_discord_client", lambda: client)
+        monkeypatch.setattr(app_tasks, "DISCORD_BOT_APPLICATION_ID", BOT_ID)
+        monkeypatch.setattr(app_tasks, "RECONCILE_REQUEST_BUDGET", REQUEST_BUDGET)
+        yield discord
+
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    path = str(tmp_path / "deaths.db")
+    storage = SqliteStorage(path, write_behind=False)
+    monkeypatch.setattr(app_tasks, "get_storage", lambda: storage)
+
+    connection = connect_to_database(path)
+    run_migrations(connection)
+    yield connection
+    connection.close()
+
+
+def test_reconcile_message_ids(discord, connection: sqlite3.Connection):
+    start = int(time.time()) - 3600
+
+    def add(channel_id: str, dead_person: str, reporter: str, timestamp: int, message_id: Optional[str] = None) -> int:
+        return add_death_db(connection.cursor(), GUILD_ID, channel_id, message_id, dead_person, "caption", "{}", "", timestamp, reporter)
+
+    # channel 111: a NULL and a placeholder to resolve past decoys, one whose message is gone, one whose
+    # closest message already belongs to another death, and one too recent to be looked for yet
+    first = bot_message(start + 1, "v1", "r1")
+    second = bot_message(start + 11, "v1", "r2")
+    taken = bot_message(start + 30, "v5", "r5")
+    fifth = bot_message(start + 35, "v5", "r5")
+    recent = bot_message(time.time() - 9, "v6", "r6")
+    decoys = [bot_message(start + 2, "v1", "r1", author="2000"), bot_message(start + 10, "v1", "r9")]
+    discord.channel_messages["111"] = [first, second, taken, fifth, recent] + decoys
+    deaths = {
+        "null": add("111", "v1", "r1", start),
+        "placeholder": add("111", "v1", "r2", start + 10, "GARBAGE3e8a54f0-placeholder"),
+        "gone": add("111", "v3", "r3", start + 20),
+        "resolved": add("111", "v4", "r4", start + 29, taken["id"]),
+        "next_to_taken": add("111", "v5", "r5", start + 30),
+        "recent": add("111", "v6", "r6", int(time.time()) - 10),
+    }
+
+    # channel 222: busier than one page of history, the second death is past where the first page stops
+    seventh = bot_message(start + 1, "v7", "r7")
+    eighth = bot_message(start + 301, "v8", "r8")
+    chatter = [bot_message(start + 2 + i, "someone", "else", author="3000") for i in range(150)]
+    discord.channel_messages["222"] = [seventh, eighth] + chatter
+    deaths["first_page"] = add("222", "v7", "r7", start)
+    deaths["second_page"] = add("222", "v8", "r8", start + 300)
+
+    # channel 333: past the first run's budget
+    ninth = bot_message(start + 501, "v9", "r9")
+    discord.channel_messages["333"] = [ninth]
+    deaths["over_budget"] = add("333", "v9", "r9", start + 500)
+    connection.commit()
+
+    def message_ids(*keys: str) -> Dict[str, Optional[str]]:
+        return {key: get_message_id(connection, deaths[key]) for key in keys}
+
+    # the first run resolves what the budget reached, one history request per channel
+    first_run = app_tasks.reconcile_message_ids.run()
+    assert first_run["discord_requests"] == REQUEST_BUDGET
+    assert discord.counters.get("history_requests") == REQUEST_BUDGET
+    assert message_ids("null", "placeholder", "next_to_taken", "first_page", "resolved", "gone", "recent", "second_page", "over_budget") == {
+        "null": first["id"],
+        "placeholder": second["id"],
+        "next_to_taken": fifth["id"],
+        "first_page": seventh["id"],
+        "resolved": taken["id"],
+        "gone": None,
+        "recent": None,
+        "second_page": None,
+        "over_budget": None,
+    }
+    # a death without a message counts an attempt, a death past the page isn't counted
+    assert get_attempts(connection, deaths["gone"]) == 1
+    assert get_attempts(connection, deaths["second_page"]) == 0
+
+    # later runs pick up the rest, a missing message stops being looked for and nothing left costs requests
+    runs = [app_tasks.reconcile_message_ids.run() for _ in range(app_tasks.RECONCILE_MAX_ATTEMPTS + 2)]
+    assert message_ids("second_page", "over_budget", "gone", "recent") == {
+        "second_page": eighth["id"],
+        "over_budget": ninth["id"],
+        "gone": None,
+        "recent": None,
+    }
+    assert get_attempts(connection, deaths["gone"]) == app_tasks.RECONCILE_MAX_ATTEMPTS
+    assert runs[-1]["discord_requests"] == 0
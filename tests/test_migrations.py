@@ -0,0 +1,13 @@
+from migrations.runner import connect_to_database, run_migrations
+
+
+def test_migrations_never_vacuum(tmp_path):
+    # the side tables are keyed on deaths' implicit rowid, which VACUUM may renumber
+    connection = connect_to_database(str(tmp_path / "deaths.db"))
+    statements = []
+    connection.set_trace_callback(statements.append)
+
+    run_migrations(connection)
+
+    assert statements
+    assert not [statement for statement in statements if "VACUUM" in statement.upper()]
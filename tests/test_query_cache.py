@@ -0,0 +1,27 @@
+import db.cache as cache
+
+
+def test_cache_is_off_without_a_shared_generation_store(monkeypatch, caplog):
+    monkeypatch.setattr(cache, "QUERY_CACHE_REDIS_URL", "")
+    monkeypatch.setattr(cache, "QUERY_CACHE_LOCAL_ONLY", False)
+    query_cache = cache.create_query_cache()
+    computed = []
+
+    for _ in range(2):
+        query_cache.get_or_compute("guild", ("death_count", None), lambda: computed.append(1) or len(computed))
+
+    assert len(computed) == 2
+    assert query_cache.stats()["entries"] == 0
+    assert "query cache disabled" in caplog.text
+
+
+def test_local_only_cache_sees_its_own_invalidations(monkeypatch):
+    monkeypatch.setattr(cache, "QUERY_CACHE_REDIS_URL", "")
+    monkeypatch.setattr(cache, "QUERY_CACHE_LOCAL_ONLY", True)
+    query_cache = cache.create_query_cache()
+    counts = iter([3, 2])
+
+    assert query_cache.get_or_compute("guild", ("death_count", None), lambda: next(counts)) == 3
+    assert query_cache.get_or_compute("guild", ("death_count", None), lambda: next(counts)) == 3
+    query_cache.invalidate("guild")
+    assert query_cache.get_or_compute("guild", ("death_count", None), lambda: next(counts)) == 2
@@ -0,0 +1,44 @@
+import re
+import sqlite3
+from typing import Dict, List
+
+import pytest
+
+import db.db as db
+from migrations.runner import run_migrations
+
+PARAMETER_PATTERN = re.compile(r":(\w+)")
+
+
+def get_queries() -> Dict[str, str]:
+    # every SQL constant in db.db, whatever its suffix
+    return {
+        name: value
+        for name, value in vars(db).items()
+        if name.isupper() and isinstance(value, str) and value.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"))
+    }
+
+
+def get_full_scans(connection: sqlite3.Connection, sql: str) -> List[str]:
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    parameters = {name: 0 for name in PARAMETER_PATTERN.findall(sql)}
+    plan = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    # SEARCH means an index or rowid lookup, SCAN means every row (or every index entry) is visited,
+    # scans of subquery results and constant rows only touch what the inner SEARCH already returned
+    return [
+        detail for _, _, _, detail in plan
+        if detail.startswith("SCAN ") and detail.split()[1] in tables
+    ]
+
+
+@pytest.fixture(scope="module")
+def connection():
+    connection = sqlite3.connect(":memory:", isolation_level=None)
+    run_migrations(connection)
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("name", sorted(get_queries()))
+def test_query_uses_an_index(connection: sqlite3.Connection, name: str):
+    assert get_full_scans(connection, get_queries()[name]) == []
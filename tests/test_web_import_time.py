@@ -0,0 +1,47 @@
+import json as python_json
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+# what a gunicorn web worker imports before it can serve, see wsgi.py and gunicorn.conf.py
+WEB_MODULE = os.getenv("WEB_MODULE", "wsgi")
+WEB_IMPORT_BUDGET_MS = float(os.getenv("WEB_IMPORT_BUDGET_MS", "400"))
+# the fastest of a few fresh interpreters, the first one also pays for a cold page cache
+WEB_IMPORT_RUNS = int(os.getenv("WEB_IMPORT_RUNS", "5"))
+# the worker-side dependencies, the web side only publishes tasks by name through tasks.signatures
+WORKER_ONLY_MODULES = ("tasks.tasks", "boto3", "botocore", "requests", "PIL")
+
+IMPORT_SCRIPT = """
+import json, sys, time
+began = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - began, "modules": sorted(sys.modules)}}))
+"""
+
+
+def time_import(module: str) -> Dict:
+    # a fresh interpreter each time, with CELERY_RESULT_BACKEND unset like on the web servers
+    environment = {name: value for name, value in os.environ.items() if name != "CELERY_RESULT_BACKEND"}
+    environment.setdefault("CELERY_BROKER", "memory://")
+    process = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(module=module)], env=environment, capture_output=True, text=True)
+    assert process.returncode == 0, f"import {module} failed: {process.stderr.strip()}"
+
+    return python_json.loads(process.stdout.splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def web_imports():
+    return [time_import(WEB_MODULE) for _ in range(WEB_IMPORT_RUNS)]
+
+
+def test_web_import_stays_within_budget(web_imports):
+    import_ms = min(run["seconds"] for run in web_imports) * 1000
+    assert import_ms <= WEB_IMPORT_BUDGET_MS, f"import {WEB_MODULE}: {import_ms:.0f}ms, budget {WEB_IMPORT_BUDGET_MS:.0f}ms"
+
+
+@pytest.mark.parametrize("module", WORKER_ONLY_MODULES)
+def test_web_import_leaves_out_worker_modules(web_imports, module):
+    assert module not in web_imports[0]["modules"], f"{module} imported by {WEB_MODULE}"